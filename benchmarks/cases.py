@@ -0,0 +1,257 @@
+"""
+Benchmark cases for the hot paths of the queue and process modes.
+
+Each case is set up for one form type with a number of generated submissions, and returns the items to work on and
+a function that handles one batch of them. Batches are what the code handles at a time in production - a fetch batch
+in the queue mode, a work item in the process mode - so their latencies are comparable across releases.
+"""
+
+import json
+import os
+
+from collections.abc import Callable
+from dataclasses import dataclass
+from io import BytesIO
+
+from helpers import config, form_transform, helper_functions, payload_codec
+from helpers.config import WEBFORMS_CONFIG
+
+from benchmarks import generator
+
+SHEET_NAME = "Besvarelser"
+
+
+@dataclass
+class Case:
+    """The items of a benchmark case, and the function handling one batch of them"""
+
+    items: list
+    run: Callable[[list], object]
+    batch_size: int
+
+
+def transform_reference(form_type: str, mapping: dict, count: int, _workdir: str) -> Case:
+    """transform_form_submission, one submission at a time."""
+
+    submissions = generator.generate_submissions(form_type, mapping, count)
+
+    def run(batch):
+        return [helper_functions.transform_form_submission(serial, form, mapping) for serial, form in batch]
+
+    return Case(submissions, run, config.FORMS_FETCH_BATCH_SIZE)
+
+
+def transform_compiled(form_type: str, mapping: dict, count: int, _workdir: str) -> Case:
+    """The compiled batch transform used by the queue mode, verified against transform_form_submission."""
+
+    submissions = generator.generate_submissions(form_type, mapping, count)
+    compiled = form_transform.compile_mapping(mapping)
+
+    sample = submissions[:config.FORMS_FETCH_BATCH_SIZE]
+    expected = [helper_functions.transform_form_submission(serial, form, mapping) for serial, form in sample]
+    actual = form_transform.transform_to_rows(compiled, sample)
+
+    if [list(row.items()) for row in expected] != [list(row.items()) for row in actual]:
+        raise AssertionError(f"{form_type}: compiled transform output differs from transform_form_submission")
+
+    def run(batch):
+        return form_transform.transform_to_rows(compiled, batch)
+
+    return Case(submissions, run, config.FORMS_FETCH_BATCH_SIZE)
+
+
+def parse_forms(form_type: str, mapping: dict, count: int, workdir: str) -> Case:
+    """The parse loop of iter_multi_forms_data over a SQLite journalizing view, fetching whole form_data documents."""
+
+    return _parse_case(form_type, mapping, count, workdir, projected=False)
+
+
+def parse_forms_projected(form_type: str, mapping: dict, count: int, workdir: str) -> Case:
+    """The parse loop of iter_multi_forms_data over a SQLite journalizing view, with projection pushdown."""
+
+    return _parse_case(form_type, mapping, count, workdir, projected=True)
+
+
+def serial_set_from_workbook(form_type: str, mapping: dict, count: int, _workdir: str) -> Case:
+    """Reading the serial numbers of an existing workbook, the serial set the queue mode diffs against."""
+
+    # Imported here, so cases that do not read workbooks do not load openpyxl
+    from helpers import serial_index  # pylint: disable=import-outside-toplevel
+
+    excel_file = _write_excel(_rows(form_type, mapping, count), list(form_transform.compile_mapping(mapping).columns))
+
+    def run(_batch):
+        return serial_index.read_serial_column(excel_file, SHEET_NAME)
+
+    # The whole workbook is read at once, but throughput is still counted per submission
+    return Case([None] * count, run, count)
+
+
+def serial_diff(form_type: str, mapping: dict, count: int, _workdir: str) -> Case:
+    """Diffing streamed submissions against a serial set holding 90% of them, and transforming the new ones."""
+
+    from processes import queue_handler  # pylint: disable=import-outside-toplevel
+
+    submissions = generator.generate_submissions(form_type, mapping, count)
+    known_serials = {serial for serial, _ in submissions if serial % 10 != 0}
+    form_config = WEBFORMS_CONFIG.get(form_type, {"formular_mapping": mapping})
+
+    def run(batch):
+        form_run = queue_handler.FormQueueRun(
+            os2_webform_id=form_type,
+            form_config=form_config,
+            formular_mapping=mapping,
+            serial_set=known_serials,
+        )
+
+        for form_id, (_, form) in enumerate(batch):
+            queue_handler._add_submission(form_run, form, {"form_id": form_id})  # pylint: disable=protected-access
+
+        queue_handler._transform_pending_forms(form_run)  # pylint: disable=protected-access
+
+        return form_run.new.rows
+
+    return Case(submissions, run, config.FORMS_FETCH_BATCH_SIZE)
+
+
+def queue_items(form_type: str, mapping: dict, count: int, _workdir: str) -> Case:
+    """
+    Chunking new submissions into work items, encoding them, ordering the items with create_sort_key like
+    concurrent_add does, and serializing them like the ATS client does before sending.
+    """
+
+    from processes import queue_handler  # pylint: disable=import-outside-toplevel
+
+    rows = _rows(form_type, mapping, count)
+    columns = form_transform.compile_mapping(mapping).columns
+
+    def run(batch):
+        items = []
+
+        for chunk in queue_handler.chunk_submissions(batch):
+            serials = [row["Serial number"] for row in chunk]
+
+            items.append({
+                "reference": f"{form_type}_{min(serials)}-{max(serials)}",
+                "data": {"submissions": payload_codec.encode_submissions(chunk, columns)},
+            })
+
+        return [
+            json.dumps({"item": item}, ensure_ascii=False, default=str)
+            for item in sorted(items, key=queue_handler.create_sort_key)
+        ]
+
+    # All new submissions of a run are turned into work items at once
+    return Case(rows, run, count)
+
+
+def xlsx_pandas(form_type: str, mapping: dict, count: int, _workdir: str) -> Case:
+    """The DataFrame to xlsx create path of process_item, one workbook per work item."""
+
+    rows = _rows(form_type, mapping, count)
+    columns = list(form_transform.compile_mapping(mapping).columns)
+
+    def run(batch):
+        return _write_excel(batch, columns)
+
+    return Case(rows, run, config.WORK_ITEM_MAX_SUBMISSIONS)
+
+
+def xlsx_merge(form_type: str, mapping: dict, count: int, _workdir: str) -> Case:
+    """The merge mode create path of process_item, one formatted workbook per work item."""
+
+    # Imported here, so cases that do not merge do not load openpyxl or the Sharepoint client
+    from openpyxl import Workbook  # pylint: disable=import-outside-toplevel
+
+    from helpers import workbook_merge  # pylint: disable=import-outside-toplevel
+
+    rows = _rows(form_type, mapping, count)
+    columns = list(form_transform.compile_mapping(mapping).columns)
+
+    def run(batch):
+        workbook = Workbook()
+        worksheet = workbook.active
+        worksheet.title = SHEET_NAME
+        worksheet.append(columns)
+
+        workbook_merge.merge_rows(worksheet, batch)
+
+        excel_stream = BytesIO()
+        workbook.save(excel_stream)
+
+        return excel_stream
+
+    return Case(rows, run, config.WORK_ITEM_MAX_SUBMISSIONS)
+
+
+def payload_roundtrip(form_type: str, mapping: dict, count: int, _workdir: str) -> Case:
+    """Encoding a work item's submissions in the configured format, and reading them back as the process mode does."""
+
+    rows = _rows(form_type, mapping, count)
+    columns = list(form_transform.compile_mapping(mapping).columns)
+
+    def run(batch):
+        encoded = json.loads(json.dumps(payload_codec.encode_submissions(batch, columns), ensure_ascii=False))
+
+        return payload_codec.submission_rows(payload_codec.decode_submissions(encoded))
+
+    return Case(rows, run, config.WORK_ITEM_MAX_SUBMISSIONS)
+
+
+CASES = {
+    "transform_reference": transform_reference,
+    "transform_compiled": transform_compiled,
+    "parse_forms": parse_forms,
+    "parse_forms_projected": parse_forms_projected,
+    "serial_set_from_workbook": serial_set_from_workbook,
+    "serial_diff": serial_diff,
+    "queue_items": queue_items,
+    "xlsx_pandas": xlsx_pandas,
+    "xlsx_merge": xlsx_merge,
+    "payload_roundtrip": payload_roundtrip,
+}
+
+
+def _parse_case(form_type: str, mapping: dict, count: int, workdir: str, projected: bool) -> Case:
+    from helpers import query_builder  # pylint: disable=import-outside-toplevel
+
+    db_path = os.path.join(workdir, f"{form_type}.db")
+    conn_string = generator.write_journalizing_db(db_path, {form_type: (mapping, count)})
+
+    form_projections = None
+
+    if projected:
+        include_attachments = bool(WEBFORMS_CONFIG.get(form_type, {}).get("upload_pdfs_to_sharepoint_folder_name"))
+        form_projections = {form_type: query_builder.projected_data_keys(mapping, include_attachments)}
+
+    def run(_batch):
+        submissions = helper_functions.iter_multi_forms_data(
+            conn_string,
+            {form_type: None},
+            form_projections=form_projections,
+        )
+
+        return sum(1 for _ in submissions)
+
+    # The whole view is scanned in one query, but throughput is still counted per submission
+    return Case([None] * count, run, count)
+
+
+def _rows(form_type: str, mapping: dict, count: int) -> list[dict]:
+    compiled = form_transform.compile_mapping(mapping)
+
+    return form_transform.transform_to_rows(compiled, generator.generate_submissions(form_type, mapping, count))
+
+
+def _write_excel(rows: list[dict], columns: list[str]) -> bytes:
+    import pandas as pd  # pylint: disable=import-outside-toplevel
+
+    excel_stream = BytesIO()
+    pd.DataFrame(payload_codec.submission_columns(rows, columns), columns=columns).to_excel(
+        excel_stream,
+        index=False,
+        engine="openpyxl",
+        sheet_name=SHEET_NAME,
+    )
+
+    return excel_stream.getvalue()
@@ -0,0 +1,66 @@
+"""
+Module for injecting latency, throttling and failures into the local backends, for load testing.
+
+Faults are configured per backend ("sqlite", "sharepoint", "ats", "smtp") as JSON in FAULTS_ENV, e.g.
+{"sharepoint": {"latency_seconds": 0.05, "throttle_rate": 0.1, "retry_after_seconds": 1, "failure_rate": 0.01}}.
+Every call to a local backend first waits the latency, then is throttled or failed at the configured rates.
+"""
+
+import json
+import logging
+import os
+import random
+import time
+
+from dataclasses import dataclass
+
+logger = logging.getLogger(__name__)
+
+FAULTS_ENV = "FORMULARDATA_LOCAL_BACKEND_FAULTS"
+
+THROTTLE = "throttle"
+FAILURE = "failure"
+
+
+@dataclass
+class Faults:
+    """Latency, and rates of throttled and failed calls, for one backend"""
+
+    latency_seconds: float = 0.0
+    latency_jitter_seconds: float = 0.0  # added uniformly at random to latency_seconds
+    throttle_rate: float = 0.0  # share of calls answered with 429 and a Retry-After of retry_after_seconds
+    retry_after_seconds: float = 1.0
+    failure_rate: float = 0.0  # share of calls failing with a server error
+
+    def inject(self) -> str | None:
+        """Wait the latency of one call, and return THROTTLE or FAILURE if the call is to be throttled or failed."""
+
+        latency = self.latency_seconds + random.uniform(0, self.latency_jitter_seconds)
+
+        if latency > 0:
+            time.sleep(latency)
+
+        draw = random.random()
+
+        if draw < self.throttle_rate:
+            return THROTTLE
+
+        if draw < self.throttle_rate + self.failure_rate:
+            return FAILURE
+
+        return None
+
+
+def for_backend(backend: str) -> Faults:
+    """
+    Return the faults configured in FAULTS_ENV for a local backend - none if it has no entry,
+    or if the configuration cannot be read.
+    """
+
+    try:
+        return Faults(**json.loads(os.getenv(FAULTS_ENV) or "{}").get(backend, {}))
+
+    except (AttributeError, TypeError, ValueError) as e:
+        logger.warning(f"Ignoring invalid {FAULTS_ENV} for the '{backend}' backend: {e}")
+
+        return Faults()
@@ -0,0 +1,175 @@
+"""
+Generator of synthetic OS2Forms submissions, shaped like the form_data documents in the journalizing view.
+
+Every key of a formular mapping gets an answer - nested table questions get an answer per row - mixing the shapes
+seen in production: plain choices, free text, multiline answers, list-literal strings and real lists. Submissions
+also carry unmapped fields, a PDF attachment and entity metadata, so projections and parsing do realistic work.
+"""
+
+import itertools
+import json
+import os
+import random
+import sqlite3
+
+from collections.abc import Iterator
+from contextlib import closing
+from datetime import datetime, timedelta
+
+from helpers import formular_mappings
+
+CHOICES = ["Helt enig", "Enig", "Hverken enig eller uenig", "Uenig", "Helt uenig", "Ja", "Nej", "Ved ikke"]
+
+FREE_TEXTS = [
+    "Forløbet har været godt, og barnet er kommet videre i skolen.",
+    "Vi har haft et fint samarbejde med både forældre og lærere omkring trivslen.",
+    "Ingen bemærkninger.",
+    'Forælderen sagde "det har hjulpet meget" til det sidste møde.',
+]
+
+MULTILINE_TEXTS = [
+    "Første punkt\nAndet punkt\nTredje punkt",
+    "Samtalen gik godt.\r\nVi aftalte opfølgning om fire uger.",
+]
+
+LIST_LITERALS = ["['Skole', 'SFO']", "['Forældre']", '["Sundhedsplejerske", "PPR"]', "[]"]
+
+LISTS = [["Skole", "SFO"], ["Klub"], []]
+
+UNMAPPED_FIELDS = {
+    "actions": "submit",
+    "consent": "1",
+    "os2forms_nemid_cpr": "0101011234",
+    "langt_svar_som_ikke_eksporteres": "Lorem ipsum dolor sit amet " * 20,
+}
+
+START_DATE = datetime(2024, 1, 1, 8, 0, 0)
+
+INSERT_BATCH_SIZE = 10_000
+
+
+def all_mappings() -> dict[str, dict]:
+    """Return every formular mapping in formular_mappings, keyed by form type (the name without "_mapping")."""
+
+    return {
+        name.removesuffix("_mapping"): mapping
+        for name, mapping in vars(formular_mappings).items()
+        if name.endswith("_mapping") and isinstance(mapping, dict)
+    }
+
+
+def generate_answer(rng: random.Random):
+    """Return an answer in one of the shapes submissions contain, weighted towards plain choices."""
+
+    shape = rng.random()
+
+    if shape < 0.55:
+        return rng.choice(CHOICES)
+
+    if shape < 0.7:
+        return rng.choice(FREE_TEXTS)
+
+    if shape < 0.8:
+        return rng.choice(MULTILINE_TEXTS)
+
+    if shape < 0.9:
+        return rng.choice(LIST_LITERALS)
+
+    if shape < 0.95:
+        return list(rng.choice(LISTS))
+
+    return ""
+
+
+def generate_form_data(form_type: str, mapping: dict, serial: int, rng: random.Random) -> dict:
+    """Return a form_data document for a submission with the given serial number."""
+
+    data = dict(UNMAPPED_FIELDS)
+
+    for source_key, target in mapping.items():
+        # A few optional questions are left out, like unanswered questions are
+        if rng.random() < 0.03:
+            continue
+
+        if isinstance(target, dict):
+            data[source_key] = {nested_key: generate_answer(rng) for nested_key in target}
+
+        else:
+            data[source_key] = generate_answer(rng)
+
+    data["attachments"] = {
+        "besvarelse_i_pdf_format": {"url": f"https://selvbetjening.example.dk/system/files/{form_type}/{serial}.pdf"},
+    }
+
+    created = START_DATE + timedelta(minutes=37 * serial)
+    completed = created + timedelta(seconds=rng.randint(30, 3600))
+
+    return {
+        "data": data,
+        "entity": {
+            "uuid": [{"value": f"00000000-0000-4000-8000-{serial:012d}"}],
+            "serial": [{"value": serial}],
+            "created": [{"value": created.isoformat() + "+02:00"}],
+            "completed": [{"value": completed.isoformat() + "+02:00"}],
+            "webform_id": [{"target_id": form_type}],
+        },
+    }
+
+
+def iter_submissions(form_type: str, mapping: dict, count: int, seed: int = 0) -> Iterator[tuple[int, dict]]:
+    """Yield (serial, form_data) tuples for count submissions, newest (highest serial) first."""
+
+    rng = random.Random(f"{seed}/{form_type}")
+
+    for serial in range(count, 0, -1):
+        yield serial, generate_form_data(form_type, mapping, serial, rng)
+
+
+def generate_submissions(form_type: str, mapping: dict, count: int, seed: int = 0) -> list[tuple[int, dict]]:
+    """Return (serial, form_data) tuples for count submissions, newest (highest serial) first."""
+
+    return list(iter_submissions(form_type, mapping, count, seed))
+
+
+def write_journalizing_db(path: str, form_counts: dict[str, tuple[dict, int]], seed: int = 0) -> str:
+    """
+    Write a SQLite stand-in for the journalizing view, with count submissions per form type.
+    form_counts maps each form type to its (formular mapping, count). Returns the SQLAlchemy URL of the database.
+    """
+
+    if os.path.exists(path):
+        os.remove(path)
+
+    # The connection commits the inserts on exit, and closing() closes it
+    with closing(sqlite3.connect(path)) as conn:
+        with conn:
+            conn.execute(
+                "CREATE TABLE view_Journalizing "
+                "(form_id INTEGER PRIMARY KEY, form_type TEXT, form_data TEXT, form_submitted_date TEXT)"
+            )
+
+            form_ids = itertools.count(1)
+
+            for form_type, (mapping, count) in form_counts.items():
+                submissions = iter_submissions(form_type, mapping, count, seed)
+
+                # Inserted in batches, so large volumes are never held in memory at once
+                while batch := list(itertools.islice(submissions, INSERT_BATCH_SIZE)):
+                    conn.executemany(
+                        "INSERT INTO view_Journalizing VALUES (?, ?, ?, ?)",
+                        [_journalizing_row(next(form_ids), form_type, serial, form_data) for serial, form_data in batch],
+                    )
+
+            conn.execute("CREATE INDEX ix_form_type_date ON view_Journalizing (form_type, form_submitted_date)")
+
+    return f"sqlite:///{path}"
+
+
+def _journalizing_row(form_id: int, form_type: str, serial: int, form_data: dict) -> tuple:
+    # A small share of submissions is purged, and filtered by the queries
+    if serial % 50 == 0:
+        form_data = {"purged": True}
+
+    submitted = (START_DATE + timedelta(minutes=37 * serial)).isoformat(sep=" ")
+
+    return form_id, form_type, json.dumps(form_data, ensure_ascii=False), submitted
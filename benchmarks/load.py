@@ -0,0 +1,185 @@
+"""
+Offline end-to-end load test of main.py --queue and --process, against local stand-ins for every backend.
+
+Generated submissions are written to a SQLite journalizing view, workbooks are written to a local SharePoint folder
+(benchmarks.local_sharepoint), the workqueue is served by a local Automation Server (benchmarks.local_ats_server),
+and error mails go to a local SMTP server (benchmarks.local_smtp_server). Each mode runs main.py in a subprocess
+through benchmarks.local_main, with exactly the configuration a deployment would use, pointed at the stand-ins, and
+the results - wall time, throughput, item statuses, rows written, requests per endpoint and error mails - are
+written as JSON.
+
+Run from the repository root:
+    python -m benchmarks.load [--count 10000] [--forms sundung_aarhus ...]
+        [--faults '{"ats": {"throttle_rate": 0.05}, "sharepoint": {"latency_seconds": 0.02}, "smtp": {...}}']
+
+Purged submissions (every 50th) are never written, so rows_written is slightly below the submission count.
+Forms that upload PDFs need OS2Forms and its API key, so they are only included if given with --forms.
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from datetime import datetime
+
+from helpers import serial_index
+from helpers.config import WEBFORMS_CONFIG
+
+from benchmarks import fault_injection, generator
+from benchmarks.local_main import LOCAL_SHAREPOINT_DIR_ENV
+from benchmarks.local_ats_server import PROCESS_ID, WORKQUEUE_ID, LocalAtsServer
+from benchmarks.local_smtp_server import LocalSmtpServer
+from processes.queue_handler import SHAREPOINT_DOCUMENT_LIBRARY, SHEET_NAME
+
+REPOSITORY_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def main() -> None:
+    """Run the load test and write its results."""
+
+    parser = argparse.ArgumentParser(description="Offline end-to-end load test against local backends")
+    parser.add_argument("--count", type=int, default=10_000, help="submissions per form type")
+    parser.add_argument("--forms", nargs="+", choices=list(WEBFORMS_CONFIG), default=None)
+    parser.add_argument(
+        "--faults", type=json.loads, default={}, help="faults per backend: sqlite, sharepoint, ats, smtp"
+    )
+    parser.add_argument("--workdir", default=None, help="keep the generated data and workbooks in this folder")
+    parser.add_argument("--output", default="load_test_results.json")
+    args = parser.parse_args()
+
+    form_types = args.forms or [
+        form_type for form_type, form_config in WEBFORMS_CONFIG.items()
+        if not form_config.get("upload_pdfs_to_sharepoint_folder_name")
+    ]
+
+    if args.workdir:
+        os.makedirs(args.workdir, exist_ok=True)
+        results = run_load_test(args.workdir, form_types, args.count, args.faults)
+
+    else:
+        with tempfile.TemporaryDirectory() as workdir:
+            results = run_load_test(workdir, form_types, args.count, args.faults)
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+
+    print(f"Results written to {args.output}")
+
+
+def run_load_test(workdir: str, form_types: list[str], count: int, faults: dict) -> dict:
+    """Run the queue mode and then the process mode, and return the results."""
+
+    generator.write_journalizing_db(
+        os.path.join(workdir, "journalizing.db"),
+        {form_type: (WEBFORMS_CONFIG[form_type]["formular_mapping"], count) for form_type in form_types},
+    )
+
+    server = LocalAtsServer(fault_injection.Faults(**faults.get("ats", {}))).start()
+    smtp_server = LocalSmtpServer(fault_injection.Faults(**faults.get("smtp", {}))).start()
+
+    try:
+        env = _environment(workdir, server.url, smtp_server.address, faults)
+
+        queue_seconds, queue_exit_code = _run_mode(env, "--queue", form_types)
+        items_queued = sum(server.status_counts().values())
+
+        process_seconds, process_exit_code = _run_mode(env, "--process", form_types)
+
+    finally:
+        server.stop()
+        smtp_server.stop()
+
+    rows_written = _rows_written(workdir, form_types)
+    submissions = count * len(form_types)
+
+    print(
+        f"{submissions} submissions in {items_queued} items - queue {queue_seconds:.1f}s (exit code {queue_exit_code}), "
+        f"process {process_seconds:.1f}s (exit code {process_exit_code}), {submissions / (queue_seconds + process_seconds):,.0f} submissions/s, "
+        f"item statuses {server.status_counts()}, {sum(rows_written.values())} rows written, "
+        f"{len(smtp_server.messages)} error mails"
+    )
+
+    return {
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "forms": form_types,
+        "count": count,
+        "faults": faults,
+        "submissions": submissions,
+        "queue_seconds": queue_seconds,
+        "queue_exit_code": queue_exit_code,
+        "process_seconds": process_seconds,
+        "process_exit_code": process_exit_code,
+        "submissions_per_second": submissions / (queue_seconds + process_seconds),
+        "items_queued": items_queued,
+        "item_statuses": server.status_counts(),
+        "rows_written": rows_written,
+        "ats_requests": dict(sorted(server.stats.items())),
+        "error_mails": [str(message["subject"]) for message in smtp_server.messages],
+        "smtp_commands": dict(sorted(smtp_server.stats.items())),
+    }
+
+
+def _environment(workdir: str, ats_url: str, smtp_address: str, faults: dict) -> dict:
+    env = dict(os.environ)
+
+    env.update({
+        "DBCONNECTIONSTRINGPROD": f"sqlite:///{os.path.join(workdir, 'journalizing.db')}",
+        "FORMULARDATA_STATE_DIR": os.path.join(workdir, "state"),
+        LOCAL_SHAREPOINT_DIR_ENV: os.path.join(workdir, "sharepoint"),
+        fault_injection.FAULTS_ENV: json.dumps(faults),
+        "FORMULARDATA_MAIL_BACKEND": "local",
+        "FORMULARDATA_LOCAL_SMTP_ADDRESS": smtp_address,
+        "ATS_URL": ats_url,
+        "ATS_TOKEN": "load-test",
+        "OPENORCHESTRATORKEY": "load-test",  # encrypts the SharePoint file cache
+        "ATS_SESSION": "1",
+        "ATS_RESOURCE": "1",
+        "ATS_PROCESS": str(PROCESS_ID),
+        "ATS_WORKQUEUE": str(WORKQUEUE_ID),
+    })
+
+    return env
+
+
+def _run_mode(env: dict, mode: str, form_types: list[str]) -> tuple[float, int]:
+    # A mode failing under injected faults is a result too, so its exit code is returned instead of raised
+    started = time.perf_counter()
+
+    completed = subprocess.run(
+        [sys.executable, "-m", "benchmarks.local_main", mode, *(f"--{form_type}" for form_type in form_types)],
+        cwd=REPOSITORY_ROOT,
+        env=env,
+        check=False,
+    )
+
+    return time.perf_counter() - started, completed.returncode
+
+
+def _rows_written(workdir: str, form_types: list[str]) -> dict[str, int]:
+    # Counted from the serial numbers in each workbook, so duplicated rows are not counted twice
+    rows = {}
+
+    for form_type in form_types:
+        form_config = WEBFORMS_CONFIG[form_type]
+        path = os.path.join(
+            workdir, "sharepoint", "Teams", form_config["site_name"], SHAREPOINT_DOCUMENT_LIBRARY,
+            *form_config["folder_name"].split("/"), form_config["excel_file_name"],
+        )
+
+        if not os.path.exists(path):
+            rows[form_type] = 0
+
+            continue
+
+        with open(path, "rb") as f:
+            rows[form_type] = len(serial_index.read_serial_column(f.read(), SHEET_NAME))
+
+    return rows
+
+
+if __name__ == "__main__":
+    main()
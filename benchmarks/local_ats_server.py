@@ -0,0 +1,292 @@
+"""
+Local HTTP stand-in for the Automation Server workqueue API, for load testing without the production server.
+
+Point ATS_URL at it to select it. Workqueues and their items are kept in memory, and it answers the endpoints used
+by this process and by automation_server_client: sessions, processes and workqueues, adding items (one by one, or
+in bulk at /workqueues/{id}/add_bulk), paging items, next_item, and item status and data updates. Faults
+(see benchmarks.fault_injection) are injected into every request - throttled requests get a 429 with Retry-After.
+
+Run on its own with:
+    python -m benchmarks.local_ats_server [--port 8000] [--faults '{"latency_seconds": 0.02, "throttle_rate": 0.05}']
+"""
+
+import argparse
+import json
+import re
+import threading
+
+from collections import Counter
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlsplit
+
+from benchmarks import fault_injection
+
+PROCESS_ID = 1
+WORKQUEUE_ID = 1
+
+
+class LocalAtsServer(ThreadingHTTPServer):
+    """In-memory Automation Server, serving requests on a background thread once started"""
+
+    daemon_threads = True
+
+    def __init__(self, faults: fault_injection.Faults | None = None, port: int = 0, newest_first: bool = False):
+        super().__init__(("127.0.0.1", port), _RequestHandler)
+
+        self.faults = faults or fault_injection.Faults()
+        self.newest_first = newest_first  # page items newest first, instead of in the order they were added
+        self.lock = threading.Lock()
+        self.items: dict[int, dict] = {}
+        self.queues: dict[int, list[int]] = {}
+        self.next_positions: dict[int, int] = {}  # items before this position in a queue are no longer new
+        self.stats: Counter = Counter()
+
+    @property
+    def url(self) -> str:
+        """The base url to set as ATS_URL."""
+
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def start(self) -> "LocalAtsServer":
+        """Serve requests on a background thread."""
+
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+        return self
+
+    def stop(self) -> None:
+        """Stop serving and close the socket."""
+
+        self.shutdown()
+        self.server_close()
+
+    def add_item(self, workqueue_id: int, reference: str, data) -> dict:
+        """Add an item to a workqueue, with its data parsed if it was sent as a JSON string."""
+
+        now = datetime.now().isoformat()
+
+        with self.lock:
+            item = {
+                "id": len(self.items) + 1,
+                "workqueue_id": workqueue_id,
+                "reference": reference,
+                "data": json.loads(data) if isinstance(data, str) else data,
+                "status": "new",
+                "message": "",
+                "locked": False,
+                "created_at": now,
+                "updated_at": now,
+            }
+
+            self.items[item["id"]] = item
+            self.queues.setdefault(workqueue_id, []).append(item["id"])
+
+        return item
+
+    def remove_item(self, item_id: int) -> None:
+        """Delete an item, like deleting it in the Automation Server UI."""
+
+        with self.lock:
+            item = self.items.pop(item_id)
+            queue = self.queues[item["workqueue_id"]]
+            position = queue.index(item_id)
+
+            del queue[position]
+
+            # Keep next_item at the same next item
+            if position < self.next_positions.get(item["workqueue_id"], 0):
+                self.next_positions[item["workqueue_id"]] -= 1
+
+    def status_counts(self) -> dict[str, int]:
+        """Return the number of items per status, over all workqueues."""
+
+        with self.lock:
+            return dict(Counter(item["status"] for item in self.items.values()))
+
+
+class _RequestHandler(BaseHTTPRequestHandler):
+    server: LocalAtsServer
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        pass
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        self._handle("GET")
+
+    def do_POST(self):  # pylint: disable=invalid-name
+        self._handle("POST")
+
+    def do_PUT(self):  # pylint: disable=invalid-name
+        self._handle("PUT")
+
+    def _handle(self, method: str) -> None:
+        length = int(self.headers.get("Content-Length") or 0)
+        body = json.loads(self.rfile.read(length)) if length else None
+
+        url = urlsplit(self.path)
+        outcome = self.server.faults.inject()
+
+        headers = None
+
+        if outcome == fault_injection.THROTTLE:
+            status, response_body = 429, {"detail": "Too many requests"}
+            headers = {"Retry-After": str(self.server.faults.retry_after_seconds)}
+
+        elif outcome == fault_injection.FAILURE:
+            status, response_body = 500, {"detail": "Injected failure"}
+
+        else:
+            status, response_body = _route(self.server, method, url.path, parse_qs(url.query), body)
+
+        # Counted before the response is sent, so a client reading the stats after a response sees its request
+        self.server.stats[f"{method} {_endpoint(url.path)} {status}"] += 1
+
+        self._send(status, response_body, headers)
+
+    def _send(self, status: int, body, headers: dict | None = None) -> None:
+        content = json.dumps(body).encode("utf-8") if body is not None else b""
+
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(content)))
+
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+
+        self.end_headers()
+        self.wfile.write(content)
+
+
+def _route(server: LocalAtsServer, method: str, path: str, query: dict, body) -> tuple[int, object]:
+    # pylint: disable=too-many-return-statements
+    parts = [unquote(part) for part in path.strip("/").split("/")]
+
+    match method, parts:
+        case "GET", ["sessions", session_id]:
+            return 200, {
+                "id": int(session_id),
+                "process_id": PROCESS_ID,
+                "resource_id": 1,
+                "status": "in progress",
+                "parameters": "",
+                "dispatched_at": datetime.now().isoformat(),
+            }
+
+        case "GET", ["processes", process_id]:
+            return 200, {
+                "id": int(process_id),
+                "name": "Formulardata load test",
+                "description": "",
+                "requirements": "",
+                "target_type": "python",
+                "target_source": "",
+                "target_credentials_id": None,
+                "workqueue_id": WORKQUEUE_ID,
+            }
+
+        case "GET", ["workqueues", workqueue_id]:
+            return 200, {"id": int(workqueue_id), "name": "Formulardata load test", "description": "", "enabled": True}
+
+        case "POST", ["workqueues", workqueue_id, "add"]:
+            return 200, server.add_item(int(workqueue_id), body.get("reference"), body.get("data"))
+
+        case "POST", ["workqueues", workqueue_id, "add_bulk"]:
+            return 200, [server.add_item(int(workqueue_id), item.get("reference"), item.get("data")) for item in body]
+
+        case "GET", ["workqueues", workqueue_id, "items"]:
+            page, size = int(query.get("page", ["1"])[0]), int(query.get("size", ["100"])[0])
+
+            with server.lock:
+                item_ids = server.queues.get(int(workqueue_id), [])
+
+                if server.newest_first:
+                    item_ids = item_ids[::-1]
+
+                items = [server.items[item_id] for item_id in item_ids[(page - 1) * size:page * size]]
+
+                return 200, {"items": items, "total_items": len(item_ids), "page": page, "size": size}
+
+        case "GET", ["workqueues", workqueue_id, "by_reference", reference]:
+            with server.lock:
+                items = [server.items[item_id] for item_id in server.queues.get(int(workqueue_id), [])]
+
+                return 200, [item for item in items if item["reference"] == reference]
+
+        case "GET", ["workqueues", workqueue_id, "next_item"]:
+            with server.lock:
+                item_ids = server.queues.get(int(workqueue_id), [])
+                position = server.next_positions.get(int(workqueue_id), 0)
+
+                while position < len(item_ids):
+                    item = server.items[item_ids[position]]
+                    position += 1
+                    server.next_positions[int(workqueue_id)] = position
+
+                    if item["status"] == "new":
+                        item.update(status="in progress", locked=True, started_at=datetime.now().isoformat())
+
+                        return 200, item
+
+            return 204, None
+
+        case "PUT", ["workitems", item_id, "status"]:
+            with server.lock:
+                item = server.items.get(int(item_id))
+
+                if item is None:
+                    return 404, {"detail": "Item not found"}
+
+                item.update(
+                    status=body.get("status"),
+                    message=body.get("message", ""),
+                    locked=False,
+                    updated_at=datetime.now().isoformat(),
+                )
+
+                return 200, item
+
+        case "PUT", ["workitems", item_id]:
+            with server.lock:
+                item = server.items.get(int(item_id))
+
+                if item is None:
+                    return 404, {"detail": "Item not found"}
+
+                item.update({key: value for key, value in body.items() if key in ("data", "reference")})
+
+                return 200, item
+
+        case "POST", ["audit-logs"]:
+            return 204, None
+
+    return 404, {"detail": f"No route for {method} {path}"}
+
+
+def _endpoint(path: str) -> str:
+    # Statistics are kept per endpoint, not per id
+    return re.sub(r"/\d+(?=/|$)", "/{id}", re.sub(r"/by_reference/.*$", "/by_reference/{reference}", path))
+
+
+def main() -> None:
+    """Serve the local Automation Server until interrupted."""
+
+    parser = argparse.ArgumentParser(description="Local stand-in for the Automation Server workqueue API")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--faults", type=json.loads, default={}, help="fault_injection.Faults fields as JSON")
+    args = parser.parse_args()
+
+    server = LocalAtsServer(fault_injection.Faults(**args.faults), args.port)
+    print(f"Serving a local Automation Server at {server.url}")
+
+    try:
+        server.serve_forever()
+
+    except KeyboardInterrupt:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""
+Runner of main.py against the local stand-ins, used by the load test for every mode.
+
+The stand-ins are swapped in from here, so the process itself has no knowledge of them: the SharePoint client pool
+hands out LocalSharepoint clients (benchmarks.local_sharepoint) storing files under LOCAL_SHAREPOINT_DIR_ENV,
+the REST calls of helpers.sharepoint_rest are answered by those clients, and the faults configured in
+fault_injection.FAULTS_ENV are injected into the queries of SQLite engines. The journalizing view, workqueue and
+mail server are pointed at their stand-ins by the environment alone (see benchmarks.load).
+
+Run from the repository root, with the arguments of main.py:
+    python -m benchmarks.local_main --queue --sundung_aarhus
+"""
+
+import functools
+import os
+import runpy
+import sqlite3
+import sys
+import time
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from helpers import config, sharepoint_pool, sharepoint_rest
+
+from benchmarks import fault_injection
+from benchmarks.local_sharepoint import LocalSharepoint
+
+REPOSITORY_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+LOCAL_SHAREPOINT_DIR_ENV = "FORMULARDATA_LOCAL_SHAREPOINT_DIR"
+
+
+def main() -> None:
+    """Swap in the stand-ins and run main.py with the given arguments."""
+
+    install_local_backends(os.getenv(LOCAL_SHAREPOINT_DIR_ENV) or os.path.join(config.STATE_DIR, "local_sharepoint"))
+
+    sys.argv = ["main.py", *sys.argv[1:]]
+    runpy.run_path(os.path.join(REPOSITORY_ROOT, "main.py"), run_name="__main__")
+
+
+def install_local_backends(sharepoint_dir: str) -> None:
+    """Replace the SharePoint clients with LocalSharepoint clients under sharepoint_dir, and inject the SQLite faults."""
+
+    sharepoint_pool.CachedSharepoint = functools.partial(LocalSharepoint, sharepoint_dir)
+    sharepoint_rest.send = _local_send(sharepoint_rest.send)
+
+    sqlite_faults = fault_injection.for_backend("sqlite")
+
+    @event.listens_for(Engine, "before_cursor_execute")
+    def before_cursor_execute(conn, *_):
+        if conn.engine.dialect.name != "sqlite":
+            return
+
+        outcome = sqlite_faults.inject()
+
+        # A throttled query waits, like a query queued behind others on a busy server
+        if outcome == fault_injection.THROTTLE:
+            time.sleep(sqlite_faults.retry_after_seconds)
+
+        elif outcome == fault_injection.FAILURE:
+            raise sqlite3.OperationalError("Injected database failure")
+
+
+def _local_send(send):
+    @functools.wraps(send)
+    def local_send(sharepoint_api, method: str, api_path: str, headers: dict | None = None, **kwargs):
+        if isinstance(sharepoint_api, LocalSharepoint):
+            return sharepoint_api.handle_request(method, api_path, headers or {}, kwargs.get("data"))
+
+        return send(sharepoint_api, method, api_path, headers, **kwargs)
+
+    return local_send
+
+
+if __name__ == "__main__":
+    main()
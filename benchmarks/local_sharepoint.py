@@ -0,0 +1,279 @@
+"""
+Module for a filesystem stand-in of a SharePoint site, swapped in for CachedSharepoint by benchmarks.local_main.
+
+Files are kept under a root folder at their server relative url, e.g.
+<root>/Teams/<site>/Delte dokumenter/<folder>/<file>. LocalSharepoint implements the file
+operations of the Sharepoint class on those files, so append_row_to_sharepoint_excel and format_and_sort_excel_file
+run unchanged on top of them, and answers the REST calls of helpers.sharepoint_rest, including eTags, conditional
+requests and upload sessions. Faults configured for the "sharepoint" backend are injected into every call - like
+the Sharepoint class, its file operations print the error and return None instead of raising.
+"""
+
+import hashlib
+import http
+import json
+import os
+import re
+import threading
+import urllib.parse
+
+from datetime import datetime, timezone
+
+import requests
+
+from mbu_msoffice_integration.sharepoint_class import Sharepoint
+
+from benchmarks import fault_injection
+
+_REST_PATH = re.compile(
+    r"^/_api/web/(?P<kind>GetFolder|GetFile)ByServerRelativeUrl\((?P<url>[^)]*)\)(?P<action>[^?]*)(?:\?(?P<query>.*))?$"
+)
+_ADD_FILE = re.compile(r"^/Files/add\(url=(?P<name>[^,]*),overwrite=true\)$")
+_UPLOAD = re.compile(r"^/(?P<step>Start|Continue|Finish|Cancel)Upload\(uploadId=guid'(?P<upload_id>[^']*)'")
+
+# Writes and conditional replaces of a file are atomic towards each other
+_LOCK = threading.Lock()
+
+
+class LocalSharepoint(Sharepoint):
+    """Sharepoint client backed by files under a root folder"""
+
+    def __init__(self, root: str, site_url: str, site_name: str, document_library: str, site_type: str = "Teams", **_):
+        self.root = root
+        self.faults = fault_injection.for_backend("sharepoint")
+
+        super().__init__(
+            tenant="local",
+            client_id="local",
+            thumbprint="",
+            cert_path="",
+            site_url=site_url,
+            site_name=site_name,
+            document_library=document_library,
+            site_type=site_type,
+        )
+
+    def _auth(self):
+        # There is nothing to authenticate against - the root folder stands in for the client context
+        os.makedirs(self.root, exist_ok=True)
+
+        return self.root
+
+    def fetch_files_list(self, folder_name: str) -> list[dict] | None:
+        if self.faults.inject():
+            print(f"Error retrieving files: injected fault listing '{folder_name}'")
+
+            return None
+
+        return [{"Name": name} for name in self._file_names(self._folder_url(folder_name))]
+
+    def fetch_file_content(self, file_name: str, folder_name: str) -> bytes | None:
+        return self.fetch_file_using_open_binary(file_name, folder_name)
+
+    def fetch_file_using_open_binary(self, file_name: str, folder_name: str) -> bytes | None:
+        if self.faults.inject():
+            print(f"Failed to download file: injected fault reading '{file_name}'")
+
+            return None
+
+        return self._read(f"{self._folder_url(folder_name)}/{file_name}")
+
+    def upload_file_from_bytes(self, binary_content: bytes, file_name: str, folder_name: str):
+        if self.faults.inject():
+            print(f"Failed to upload file '{file_name}': injected fault")
+
+            return
+
+        self._write(f"{self._folder_url(folder_name)}/{file_name}", bytes(binary_content))
+        print(f"File '{file_name}' uploaded successfully to '{self._folder_url(folder_name)}'.")
+
+    def handle_request(self, method: str, api_path: str, headers: dict, data=None) -> requests.Response:
+        """Answer a REST request that helpers.sharepoint_rest.send would send to SharePoint, like SharePoint would."""
+
+        outcome = self.faults.inject()
+
+        if outcome == fault_injection.THROTTLE:
+            return _response(429, headers={"Retry-After": str(self.faults.retry_after_seconds)})
+
+        if outcome == fault_injection.FAILURE:
+            return _response(503)
+
+        match = _REST_PATH.match(api_path)
+
+        if not match:
+            return _response(400)
+
+        url = _odata_value(match["url"])
+        action = match["action"]
+        body = bytes(data) if data is not None else b""
+
+        if match["kind"] == "GetFolder":
+            return self._handle_folder_request(method, url, action, body)
+
+        return self._handle_file_request(method, url, action, match["query"] or "", headers, body)
+
+    def _handle_folder_request(self, method: str, folder_url: str, action: str, body: bytes) -> requests.Response:
+        if method == "GET" and action == "/Files":
+            files = []
+
+            for name in self._file_names(folder_url):
+                file_url = f"{folder_url}/{name}"
+                stat = os.stat(self._path(file_url))
+
+                files.append({
+                    "Name": name,
+                    "ETag": self._etag(file_url),
+                    "TimeLastModified": datetime.fromtimestamp(stat.st_mtime, timezone.utc).isoformat(),
+                    "Length": str(stat.st_size),
+                })
+
+            return _response(200, json_body={"value": files})
+
+        if method == "POST" and (add_file := _ADD_FILE.match(action)):
+            file_url = f"{folder_url}/{_odata_value(add_file['name'])}"
+            etag = self._write(file_url, body)
+
+            return _response(200, headers={"ETag": etag}, json_body={"Name": os.path.basename(file_url)})
+
+        return _response(400)
+
+    def _handle_file_request(
+        self,
+        method: str,
+        file_url: str,
+        action: str,
+        query: str,
+        headers: dict,
+        body: bytes,
+    ) -> requests.Response:
+        if upload := _UPLOAD.match(action):
+            return self._handle_upload(file_url, upload["step"], upload["upload_id"], body)
+
+        content = self._read(file_url)
+
+        if content is None:
+            return _response(404)
+
+        etag = _etag_of(content)
+
+        if method == "GET" and action == "" and "ETag" in query:
+            return _response(200, json_body={"ETag": etag})
+
+        if method == "GET" and action == "/$value":
+            if headers.get("If-None-Match") == etag:
+                return _response(304, headers={"ETag": etag})
+
+            return _response(200, content=content, headers={"ETag": etag})
+
+        if method == "POST" and action == "/$value" and headers.get("X-HTTP-Method") == "PUT":
+            with _LOCK:
+                current = self._read(file_url)
+
+                if headers.get("If-Match") not in (None, "*", _etag_of(current or b"")):
+                    return _response(412)
+
+                etag = self._write(file_url, body)
+
+            return _response(204, headers={"ETag": etag})
+
+        return _response(400)
+
+    def _handle_upload(self, file_url: str, step: str, upload_id: str, body: bytes) -> requests.Response:
+        # Chunks of an upload session are collected in a file next to the target, and moved into place when finished
+        upload_path = f"{self._path(file_url)}.upload-{upload_id}"
+
+        if step == "Cancel":
+            if os.path.exists(upload_path):
+                os.remove(upload_path)
+
+            return _response(200)
+
+        if step != "Start" and not os.path.exists(upload_path):
+            return _response(404)
+
+        with open(upload_path, "wb" if step == "Start" else "ab") as f:
+            f.write(body)
+
+        offset = os.path.getsize(upload_path)
+
+        if step == "Finish":
+            with _LOCK:
+                os.replace(upload_path, self._path(file_url))
+
+        return _response(200, json_body={"value": str(offset)})
+
+    def _folder_url(self, folder_name: str) -> str:
+        return f"/{self.site_type}/{self.site_name}/{self.document_library}/{folder_name}"
+
+    def _path(self, server_relative_url: str) -> str:
+        path = os.path.normpath(os.path.join(self.root, *server_relative_url.strip("/").split("/")))
+
+        if os.path.commonpath([path, os.path.normpath(self.root)]) != os.path.normpath(self.root):
+            raise ValueError(f"'{server_relative_url}' is outside the local SharePoint folder")
+
+        return path
+
+    def _file_names(self, folder_url: str) -> list[str]:
+        folder_path = self._path(folder_url)
+
+        if not os.path.isdir(folder_path):
+            return []
+
+        return sorted(
+            name for name in os.listdir(folder_path)
+            if os.path.isfile(os.path.join(folder_path, name)) and ".upload-" not in name and not name.endswith(".tmp")
+        )
+
+    def _read(self, file_url: str) -> bytes | None:
+        try:
+            with open(self._path(file_url), "rb") as f:
+                return f.read()
+
+        except FileNotFoundError:
+            return None
+
+    def _write(self, file_url: str, content: bytes) -> str:
+        path = self._path(file_url)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        temp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(temp_path, "wb") as f:
+            f.write(content)
+
+        os.replace(temp_path, path)
+
+        return _etag_of(content)
+
+    def _etag(self, file_url: str) -> str | None:
+        content = self._read(file_url)
+
+        return _etag_of(content) if content is not None else None
+
+
+def _etag_of(content: bytes) -> str:
+    # Shaped like SharePoint eTags, "{<guid>},<version>" - derived from the content, so every change gets a new one
+    digest = hashlib.md5(content, usedforsecurity=False).hexdigest()
+
+    return f'"{{{digest[:8]}-{digest[8:12]}-{digest[12:16]}-{digest[16:20]}-{digest[20:]}}},1"'
+
+
+def _odata_value(quoted: str) -> str:
+    value = urllib.parse.unquote(quoted)
+
+    return value[1:-1].replace("''", "'") if value.startswith("'") and value.endswith("'") else value
+
+
+def _response(status_code: int, content: bytes = b"", headers: dict | None = None, json_body=None) -> requests.Response:
+    response = requests.Response()
+    response.status_code = status_code
+    response.reason = http.HTTPStatus(status_code).phrase
+    response.url = "local-sharepoint"
+
+    if json_body is not None:
+        content = json.dumps(json_body).encode("utf-8")
+        response.headers["Content-Type"] = "application/json"
+
+    response._content = content  # pylint: disable=protected-access
+    response.headers.update(headers or {})
+
+    return response
@@ -0,0 +1,147 @@
+"""
+Local SMTP stand-in, for testing error mails without the production mail server.
+
+Set MAIL_BACKEND = "local" (FORMULARDATA_MAIL_BACKEND=local) and point LOCAL_SMTP_ADDRESS at it to select it.
+It speaks just enough SMTP for smtplib - EHLO, MAIL, RCPT, DATA, RSET, NOOP and QUIT, without STARTTLS - and keeps
+every message it receives in memory. Faults (see benchmarks.fault_injection) are injected into every command - failed
+commands get a 451, and throttled ones a 421 that closes the connection, like a busy server would.
+
+Run on its own with:
+    python -m benchmarks.local_smtp_server [--port 8025] [--faults '{"failure_rate": 0.1}']
+"""
+
+import argparse
+import json
+import socketserver
+import threading
+
+from collections import Counter
+from email import message_from_bytes, policy
+from email.message import EmailMessage
+
+from benchmarks import fault_injection
+
+
+class LocalSmtpServer(socketserver.ThreadingTCPServer):
+    """In-memory SMTP server, serving connections on a background thread once started"""
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, faults: fault_injection.Faults | None = None, port: int = 0):
+        super().__init__(("127.0.0.1", port), _SmtpHandler)
+
+        self.faults = faults or fault_injection.Faults()
+        self.lock = threading.Lock()
+        self.messages: list[EmailMessage] = []
+        self.stats: Counter = Counter()
+
+    @property
+    def address(self) -> str:
+        """The address to set as LOCAL_SMTP_ADDRESS."""
+
+        return f"127.0.0.1:{self.server_address[1]}"
+
+    def start(self) -> "LocalSmtpServer":
+        """Serve connections on a background thread."""
+
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+        return self
+
+    def stop(self) -> None:
+        """Stop serving and close the socket."""
+
+        self.shutdown()
+        self.server_close()
+
+
+class _SmtpHandler(socketserver.StreamRequestHandler):
+    server: LocalSmtpServer
+
+    def handle(self) -> None:
+        self.server.stats["connections"] += 1
+        self._reply("220 localhost local SMTP stand-in")
+
+        while line := self.rfile.readline():
+            command = line.decode("utf-8", errors="replace").strip()
+            verb = command.split(" ", 1)[0].upper()
+
+            self.server.stats[verb] += 1
+            outcome = self.server.faults.inject()
+
+            if outcome == fault_injection.THROTTLE:
+                self._reply("421 Too many requests, closing connection")
+
+                return
+
+            if outcome == fault_injection.FAILURE:
+                self._reply("451 Injected failure")
+
+                continue
+
+            match verb:
+                case "EHLO":
+                    self._reply("250-localhost\r\n250-8BITMIME\r\n250 SMTPUTF8")
+
+                case "HELO" | "MAIL" | "RCPT" | "RSET" | "NOOP":
+                    self._reply("250 OK")
+
+                case "DATA":
+                    self._reply("354 End data with <CR><LF>.<CR><LF>")
+                    self._receive_message()
+                    self._reply("250 OK")
+
+                case "QUIT":
+                    self._reply("221 Bye")
+
+                    return
+
+                case _:
+                    self._reply("502 Command not implemented")
+
+    def _receive_message(self) -> None:
+        lines = []
+
+        while (line := self.rfile.readline()) not in (b".\r\n", b".\n", b""):
+            # Lines starting with a dot are sent with an extra dot
+            lines.append(line[1:] if line.startswith(b"..") else line)
+
+        message = message_from_bytes(b"".join(lines), policy=policy.default)
+
+        with self.server.lock:
+            self.server.messages.append(message)
+
+    def _reply(self, reply: str) -> None:
+        self.wfile.write(f"{reply}\r\n".encode("utf-8"))
+
+
+def main() -> None:
+    """Serve the local SMTP server until interrupted, printing the subject of every message received."""
+
+    parser = argparse.ArgumentParser(description="Local stand-in for the SMTP server of the error mails")
+    parser.add_argument("--port", type=int, default=8025)
+    parser.add_argument("--faults", type=json.loads, default={}, help="fault_injection.Faults fields as JSON")
+    args = parser.parse_args()
+
+    server = LocalSmtpServer(fault_injection.Faults(**args.faults), args.port).start()
+    print(f"Serving a local SMTP server at {server.address}")
+
+    printed = 0
+
+    try:
+        while True:
+            threading.Event().wait(1)
+
+            with server.lock:
+                for message in server.messages[printed:]:
+                    print(f"{message['from']} -> {message['to']}: {message['subject']}")
+
+                printed = len(server.messages)
+
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,185 @@
+"""
+Runner of the benchmark suite, writing the results as JSON so they can be compared release to release.
+
+Every case runs for every form type in a fresh worker process, so the peak RSS of one case does not carry over to
+the next. Items are handled in the case's batches, repeated --repeat times, and each result records the throughput
+in items per second, the p50/p95 batch latency, and the peak RSS after setup and after the run.
+
+Run from the repository root:
+    python -m benchmarks.run [--count 10000] [--repeat 3] [--cases transform_compiled ...] [--forms sundung_aarhus ...]
+        [--output benchmark_results.json]
+
+Generated submissions are held in memory, about 2-5 KB each, so the largest volumes (500k) need a few GB.
+"""
+
+import argparse
+import ctypes
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from datetime import datetime
+
+RESULTS_VERSION = 1
+
+
+def main() -> None:
+    """Run the selected cases for the selected form types and write the results."""
+
+    # Imported here, so the worker processes are the only ones paying for the imports of the code under test
+    from benchmarks import cases, generator  # pylint: disable=import-outside-toplevel
+
+    parser = argparse.ArgumentParser(description="Benchmarks of the queue and process hot paths")
+    parser.add_argument("--count", type=int, default=10_000, help="submissions per form type")
+    parser.add_argument("--repeat", type=int, default=3, help="runs over all items per case")
+    parser.add_argument("--cases", nargs="+", choices=list(cases.CASES), default=list(cases.CASES))
+    parser.add_argument("--forms", nargs="+", choices=list(generator.all_mappings()), default=None)
+    parser.add_argument("--output", default="benchmark_results.json")
+    args = parser.parse_args()
+
+    form_types = args.forms or list(generator.all_mappings())
+    results = []
+
+    for case_name in args.cases:
+        for form_type in form_types:
+            result = _run_worker(case_name, form_type, args.count, args.repeat)
+            results.append(result)
+
+            print(
+                f"{case_name:<26} {form_type:<35} {result['ops_per_second']:>12,.0f} ops/s   "
+                f"p50 {result['p50_seconds'] * 1000:>9.2f} ms   p95 {result['p95_seconds'] * 1000:>9.2f} ms   "
+                f"peak RSS {result['peak_rss_bytes'] / 2**20:>8.1f} MB"
+            )
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump({
+            "version": RESULTS_VERSION,
+            "created": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "count": args.count,
+            "repeat": args.repeat,
+            "results": results,
+        }, f, indent=2)
+
+    print(f"Results written to {args.output}")
+
+
+def run_case(case_name: str, form_type: str, count: int, repeat: int) -> dict:
+    """Set up and time a single case for a single form type, in this process."""
+
+    from benchmarks import cases, generator  # pylint: disable=import-outside-toplevel
+
+    mapping = generator.all_mappings()[form_type]
+
+    with tempfile.TemporaryDirectory() as workdir:
+        case = cases.CASES[case_name](form_type, mapping, count, workdir)
+        setup_peak_rss = peak_rss_bytes()
+
+        durations = []
+
+        for _ in range(repeat):
+            for start in range(0, len(case.items), case.batch_size):
+                batch = case.items[start:start + case.batch_size]
+
+                started = time.perf_counter()
+                case.run(batch)
+                durations.append(time.perf_counter() - started)
+
+    return {
+        "case": case_name,
+        "form_type": form_type,
+        "count": count,
+        "batch_size": case.batch_size,
+        "batches": len(durations),
+        "ops_per_second": len(case.items) * repeat / sum(durations),
+        "p50_seconds": _percentile(durations, 50),
+        "p95_seconds": _percentile(durations, 95),
+        "setup_peak_rss_bytes": setup_peak_rss,
+        "peak_rss_bytes": peak_rss_bytes(),
+    }
+
+
+def peak_rss_bytes() -> int:
+    """Return the peak resident set size of this process, in bytes."""
+
+    try:
+        import resource  # pylint: disable=import-outside-toplevel
+
+    except ImportError:
+        return _windows_peak_rss_bytes()
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    # ru_maxrss is in bytes on macOS, and in kilobytes everywhere else
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def _windows_peak_rss_bytes() -> int:
+    class ProcessMemoryCounters(ctypes.Structure):  # pylint: disable=too-few-public-methods
+        """The PROCESS_MEMORY_COUNTERS structure filled in by GetProcessMemoryInfo"""
+
+        _fields_ = [
+            ("cb", ctypes.c_ulong),
+            ("PageFaultCount", ctypes.c_ulong),
+            ("PeakWorkingSetSize", ctypes.c_size_t),
+            ("WorkingSetSize", ctypes.c_size_t),
+            ("QuotaPeakPagedPoolUsage", ctypes.c_size_t),
+            ("QuotaPagedPoolUsage", ctypes.c_size_t),
+            ("QuotaPeakNonPagedPoolUsage", ctypes.c_size_t),
+            ("QuotaNonPagedPoolUsage", ctypes.c_size_t),
+            ("PagefileUsage", ctypes.c_size_t),
+            ("PeakPagefileUsage", ctypes.c_size_t),
+        ]
+
+    counters = ProcessMemoryCounters(cb=ctypes.sizeof(ProcessMemoryCounters))
+
+    process = ctypes.windll.kernel32.GetCurrentProcess()
+    ctypes.windll.psapi.GetProcessMemoryInfo(process, ctypes.byref(counters), counters.cb)
+
+    return counters.PeakWorkingSetSize
+
+
+def _run_worker(case_name: str, form_type: str, count: int, repeat: int) -> dict:
+    with tempfile.TemporaryDirectory() as result_dir:
+        result_path = os.path.join(result_dir, "result.json")
+
+        # The code under test prints progress, so the result is passed back in a file instead of on stdout
+        subprocess.run(
+            [
+                sys.executable, "-m", "benchmarks.run", "--worker",
+                case_name, form_type, str(count), str(repeat), result_path,
+            ],
+            check=True,
+            stdout=subprocess.DEVNULL,
+        )
+
+        with open(result_path, encoding="utf-8") as f:
+            return json.load(f)
+
+
+def _worker(case_name: str, form_type: str, count: str, repeat: str, result_path: str) -> None:
+    result = run_case(case_name, form_type, int(count), int(repeat))
+
+    with open(result_path, "w", encoding="utf-8") as f:
+        json.dump(result, f)
+
+
+def _percentile(values: list[float], percent: int) -> float:
+    if len(values) == 1:
+        return values[0]
+
+    return statistics.quantiles(values, n=100, method="inclusive")[percent - 1]
+
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ["--worker"]:
+        _worker(*sys.argv[2:])
+
+    else:
+        main()
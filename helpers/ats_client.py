@@ -0,0 +1,136 @@
+"""
+Module for adding work items to an Automation Server workqueue over an async, pooled HTTP client.
+
+Each item is serialized once, and sent either in bulk, if the server exposes a bulk endpoint (ATS_BULK_ENQUEUE_PATH),
+or one request per item with at most MAX_CONCURRENCY requests in flight over keep-alive connections. Rate limited
+requests, server errors and transport errors are retried ATS_REQUEST_MAX_RETRIES times with exponential backoff,
+honoring Retry-After when the server is rate limiting.
+
+Items are posted to the endpoint Workqueue.add_item of automation_server_client (v0.2.0, pinned in pyproject.toml)
+posts to, with the body it sends for add_item({"item": item}, reference): {"data": json.dumps({"item": item}),
+"reference": reference}. The data is dumped with ensure_ascii=False, so it is the same JSON document, with non-ASCII
+characters written as is instead of escaped. Check the body against add_item when the client is upgraded.
+"""
+
+import asyncio
+import json
+import logging
+
+import httpx
+
+from helpers import config, metrics
+from helpers.ats_reference_index import retry_after_seconds
+
+REQUEST_TIMEOUT = 60
+
+logger = logging.getLogger(__name__)
+
+
+async def add_items(url: str, token: str, workqueue_id, items: list[dict]) -> list[bool]:
+    """
+    Add items ({"reference": ..., "data": ...}) to the workqueue, stored as {"item": item} like workqueue.add_item.
+    Returns whether each item was added, in the order of items.
+    """
+
+    if not url or not token:
+        raise EnvironmentError("ATS_URL or ATS_TOKEN is not set in the environment")
+
+    payloads = [
+        {"reference": str(item.get("reference") or ""), "data": json.dumps({"item": item}, ensure_ascii=False, default=str)}
+        for item in items
+    ]
+
+    limits = httpx.Limits(max_connections=config.MAX_CONCURRENCY, max_keepalive_connections=config.MAX_CONCURRENCY)
+
+    with metrics.span("enqueue") as span:
+        async with httpx.AsyncClient(
+            base_url=url,
+            headers={"Authorization": f"Bearer {token}"},
+            limits=limits,
+            timeout=REQUEST_TIMEOUT,
+        ) as client:
+            if config.ATS_BULK_ENQUEUE_PATH:
+                results = await _add_in_bulk(client, workqueue_id, payloads)
+
+            else:
+                results = await _add_each(client, workqueue_id, payloads)
+
+        span.add(
+            rows=sum(results),
+            bytes_out=sum(len(payload["data"].encode("utf-8")) for payload, added in zip(payloads, results) if added),
+        )
+
+    return results
+
+
+async def _add_in_bulk(client: httpx.AsyncClient, workqueue_id, payloads: list[dict]) -> list[bool]:
+    path = config.ATS_BULK_ENQUEUE_PATH.format(workqueue_id=workqueue_id)
+    results = []
+
+    for start in range(0, len(payloads), config.ATS_BULK_ENQUEUE_SIZE):
+        batch = payloads[start:start + config.ATS_BULK_ENQUEUE_SIZE]
+
+        if await _post(client, path, batch, f"batch of {len(batch)} items"):
+            logger.info(f"Added {len(batch)} items to queue in bulk")
+            results.extend([True] * len(batch))
+
+        else:
+            # Items in a failed batch are added one by one, so one bad item does not fail the rest
+            results.extend(await _add_each(client, workqueue_id, batch))
+
+    return results
+
+
+async def _add_each(client: httpx.AsyncClient, workqueue_id, payloads: list[dict]) -> list[bool]:
+    path = config.ATS_ADD_ITEM_PATH.format(workqueue_id=workqueue_id)
+    sem = asyncio.Semaphore(config.MAX_CONCURRENCY)
+
+    async def add_one(payload: dict) -> bool:
+        async with sem:
+            added = await _post(client, path, payload, payload["reference"])
+
+        if added:
+            logger.info(f"Added item to queue with reference: {payload['reference']}")
+
+        return added
+
+    return list(await asyncio.gather(*(add_one(payload) for payload in payloads)))
+
+
+async def _post(client: httpx.AsyncClient, path: str, body, description: str) -> bool:
+    # Only rate limiting, server errors and transport errors are retried - any other error will not go away
+    for attempt in range(1, config.ATS_REQUEST_MAX_RETRIES + 2):
+        try:
+            response = await client.post(path, json=body)
+            response.raise_for_status()
+
+            return True
+
+        except httpx.HTTPStatusError as e:
+            status_code = e.response.status_code
+
+            if (status_code != 429 and status_code < 500) or attempt > config.ATS_REQUEST_MAX_RETRIES:
+                logger.error(f"Failed to add {description} after {attempt} attempts: {e}")
+
+                return False
+
+            error = e
+            backoff = retry_after_seconds(e.response) or config.RETRY_BASE_DELAY * (2 ** (attempt - 1))
+
+        except httpx.TransportError as e:
+            if attempt > config.ATS_REQUEST_MAX_RETRIES:
+                logger.error(f"Failed to add {description} after {attempt} attempts: {e}")
+
+                return False
+
+            error = e
+            backoff = config.RETRY_BASE_DELAY * (2 ** (attempt - 1))
+
+        logger.warning(
+            f"Error adding {description} (attempt {attempt}/{config.ATS_REQUEST_MAX_RETRIES + 1}). "
+            f"Retrying in {backoff:.2f}s... {error}"
+        )
+
+        await asyncio.sleep(backoff)
+
+    return False
@@ -3,55 +3,30 @@
 import logging
 import os
 
-import requests
 from automation_server_client import WorkItem, Workqueue
 from dotenv import load_dotenv
 
+from helpers import ats_reference_index, payload_codec
+
 
 def get_workqueue_items(workqueue: Workqueue):
     """
-    Retrieve items from the specified workqueue.
-    If the queue is empty, return an empty list.
+    Retrieve the references of the items in the specified workqueue.
+    If the queue is empty, return an empty set.
     """
     load_dotenv()
 
-    url = os.getenv("ATS_URL")
-    token = os.getenv("ATS_TOKEN")
-
-    workqueue_items = set()
-
-    if not url or not token:
-        raise EnvironmentError("ATS_URL or ATS_TOKEN is not set in the environment")
-
-    headers = {"Authorization": f"Bearer {token}"}
-
-    workqueue_items = set()
-    page = 1
-    size = 200  # max allowed
-
-    while True:
-        full_url = f"{url}/workqueues/{workqueue.id}/items?page={page}&size={size}"
-        response = requests.get(full_url, headers=headers, timeout=60)
-        response.raise_for_status()
-
-        res_json = response.json().get("items", [])
-
-        if not res_json:
-            break
-
-        for row in res_json:
-            ref = row.get("reference")
-            if ref:
-                workqueue_items.add(ref)
+    return ats_reference_index.get_references(os.getenv("ATS_URL"), os.getenv("ATS_TOKEN"), workqueue.id)
 
-        page += 1
 
-    return workqueue_items
+def get_item_info(item: WorkItem, decode_submissions: bool = True):
+    """Unpack item, decompressing its submissions if they are stored compressed"""
+    data = item.data["item"]["data"]
 
+    if decode_submissions and "submissions" in data:
+        data = {**data, "submissions": payload_codec.decode_submissions(data["submissions"])}
 
-def get_item_info(item: WorkItem):
-    """Unpack item"""
-    return item.data["item"]["data"], item.data["item"]["reference"]
+    return data, item.data["item"]["reference"]
 
 
 def init_logger():
@@ -0,0 +1,253 @@
+"""
+Module for a persisted index of the references in an Automation Server workqueue.
+
+Workqueue items are paged oldest first, so the index records every reference on the complete pages already read,
+and the first item of the last complete page as an anchor. The next run re-reads only that page to check the anchor
+has not moved (e.g. because items were deleted), and continues from the page after it. If it has moved - as it
+always does when the queue is paged newest first - a warning is logged and every page is read again. Pages are fetched over
+keep-alive sessions with a fixed number of pages in flight.
+"""
+
+import email.utils
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import requests
+
+from helpers import config
+
+REQUEST_TIMEOUT = 60
+
+logger = logging.getLogger(__name__)
+
+_SESSIONS = threading.local()
+
+
+def get_references(url: str, token: str, workqueue_id) -> set[str]:
+    """Return the references of all items in the workqueue, reading only the pages added since the last run."""
+
+    if not url or not token:
+        raise EnvironmentError("ATS_URL or ATS_TOKEN is not set in the environment")
+
+    index_path = _index_path(url, workqueue_id)
+    index = _read_index(index_path)
+
+    references: set[str] = set()
+    start_page = 1
+
+    if _index_is_current(index, url, token, workqueue_id):
+        references = set(index["references"])
+        start_page = index["complete_pages"] + 1
+
+        logger.info(f"Reference index has {len(references)} references - reading workqueue from page {start_page}")
+
+    complete_pages = start_page - 1
+    anchor = index.get("anchor") if start_page > 1 else None
+
+    for page, items in fetch_pages(url, token, workqueue_id, start_page):
+        references.update(item["reference"] for item in items if item.get("reference"))
+
+        if len(items) == config.ATS_PAGE_SIZE:
+            complete_pages = page
+            anchor = _item_key(items[0])
+
+    _write_index(index_path, {
+        "url": url,
+        "workqueue_id": workqueue_id,
+        "page_size": config.ATS_PAGE_SIZE,
+        "complete_pages": complete_pages,
+        "anchor": anchor,
+        "references": sorted(references),
+    })
+
+    logger.info(f"Read workqueue pages {start_page}-{complete_pages + 1} - {len(references)} references in total")
+
+    return references
+
+
+def fetch_pages(url: str, token: str, workqueue_id, start_page: int = 1) -> list[tuple[int, list[dict]]]:
+    """
+    Fetch pages from start_page until the first page that is not full, with ATS_PAGES_IN_FLIGHT pages in flight.
+    Returns (page, items) tuples in page order.
+    """
+
+    pages = []
+    in_flight: dict[int, Future] = {}
+    next_page = start_page
+
+    with ThreadPoolExecutor(max_workers=config.ATS_PAGES_IN_FLIGHT) as executor:
+        while True:
+            while len(in_flight) < config.ATS_PAGES_IN_FLIGHT:
+                in_flight[next_page] = executor.submit(fetch_page, url, token, workqueue_id, next_page)
+                next_page += 1
+
+            # Pages are consumed in order, so the first page that is not full ends the pipeline
+            page = min(in_flight)
+            items = in_flight.pop(page).result()
+            pages.append((page, items))
+
+            if len(items) < config.ATS_PAGE_SIZE:
+                for future in in_flight.values():
+                    future.cancel()
+
+                break
+
+    return pages
+
+
+def fetch_page(url: str, token: str, workqueue_id, page: int) -> list[dict]:
+    """Fetch a single page of workqueue items, retrying on rate limiting and server errors."""
+
+    headers = {"Authorization": f"Bearer {token}"}
+    params = {"page": page, "size": config.ATS_PAGE_SIZE}
+
+    for attempt in range(1, config.ATS_REQUEST_MAX_RETRIES + 2):
+        try:
+            response = _session().get(
+                f"{url}/workqueues/{workqueue_id}/items",
+                params=params,
+                headers=headers,
+                timeout=REQUEST_TIMEOUT,
+            )
+
+        except requests.ConnectionError:
+            if attempt > config.ATS_REQUEST_MAX_RETRIES:
+                raise
+
+            time.sleep(config.RETRY_BASE_DELAY * (2 ** (attempt - 1)))
+
+            continue
+
+        if (response.status_code == 429 or response.status_code >= 500) and attempt <= config.ATS_REQUEST_MAX_RETRIES:
+            delay = retry_after_seconds(response) or config.RETRY_BASE_DELAY * (2 ** (attempt - 1))
+
+            logger.info(f"Workqueue page {page} returned {response.status_code} - retrying in {delay:.2f}s")
+
+            time.sleep(delay)
+
+            continue
+
+        response.raise_for_status()
+
+        return response.json().get("items", [])
+
+    return []
+
+
+def retry_after_seconds(response: requests.Response) -> float | None:
+    """Return the delay requested by a Retry-After header, in seconds or as an HTTP date, or None."""
+
+    retry_after = response.headers.get("Retry-After")
+
+    if not retry_after:
+        return None
+
+    try:
+        return max(float(retry_after), 0.0)
+
+    except ValueError:
+        pass
+
+    try:
+        return max(email.utils.parsedate_to_datetime(retry_after).timestamp() - time.time(), 0.0)
+
+    except (TypeError, ValueError):
+        return None
+
+
+def _index_is_current(index: dict, url: str, token: str, workqueue_id) -> bool:
+    if (
+        index.get("url") != url
+        or index.get("page_size") != config.ATS_PAGE_SIZE
+        or not index.get("complete_pages")
+    ):
+        return False
+
+    # The last complete page still starts with the anchor, unless items were deleted or reordered
+    items = fetch_page(url, token, workqueue_id, index["complete_pages"])
+
+    if len(items) == config.ATS_PAGE_SIZE and _item_key(items[0]) == index.get("anchor"):
+        return True
+
+    # Resuming relies on new items being added to the last page, so a queue paged newest first never resumes
+    if _is_newest_first(items):
+        logger.warning(
+            "Workqueue pages are ordered newest first, so the reference index cannot resume from its last "
+            "complete page - reading all pages"
+        )
+
+    else:
+        logger.warning(
+            f"Reference index anchor {index.get('anchor')} is no longer first on page {index['complete_pages']}, "
+            "items were deleted or reordered - reading all pages"
+        )
+
+    return False
+
+
+def _is_newest_first(items: list[dict]) -> bool:
+    ids = [item.get("id") for item in items]
+
+    if len(ids) < 2 or not all(isinstance(item_id, int) for item_id in ids):
+        return False
+
+    return ids == sorted(ids, reverse=True)
+
+
+def _item_key(item: dict):
+    return item.get("id", item.get("reference"))
+
+
+def _session() -> requests.Session:
+    # One keep-alive session per thread, since sessions are not guaranteed to be thread safe
+    session = getattr(_SESSIONS, "session", None)
+
+    if session is None:
+        session = requests.Session()
+        _SESSIONS.session = session
+
+    return session
+
+
+def _index_path(url: str, workqueue_id) -> str:
+    key = hashlib.sha1(f"{url}/{workqueue_id}".encode("utf-8")).hexdigest()
+
+    return os.path.join(config.ATS_REFERENCE_INDEX_DIR, f"{key}.json")
+
+
+def _read_index(index_path: str) -> dict:
+    if not os.path.exists(index_path):
+        return {}
+
+    try:
+        with open(index_path, encoding="utf-8") as f:
+            return json.load(f)
+
+    except (OSError, json.JSONDecodeError) as e:
+        logger.warning(f"Could not read reference index, reading all pages: {e}")
+
+        return {}
+
+
+def _write_index(index_path: str, index: dict) -> None:
+    index_dir = os.path.dirname(index_path)
+    os.makedirs(index_dir, exist_ok=True)
+
+    # Runs reading the same workqueue each write their own temp file, so the index is only ever replaced whole
+    with tempfile.NamedTemporaryFile("w", dir=index_dir, suffix=".tmp", delete=False, encoding="utf-8") as f:
+        json.dump(index, f, ensure_ascii=False, default=str)
+
+    try:
+        os.replace(f.name, index_path)
+
+    except OSError:
+        os.remove(f.name)
+
+        raise
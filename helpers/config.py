@@ -1,11 +1,14 @@
 """Module for general configurations of the process"""
 
+import os
+
 from helpers import formular_mappings
 
 # ----------------------
 # Workqueue settings
 # ----------------------
 MAX_RETRY = 1
+PROCESS_CONCURRENCY = 1  # items processed in parallel, items for the same workbook always run in order
 
 # ----------------------
 # Queue population settings
@@ -13,6 +16,145 @@ MAX_RETRY = 1
 MAX_CONCURRENCY = 10  # tune based on backend capacity
 MAX_RETRIES = 1  # failure retries per item
 RETRY_BASE_DELAY = 0.5  # seconds
+WORK_ITEM_MAX_SUBMISSIONS = 500  # submissions per work item, new submissions are split into several items
+WORK_ITEM_MAX_BYTES = 1_000_000  # serialized submission bytes per work item
+ATS_ADD_ITEM_PATH = "/workqueues/{workqueue_id}/add"  # endpoint workqueue.add_item posts to
+ATS_BULK_ENQUEUE_PATH = None  # bulk endpoint taking a list of items, if the server has one, e.g. "/workqueues/{workqueue_id}/add_bulk"
+ATS_BULK_ENQUEUE_SIZE = 100  # items per bulk request
+WORK_ITEM_FORMAT = "rows"  # "rows" stores submissions as row dicts, "columns" as a dictionary encoded columnar table
+WORK_ITEM_COMPRESSION = None  # None stores submissions as plain JSON, "gzip" or "zstd" stores them compressed
+WORK_ITEM_COMPRESSION_LEVEL = 6
+
+# ----------------------
+# Startup settings, checked by main.py --import-profile
+# ----------------------
+IMPORT_TIME_BUDGET_SECONDS = {"--queue": 2.5, "--process": 2.5, "--finalize": 1.0}
+DEFERRED_IMPORTS = {  # modules a mode must not load at startup, only on first use
+    "--queue": ("PIL.Image",),
+    "--process": ("PIL.Image", "sqlalchemy"),
+    "--finalize": ("PIL.Image", "pandas", "sqlalchemy"),
+}
+
+# ----------------------
+# PDF transfer settings
+# ----------------------
+PDF_TRANSFER_CONCURRENCY = 8  # PDFs downloaded from OS2Forms and uploaded to SharePoint in parallel
+PDF_TRANSFER_MAX_RETRIES = 3  # retries per PDF, with exponential backoff from RETRY_BASE_DELAY
+
+# ----------------------
+# SharePoint upload settings
+# ----------------------
+UPLOAD_CHUNK_SIZE = 10 * 1024 * 1024  # files larger than this are uploaded in chunks, bounding memory per transfer
+UPLOAD_CHUNK_MAX_RETRIES = 3  # retries per chunk before the upload is cancelled
+
+# ----------------------
+# Workbook write settings
+# ----------------------
+EXCEL_WRITE_MODE = "append"  # "append": append, then sort and format remotely, "merge": merge locally and upload once
+EXCEL_MERGE_MAX_RETRIES = 3  # merges retried when the workbook is changed concurrently
+
+# ----------------------
+# Local state settings
+# ----------------------
+STATE_DIR = os.getenv(
+    "FORMULARDATA_STATE_DIR",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), ".state"),
+)
+
+# ----------------------
+# Workqueue reference index settings
+# ----------------------
+ATS_PAGE_SIZE = 200  # max allowed by Automation Server
+ATS_PAGES_IN_FLIGHT = 4  # workqueue pages fetched concurrently
+ATS_REQUEST_MAX_RETRIES = 3  # retries on rate limiting (honoring Retry-After) and server errors, reading or adding items
+ATS_REFERENCE_INDEX_DIR = os.path.join(STATE_DIR, "ats_reference_index")
+
+# ----------------------
+# Secrets settings
+# ----------------------
+SECRETS_TTL_SECONDS = 60 * 60  # credentials and constants are re-read from the RPA database after this
+SECRETS_DISK_CACHE = False  # keep resolved secrets on disk, encrypted with the OPENORCHESTRATORKEY key
+SECRETS_DISK_CACHE_FILE = os.path.join(STATE_DIR, "secrets.bin")
+
+# ----------------------
+# Error mail settings
+# ----------------------
+ERROR_MAIL_DIGEST = True  # queue error mails and send digests off the item loop, False sends one mail per error
+ERROR_MAIL_DIGEST_WINDOW_SECONDS = 15 * 60  # at most one digest per window, None sends one digest per run
+ERROR_MAIL_MAX_DISTINCT_ERRORS = 50  # distinct errors listed in a digest, occurrences of any others are only counted
+ERROR_MAIL_MAX_SCREENSHOTS = 3  # screenshots per digest, each of the first occurrence of an error
+ERROR_MAIL_CLOSE_TIMEOUT_SECONDS = 60  # how long the end of a run waits for the last digest to be sent
+ERROR_MAIL_STARTTLS = True
+
+# ----------------------
+# Incremental extraction settings
+# ----------------------
+# Requires a STATE_DIR that persists between runs - without a watermark file, every submission is read as before
+INCREMENTAL_EXTRACTION = False  # only query submissions newer than the last run's high-water mark
+WATERMARK_FILE = os.path.join(STATE_DIR, "watermarks.json")
+WATERMARK_LOOKBACK_HOURS = 24  # re-scan window for rows that arrive late in the view
+
+# ----------------------
+# SharePoint client pool settings
+# ----------------------
+SHAREPOINT_POOL_MAX_CLIENTS = 10
+SHAREPOINT_CLIENT_MAX_AGE_SECONDS = 45 * 60  # replace clients before their access token expires
+SHAREPOINT_CLIENT_IDLE_SECONDS = 15 * 60
+
+# ----------------------
+# SharePoint file cache settings
+# ----------------------
+SHAREPOINT_CACHE_DIR = os.path.join(STATE_DIR, "sharepoint_cache")  # encrypted with OPENORCHESTRATORKEY, off without it
+SHAREPOINT_CACHE_MAX_BYTES = 500 * 1024 * 1024
+
+# ----------------------
+# Serial index settings
+# ----------------------
+SERIAL_INDEX_DIR = os.path.join(STATE_DIR, "serial_index")
+
+# ----------------------
+# Metrics settings
+# ----------------------
+METRICS_DIR = os.path.join(STATE_DIR, "metrics")  # a JSON summary of every run is written here
+METRICS_PROMETHEUS_TEXTFILE_DIR = os.getenv("FORMULARDATA_PROMETHEUS_TEXTFILE_DIR")  # e.g. node_exporter's textfile dir
+
+# ----------------------
+# Profiling settings, used with --profile (see helpers.profiling)
+# ----------------------
+PROFILE_DIR = os.path.join(STATE_DIR, "profiles")
+PROFILE_TOP_FUNCTIONS = 40  # functions in each CPU report
+PROFILE_TOP_ALLOCATIONS = 25  # allocation sites in each memory report
+PROFILE_TRACEMALLOC_FRAMES = 10  # frames kept per traced allocation - 1 with --profile-sampling
+PROFILE_SAMPLE_INTERVAL_SECONDS = 0.005
+PROFILE_MEMORY_CHECK_SECONDS = 0.5  # how often traced memory is checked for growth since the last snapshot
+PROFILE_SNAPSHOT_GROWTH = 1.2  # a new snapshot is taken when traced memory has grown by this factor
+
+# ----------------------
+# Local backend settings, stand-ins for load testing without the production systems
+# ----------------------
+# The journalizing view is read from SQLite when DBCONNECTIONSTRINGPROD is a sqlite:/// URL (see benchmarks.generator),
+# and workqueues from a local server when ATS_URL points at one (see benchmarks.local_ats_server).
+# SharePoint and injected faults are swapped in by benchmarks.local_main, which runs main.py against the stand-ins
+MAIL_BACKEND = os.getenv("FORMULARDATA_MAIL_BACKEND", "smtp")  # "local" sends error mails to LOCAL_SMTP_ADDRESS
+LOCAL_SMTP_ADDRESS = os.getenv("FORMULARDATA_LOCAL_SMTP_ADDRESS", "127.0.0.1:8025")  # see benchmarks.local_smtp_server
+
+# ----------------------
+# Database settings
+# ----------------------
+DB_POOL_SIZE = 5
+DB_MAX_OVERFLOW = 5
+DB_POOL_TIMEOUT = 30  # seconds to wait for a free connection
+DB_POOL_RECYCLE = 1800  # seconds before a pooled connection is replaced
+DB_POOL_PRE_PING = True  # test connections on checkout, so stale ones are replaced transparently
+
+# ----------------------
+# Submission reader settings
+# ----------------------
+FORMS_FETCH_BATCH_SIZE = 500  # rows fetched from the cursor at a time
+# Early stop only counts submissions below the lowest serial number of a queued work item not yet in the workbook.
+# A submission whose work item could not be added to the queue is only read again by a full read
+STOP_AFTER_KNOWN_SERIALS = 0  # stop reading after this many such submissions in a row in the workbook, 0 disables
+JSON_PROJECTION_PUSHDOWN = True  # only fetch the mapped fields of form_data, instead of the whole document
 
 WEBFORMS_CONFIG = {
 
@@ -0,0 +1,116 @@
+"""Module for a process-wide, pooled database engine cache"""
+
+import logging
+import threading
+import time
+import urllib.parse
+
+from contextlib import contextmanager
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Connection, Engine
+
+from helpers import config
+
+logger = logging.getLogger(__name__)
+
+_ENGINES: dict[str, Engine] = {}
+_POOL_STATS: dict[str, dict] = {}
+_LOCK = threading.Lock()
+
+
+def get_engine(conn_string: str) -> Engine:
+    """
+    Return the shared engine for the given ODBC connection string, creating it on first use.
+    The connection pool is configured from the DB_POOL_* settings in helpers.config.
+
+    A SQLAlchemy sqlite:/// URL can be given instead of an ODBC connection string, to use a local
+    SQLite stand-in for the journalizing view.
+    """
+
+    with _LOCK:
+        engine = _ENGINES.get(conn_string)
+
+        if engine is None:
+            if conn_string.startswith("sqlite:"):
+                engine = create_engine(conn_string, pool_pre_ping=config.DB_POOL_PRE_PING)
+
+            else:
+                encoded_conn_str = urllib.parse.quote_plus(conn_string)
+
+                engine = create_engine(
+                    f"mssql+pyodbc:///?odbc_connect={encoded_conn_str}",
+                    pool_size=config.DB_POOL_SIZE,
+                    max_overflow=config.DB_MAX_OVERFLOW,
+                    pool_timeout=config.DB_POOL_TIMEOUT,
+                    pool_recycle=config.DB_POOL_RECYCLE,
+                    pool_pre_ping=config.DB_POOL_PRE_PING,
+                )
+
+            _POOL_STATS[conn_string] = _track_pool_stats(engine)
+            _ENGINES[conn_string] = engine
+
+        return engine
+
+
+@contextmanager
+def connect(conn_string: str):
+    """Check out a connection from the shared engine, recording how long the checkout waited."""
+
+    engine = get_engine(conn_string)
+    stats = _POOL_STATS[conn_string]
+
+    start = time.perf_counter()
+    conn: Connection = engine.connect()
+    stats["wait_seconds"] += time.perf_counter() - start
+
+    try:
+        yield conn
+
+    finally:
+        conn.close()
+
+
+def log_pool_stats() -> None:
+    """Log checkouts, connects, wait time and overflow for every engine in the registry."""
+
+    with _LOCK:
+        for index, (conn_string, engine) in enumerate(_ENGINES.items()):
+            stats = _POOL_STATS[conn_string]
+
+            logger.info(
+                f"DB pool {index}: {stats['checkouts']} checkouts, {stats['connects']} new connections, "
+                f"{stats['wait_seconds']:.3f}s waited, max overflow {stats['max_overflow']}, "
+                f"status: {engine.pool.status()}"
+            )
+
+
+def dispose_engines() -> None:
+    """Log pool statistics and close all pooled connections. Call once at shutdown."""
+
+    log_pool_stats()
+
+    with _LOCK:
+        for engine in _ENGINES.values():
+            engine.dispose()
+
+        _ENGINES.clear()
+        _POOL_STATS.clear()
+
+
+def _track_pool_stats(engine: Engine) -> dict:
+    stats = {"checkouts": 0, "connects": 0, "wait_seconds": 0.0, "max_overflow": 0}
+
+    @event.listens_for(engine, "connect")
+    def on_connect(dbapi_connection, connection_record):  # pylint: disable=unused-argument
+        stats["connects"] += 1
+
+    @event.listens_for(engine, "checkout")
+    def on_checkout(dbapi_connection, connection_record, connection_proxy):  # pylint: disable=unused-argument
+        stats["checkouts"] += 1
+
+        overflow = getattr(engine.pool, "overflow", None)
+        if overflow is not None:
+            stats["max_overflow"] = max(stats["max_overflow"], overflow())
+
+    return stats
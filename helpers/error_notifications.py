@@ -0,0 +1,319 @@
+"""
+Module for sending error mails as digests, off the item loop.
+
+notify() only puts the error on a queue. A background thread collects the errors, deduplicated by error type and
+message, and sends one digest per ERROR_MAIL_DIGEST_WINDOW_SECONDS - or one per run, if the window is None - over
+an SMTP connection that is kept open between digests. The last digest is sent when the run ends (see close()).
+
+The mail settings are resolved once, through helpers.secrets_provider. With MAIL_BACKEND = "local", mails are
+sent to LOCAL_SMTP_ADDRESS instead, e.g. benchmarks.local_smtp_server, without STARTTLS.
+"""
+
+import atexit
+import html
+import logging
+import queue
+import smtplib
+import threading
+import time
+
+from collections.abc import Callable
+from dataclasses import dataclass, field
+from datetime import datetime
+from email.message import EmailMessage
+
+from helpers import config, secrets_provider
+
+logger = logging.getLogger(__name__)
+
+_CLOSE = object()
+
+
+@dataclass
+class MailSettings:
+    """Where error mails are sent, and from whom"""
+
+    recipient: str
+    sender: str
+    smtp_server: str
+    smtp_port: int
+    starttls: bool = True
+
+
+@dataclass
+class ErrorSummary:
+    """All occurrences of one error type and message in a digest"""
+
+    error_type: str
+    message: str
+    traceback: str
+    process_name: str | None
+    count: int = 0
+    first_seen: datetime = field(default_factory=datetime.now)
+    last_seen: datetime = field(default_factory=datetime.now)
+    screenshot: str | None = None
+
+
+@dataclass
+class _Notification:
+    error_info: dict
+    process_name: str | None
+    grab_screenshot: Callable[[], str] | None
+    seen: datetime = field(default_factory=datetime.now)
+
+
+class ErrorNotifier:
+    """Collects errors on a background thread and mails them as digests"""
+
+    def __init__(self, window_seconds: float | None = None):
+        self.window_seconds = window_seconds
+        self.queue: queue.SimpleQueue = queue.SimpleQueue()
+        self.digest: dict[tuple[str, str], ErrorSummary] = {}
+        self.omitted = 0  # occurrences of errors beyond ERROR_MAIL_MAX_DISTINCT_ERRORS
+        self.digests_sent = 0
+        self._deadline: float | None = None
+        self._settings: MailSettings | None = None
+        self._smtp: smtplib.SMTP | None = None
+        self._thread = threading.Thread(target=self._run, name="error-notifications", daemon=True)
+        self._thread.start()
+
+    def notify(self, error_info: dict, process_name: str | None, grab_screenshot: Callable[[], str] | None) -> None:
+        """Queue an error for the next digest, without waiting for anything."""
+
+        self.queue.put(_Notification(error_info, process_name, grab_screenshot))
+
+    def close(self, timeout: float | None = None) -> None:
+        """Send the last digest and close the SMTP connection, waiting at most timeout seconds."""
+
+        if self._thread.is_alive():
+            self.queue.put(_CLOSE)
+            self._thread.join(timeout)
+
+        if self._thread.is_alive():
+            logger.warning(f"Error digest with {len(self.digest)} errors was not sent within {timeout}s")
+
+    def _run(self) -> None:
+        while True:
+            timeout = None if self._deadline is None else max(self._deadline - time.monotonic(), 0)
+
+            try:
+                notification = self.queue.get(timeout=timeout)
+
+            except queue.Empty:
+                self._send_digest()
+
+                continue
+
+            if notification is _CLOSE:
+                self._send_digest()
+                self._disconnect()
+
+                return
+
+            self._add(notification)
+
+    def _add(self, notification: _Notification) -> None:
+        error_info = notification.error_info
+        key = (str(error_info.get("type")), str(error_info.get("message")))
+
+        summary = self.digest.get(key)
+
+        if summary is None:
+            if len(self.digest) >= config.ERROR_MAIL_MAX_DISTINCT_ERRORS:
+                self.omitted += 1
+
+                return
+
+            summary = self.digest[key] = ErrorSummary(
+                error_type=key[0],
+                message=key[1],
+                traceback=str(error_info.get("traceback") or ""),
+                process_name=notification.process_name,
+                first_seen=notification.seen,
+            )
+
+            # Taken here rather than where the error was raised, so the item loop does not wait for it either
+            screenshots = sum(1 for s in self.digest.values() if s.screenshot)
+
+            if notification.grab_screenshot and screenshots < config.ERROR_MAIL_MAX_SCREENSHOTS:
+                try:
+                    summary.screenshot = notification.grab_screenshot()
+
+                except Exception as e:
+                    logger.warning(f"Could not grab a screenshot for the error digest: {e}")
+
+        summary.count += 1
+        summary.last_seen = notification.seen
+
+        # Windows start with their first error, so a quiet run sends nothing
+        if self._deadline is None and self.window_seconds is not None:
+            self._deadline = time.monotonic() + self.window_seconds
+
+    def _send_digest(self) -> None:
+        self._deadline = None
+
+        if not self.digest:
+            return
+
+        summaries = list(self.digest.values())
+        omitted = self.omitted
+
+        self.digest = {}
+        self.omitted = 0
+
+        try:
+            if self._settings is None:
+                self._settings = mail_settings()
+
+            message = build_digest(summaries, omitted, self._settings)
+
+        except Exception as e:
+            logger.error(f"Could not build the error digest of {len(summaries)} errors: {e}")
+
+            return
+
+        # A connection kept open between digests may have been closed by the server, so one failed send reconnects
+        for attempt in range(2):
+            try:
+                self._connection().send_message(message)
+                self.digests_sent += 1
+
+                logger.info(f"Sent an error digest of {sum(s.count for s in summaries) + omitted} errors")
+
+                return
+
+            except (smtplib.SMTPException, OSError) as e:
+                self._disconnect()
+
+                if attempt:
+                    logger.error(f"Could not send the error digest of {len(summaries)} errors: {e}")
+
+    def _connection(self) -> smtplib.SMTP:
+        if self._smtp is None:
+            self._smtp = open_smtp(self._settings)
+
+        return self._smtp
+
+    def _disconnect(self) -> None:
+        if self._smtp is None:
+            return
+
+        try:
+            self._smtp.quit()
+
+        except (smtplib.SMTPException, OSError):
+            self._smtp.close()
+
+        self._smtp = None
+
+
+_NOTIFIER: ErrorNotifier | None = None
+_LOCK = threading.Lock()
+
+
+def notify(error_info: dict, process_name: str | None = None, grab_screenshot: Callable[[], str] | None = None):
+    """
+    Queue an error, as given by error.__dictinfo__(), for the next error digest. Returns immediately.
+    If grab_screenshot is given, it is called for the first occurrence of the error, to embed in the digest.
+    """
+
+    global _NOTIFIER  # pylint: disable=global-statement
+
+    with _LOCK:
+        if _NOTIFIER is None:
+            _NOTIFIER = ErrorNotifier(config.ERROR_MAIL_DIGEST_WINDOW_SECONDS)
+
+            # The last digest is sent when the run ends, however it ends
+            atexit.register(close)
+
+        _NOTIFIER.notify(error_info, process_name, grab_screenshot)
+
+
+def close() -> None:
+    """Send the queued errors, if any, and stop the background thread."""
+
+    global _NOTIFIER  # pylint: disable=global-statement
+
+    with _LOCK:
+        notifier, _NOTIFIER = _NOTIFIER, None
+
+    if notifier is not None:
+        notifier.close(config.ERROR_MAIL_CLOSE_TIMEOUT_SECONDS)
+
+
+def mail_settings() -> MailSettings:
+    """Return the error mail settings, from the RPA database constants or the local backend."""
+
+    if config.MAIL_BACKEND == "local":
+        host, port = config.LOCAL_SMTP_ADDRESS.rsplit(":", 1)
+
+        return MailSettings("errors@localhost", "formulardata@localhost", host, int(port), starttls=False)
+
+    error_email, error_sender, smtp_server, smtp_port = (
+        constant["value"]
+        for constant in secrets_provider.get_constants("Error Email", "Email Friend", "smtp_server", "smtp_port")
+    )
+
+    return MailSettings(error_email, error_sender, smtp_server, int(smtp_port), starttls=config.ERROR_MAIL_STARTTLS)
+
+
+def open_smtp(settings: MailSettings) -> smtplib.SMTP:
+    """Open an SMTP connection, upgraded with STARTTLS if the settings say so."""
+
+    smtp = smtplib.SMTP(settings.smtp_server, settings.smtp_port)
+
+    try:
+        if settings.starttls:
+            smtp.starttls()
+
+    except Exception:
+        smtp.close()
+
+        raise
+
+    return smtp
+
+
+def build_digest(summaries: list[ErrorSummary], omitted: int, settings: MailSettings) -> EmailMessage:
+    """Build the digest mail of a list of errors."""
+
+    total = sum(summary.count for summary in summaries) + omitted
+    process_names = sorted({summary.process_name for summary in summaries if summary.process_name})
+
+    process_name = ", ".join(process_names) or "Formulardata"
+
+    msg = EmailMessage()
+    msg["to"] = settings.recipient
+    msg["from"] = settings.sender
+    msg["subject"] = f"Error digest: {process_name} - {total} errors, {len(summaries)} distinct"
+
+    sections = []
+
+    for summary in sorted(summaries, key=lambda s: s.count, reverse=True):
+        section = f"""
+                <h3>{summary.count} x {html.escape(summary.error_type)}</h3>
+                <p>Error message: {html.escape(summary.message)}</p>
+                <p>First seen {summary.first_seen:%H:%M:%S}, last seen {summary.last_seen:%H:%M:%S}</p>
+                <pre>{html.escape(summary.traceback)}</pre>
+            """
+
+        if summary.screenshot:
+            section += f'<img src="data:image/png;base64,{summary.screenshot}" alt="Screenshot">'
+
+        sections.append(section)
+
+    if omitted:
+        sections.append(f"<p>{omitted} more errors of other types and messages are not listed.</p>")
+
+    html_message = f"""
+            <html>
+                <body>
+                    {"".join(sections)}
+                </body>
+            </html>
+        """
+
+    msg.set_content("Please enable HTML to view this message.")
+    msg.add_alternative(html_message, subtype="html")
+
+    return msg
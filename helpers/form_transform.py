@@ -0,0 +1,194 @@
+"""
+Module to transform form submissions into Excel rows in batches.
+
+A formular mapping is compiled once into a flat plan of accessors with a precomputed output column order,
+which is then applied to a batch of submissions in a single pass. The output is identical to calling
+helper_functions.transform_form_submission for each submission.
+"""
+
+import ast
+import re
+
+from dataclasses import dataclass
+from datetime import datetime
+from functools import lru_cache
+
+SERIAL_NUMBER_COLUMN = "Serial number"
+CREATED_COLUMN = "Oprettet"
+COMPLETED_COLUMN = "Gennemført"
+
+# Strings without brackets or quotes, and without surrounding whitespace, come out of _clean_value unchanged
+_NEEDS_CLEANING = re.compile(r"""[\[\]'"]|^\s|\s$""")
+
+# Datetimes that can be formatted by slicing, once fromisoformat has validated them
+_ISO_DATETIME = re.compile(r"[1-9]\d{3}-\d{2}-\d{2}[T ](?!24)\d{2}:\d{2}:\d{2}")
+
+# Keyed by id, with the mapping kept in the entry - so an id is never reused while cached, and is checked on lookup
+_COMPILED_MAPPINGS: dict[int, tuple[dict, "CompiledMapping"]] = {}
+
+
+@dataclass(frozen=True)
+class CompiledMapping:
+    """A formular mapping compiled into flat accessors and a fixed output column order"""
+
+    columns: tuple[str, ...]
+    accessors: tuple[tuple[int, str, str | None], ...]  # (column index, source key, nested key or None)
+    serial_index: int
+    created_index: int
+    completed_index: int
+
+
+def compile_mapping(mapping: dict) -> CompiledMapping:
+    """
+    Compile a formular mapping, supporting both flat and nested mappings (e.g., tables of questions).
+    Compiled mappings are cached, since the mappings in helpers.formular_mappings never change.
+    """
+
+    cached = _COMPILED_MAPPINGS.get(id(mapping))
+
+    if cached is not None and cached[0] is mapping:
+        return cached[1]
+
+    columns: list[str] = []
+    column_indexes: dict[str, int] = {}
+    accessors = []
+
+    def column_index(column: str) -> int:
+        if column not in column_indexes:
+            column_indexes[column] = len(columns)
+            columns.append(column)
+
+        return column_indexes[column]
+
+    for source_key, target in mapping.items():
+        if isinstance(target, dict):
+            for nested_key, output_column in target.items():
+                accessors.append((column_index(output_column), source_key, nested_key))
+
+        else:
+            accessors.append((column_index(target), source_key, None))
+
+    # Entity columns missing from the mapping are added last, like in transform_form_submission
+    serial_index = column_index(SERIAL_NUMBER_COLUMN)
+    created_index = column_index(CREATED_COLUMN)
+    completed_index = column_index(COMPLETED_COLUMN)
+
+    compiled = CompiledMapping(
+        columns=tuple(columns),
+        accessors=tuple(accessors),
+        serial_index=serial_index,
+        created_index=created_index,
+        completed_index=completed_index,
+    )
+
+    _COMPILED_MAPPINGS[id(mapping)] = (mapping, compiled)
+
+    return compiled
+
+
+def transform_to_columns(compiled: CompiledMapping, submissions: list[tuple]) -> dict[str, list]:
+    """
+    Transform a batch of (form_serial_number, form) tuples into column arrays, keyed by output column
+    in the compiled column order.
+    """
+
+    column_count = len(compiled.columns)
+    arrays: list[list] = [[None] * len(submissions) for _ in range(column_count)]
+
+    created_raws = []
+    completed_raws = []
+
+    for row_index, (form_serial_number, form) in enumerate(submissions):
+        form_data = form.get("data", {})
+
+        for index, source_key, nested_key in compiled.accessors:
+            if nested_key is None:
+                arrays[index][row_index] = clean_value(form_data.get(source_key))
+
+            else:
+                arrays[index][row_index] = clean_value(form_data.get(source_key, {}).get(nested_key))
+
+        entity = form.get("entity", {})
+        arrays[compiled.serial_index][row_index] = form_serial_number
+        created_raws.append(_raw_datetime(entity, "created"))
+        completed_raws.append(_raw_datetime(entity, "completed"))
+
+    arrays[compiled.created_index] = format_datetimes(created_raws)
+    arrays[compiled.completed_index] = format_datetimes(completed_raws)
+
+    return dict(zip(compiled.columns, arrays))
+
+
+def transform_to_rows(compiled: CompiledMapping, submissions: list[tuple]) -> list[dict]:
+    """Transform a batch of (form_serial_number, form) tuples into row dicts, in the compiled column order."""
+
+    columns = transform_to_columns(compiled, submissions)
+
+    return [dict(zip(compiled.columns, values)) for values in zip(*columns.values())]
+
+
+def clean_value(value):
+    """Cleans and flattens lists or JSON-encoded strings. Same output as helper_functions._clean_value."""
+
+    if isinstance(value, str):
+        value = value.replace("\r\n", ". ").replace("\n", ". ")
+
+        # Fast path - only strings that look like a literal can be changed by the slow path
+        if not _NEEDS_CLEANING.search(value):
+            return value
+
+        return _clean_string(value)
+
+    if isinstance(value, list):
+        return ", ".join(str(v) for v in value)
+
+    return value
+
+
+@lru_cache(maxsize=65536)
+def _clean_string(value: str) -> str:
+    # Memoized, since answers repeat constantly across submissions
+    try:
+        parsed = ast.literal_eval(value)
+
+    except Exception:
+        return value.strip("[]").replace("'", "").replace('"', "").strip()
+
+    if isinstance(parsed, list):
+        return ", ".join(str(v) for v in parsed)
+
+    return value
+
+
+def format_datetimes(raws: list) -> list:
+    """
+    Format a column of raw ISO datetimes as "%Y-%m-%d %H:%M:%S", or None where a value is missing or invalid.
+    Common ISO strings are validated with fromisoformat and formatted by slicing instead of strftime.
+    """
+
+    formatted = []
+
+    for raw in raws:
+        try:
+            parsed = datetime.fromisoformat(raw)
+
+        except Exception:
+            formatted.append(None)
+
+            continue
+
+        if _ISO_DATETIME.match(raw):
+            formatted.append(f"{raw[:10]} {raw[11:19]}")
+
+        else:
+            formatted.append(parsed.strftime("%Y-%m-%d %H:%M:%S"))
+
+    return formatted
+
+
+def _raw_datetime(entity, key):
+    try:
+        return entity[key][0]["value"]
+
+    except Exception:
+        return None
@@ -1,21 +1,32 @@
 """Script to upload fetch an OS2-formular submission and upload it in pdf format to Sharepoint."""
 
 import json
+import logging
+import math
+import time
+
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
-import urllib.parse
 from urllib.parse import unquote, urlparse
 
 import ast
 
+from collections.abc import Iterator
+
+from contextlib import contextmanager
+
 from datetime import datetime
 
+from typing import BinaryIO
+
 import requests
 
-import pandas as pd
+from mbu_msoffice_integration.sharepoint_class import Sharepoint
 
-from sqlalchemy import create_engine
+from helpers import ats_reference_index, config, metrics, query_builder, sharepoint_rest
+from helpers.watermark import make_watermark, watermark_since
 
-from mbu_msoffice_integration.sharepoint_class import Sharepoint
+logger = logging.getLogger(__name__)
 
 
 def transform_form_submission(form_serial_number: str, form: dict, mapping: dict) -> dict:
@@ -69,81 +80,255 @@ def _parse_datetime(entity, key):
 
 def get_workqueue_items(url, token, workqueue_id):
     """
-    Retrieve items from the specified workqueue.
-    If the queue is empty, return an empty list.
+    Retrieve the references of the items in the specified workqueue, across all pages.
+    If the queue is empty, return an empty set.
     """
 
-    workqueue_items = set()
-
-    if not url or not token:
-        raise EnvironmentError("ATS_URL or ATS_TOKEN is not set in the environment")
+    return ats_reference_index.get_references(url, token, workqueue_id)
 
-    headers = {"Authorization": f"Bearer {token}"}
 
-    full_url = f"{url}/workqueues/{workqueue_id}/items"
-
-    response = requests.get(full_url, headers=headers, timeout=60)
+def get_forms_data(conn_string: str, form_type: str, watermark: dict | None = None) -> list[dict]:
+    """
+    Retrieve form_data['data'] for all matching submissions for the given form type,
+    excluding purged entries.
 
-    res_json = response.json().get("items", [])
+    If a high-water mark is given, only submissions from the mark onwards (minus the configured lookback) are read.
+    Prefer iter_forms_data, which does not hold the full result set in memory and also yields the mark of each row.
+    """
 
-    for row in res_json:
-        ref = row.get("reference")
+    return [
+        parsed for parsed, _ in iter_forms_data(conn_string=conn_string, form_type=form_type, watermark=watermark)
+    ]
+
+
+def iter_forms_data(
+    conn_string: str,
+    form_type: str,
+    watermark: dict | None = None,
+    known_serials: set | None = None,
+    stop_after_known: int = 0,
+    stop_below_serial: float = math.inf,
+    batch_size: int | None = None,
+    data_keys: list[str] | None = None,
+) -> Iterator[tuple[dict, dict]]:
+    """
+    Stream the parsed form_data of all matching submissions for the given form type, newest first,
+    excluding purged entries. Rows are fetched from the cursor in bounded batches and parsed one at a time.
 
-        workqueue_items.add(ref)
+    If a high-water mark is given, only submissions from the mark onwards (minus the configured lookback)
+    are queried - otherwise all submissions are scanned.
 
-    return workqueue_items
+    If known_serials and stop_after_known are given, reading stops once that many consecutive submissions
+    have a serial number that is already known. Only submissions with a serial number below stop_below_serial
+    count - e.g. the lowest serial number of a work item that is not written yet, so its submissions are never
+    skipped.
 
+    If data_keys is given, only those keys of form_data['data'] are projected in SQL.
 
-def get_forms_data(conn_string: str, form_type: str) -> list[dict]:
+    Yields tuples of the parsed submission and the mark of the row it came from.
     """
-    Retrieve form_data['data'] for all matching submissions for the given form type,
-    excluding purged entries.
+
+    for _, parsed, row_watermark in iter_multi_forms_data(
+        conn_string=conn_string,
+        form_watermarks={form_type: watermark},
+        known_serials={form_type: known_serials or set()},
+        stop_after_known=stop_after_known,
+        stop_below_serials={form_type: stop_below_serial},
+        batch_size=batch_size,
+        form_projections=None if data_keys is None else {form_type: data_keys},
+    ):
+        yield parsed, row_watermark
+
+
+def iter_multi_forms_data(
+    conn_string: str,
+    form_watermarks: dict[str, dict | None],
+    known_serials: dict[str, set] | None = None,
+    stop_after_known: int = 0,
+    stop_below_serials: dict[str, float] | None = None,
+    batch_size: int | None = None,
+    form_projections: dict[str, list[str]] | None = None,
+) -> Iterator[tuple[str, dict, dict]]:
     """
+    Stream the parsed form_data of all matching submissions for several form types using a single query.
+    Rows are grouped by form type and ordered newest first within each form type.
+
+    form_watermarks maps each form type to its high-water mark, or None to scan all of its submissions.
+    Early stopping (see iter_forms_data) is tracked per form type, with the serial number bound of each form type
+    in stop_below_serials - the rest of a stopped form's rows are skipped without being parsed, and the query is
+    closed once every form type has stopped.
 
-    query = """
-        SELECT
-            form_id,
-            form_data,
-            CAST(form_submitted_date AS datetime) AS form_submitted_date
-        FROM
-            [RPA].[journalizing].view_Journalizing
-        WHERE
-            form_type = ?
-            AND form_data IS NOT NULL
-            AND form_submitted_date IS NOT NULL
-        ORDER BY form_submitted_date DESC
+    form_projections maps each form type to the keys of form_data['data'] to project in SQL
+    (see helpers.query_builder). If None, the whole form_data document is fetched and parsed.
+
+    Yields tuples of the form type, the parsed submission and the mark of the row it came from.
     """
 
-    # Create SQLAlchemy engine
-    encoded_conn_str = urllib.parse.quote_plus(conn_string)
-    engine = create_engine(f"mssql+pyodbc:///?odbc_connect={encoded_conn_str}")
+    _log_scan_ranges(form_watermarks)
 
-    try:
-        df = pd.read_sql(sql=query, con=engine, params=(form_type,))
+    form_types = list(form_watermarks)
+    early_stop = _EarlyStop(known_serials or {}, stop_after_known, stop_below_serials or {})
+    row_counts = dict.fromkeys(form_types, 0)
+
+    # Imported here, so modes that never query the database do not load sqlalchemy
+    from helpers import db  # pylint: disable=import-outside-toplevel
+
+    with db.connect(conn_string) as conn:
+        query, params = query_builder.build_forms_query(
+            dialect=conn.dialect.name,
+            form_watermarks=form_watermarks,
+            form_projections=form_projections,
+        )
+
+        try:
+            # The driver streams the result set, so only one batch of raw rows is held at a time
+            result = conn.exec_driver_sql(query, tuple(params))
+
+        except Exception as e:
+            logger.error(f"Error during query execution: {e}")
+
+            raise
+
+        for batch in _fetch_batches(result, batch_size or config.FORMS_FETCH_BATCH_SIZE):
+            # Parsing is timed per row and recorded per form type once the batch is done
+            parse_seconds = dict.fromkeys(form_types, 0.0)
+            parse_rows = dict.fromkeys(form_types, 0)
+
+            for row in batch:
+                form_type, form_id, form_submitted_date = row[:3]
+
+                if early_stop.has_stopped(form_type):
+                    continue
+
+                row_counts[form_type] += 1
+                parse_rows[form_type] += 1
+                parse_started = time.perf_counter()
+                parsed = _parse_row(row, projected=form_projections is not None)
+                parse_seconds[form_type] += time.perf_counter() - parse_started
+
+                if parsed is None:
+                    continue
+
+                early_stop.count(form_type, _serial_number(parsed))
+
+                yield form_type, parsed, _row_watermark(form_submitted_date, form_id)
+
+            for form_type, rows in parse_rows.items():
+                if rows:
+                    metrics.record("json_parse", parse_seconds[form_type], form=form_type, rows=rows)
+
+            if all(early_stop.has_stopped(form_type) for form_type in form_types):
+                result.close()
 
-    except Exception as e:
-        print("Error during pd.read_sql:", e)
+                return
 
-        raise
+    for form_type, row_count in row_counts.items():
+        if row_count == 0:
+            logger.info(f"{form_type}: No submissions found for the given form type.")
 
-    if df.empty:
-        print("No submissions found for the given form type.")
 
-        return []
+class _EarlyStop:
+    """Per form type count of consecutive submissions with a known serial number, for stopping a read early"""
 
-    extracted_data = []
+    def __init__(self, known_serials: dict[str, set], stop_after_known: int, stop_below_serials: dict[str, float]):
+        self.known_serials = known_serials
+        self.stop_after_known = stop_after_known
+        self.stop_below_serials = stop_below_serials
+        self.known_in_a_row: dict[str, int] = {}
+        self.stopped: set[str] = set()
 
-    for _, row in df.iterrows():
+    def count(self, form_type: str, serial) -> None:
+        """Count a submission read for the form type, stopping the form type once enough known ones are in a row."""
+
+        form_known_serials = self.known_serials.get(form_type)
+
+        # Submissions at or above the bound may belong to a work item that is not written yet, so they never count
+        if not self.stop_after_known or not form_known_serials or not self._is_below_bound(form_type, serial):
+            return
+
+        if serial not in form_known_serials:
+            self.known_in_a_row[form_type] = 0
+
+            return
+
+        self.known_in_a_row[form_type] = self.known_in_a_row.get(form_type, 0) + 1
+
+        if self.known_in_a_row[form_type] >= self.stop_after_known:
+            logger.info(f"{form_type}: Stopping early after {self.known_in_a_row[form_type]} known submissions in a row.")
+            self.stopped.add(form_type)
+
+    def has_stopped(self, form_type: str) -> bool:
+        """Return whether the rest of the form type's submissions are skipped."""
+
+        return form_type in self.stopped
+
+    def _is_below_bound(self, form_type: str, serial) -> bool:
         try:
-            parsed = json.loads(row["form_data"])
+            return int(serial) < self.stop_below_serials.get(form_type, math.inf)
+
+        except (TypeError, ValueError):
+            return False
+
+
+def _log_scan_ranges(form_watermarks: dict[str, dict | None]) -> None:
+    for form_type, watermark in form_watermarks.items():
+        since = watermark_since(watermark)
+
+        if since is None:
+            logger.info(f"{form_type}: No watermark found - scanning all submissions.")
+
+        else:
+            logger.info(f"{form_type}: Incremental scan of submissions since {since}.")
+
+
+def _fetch_batches(result, batch_size: int) -> Iterator[list]:
+    while True:
+        fetch_started = time.perf_counter()
+        batch = result.fetchmany(batch_size)
+        fetch_seconds = time.perf_counter() - fetch_started
 
-            if "purged" not in parsed:  # Skip purged entries
-                extracted_data.append(parsed)
+        if not batch:
+            return
 
-        except json.JSONDecodeError:
-            print("Invalid JSON in form_data, skipping row.")
+        metrics.record("db_fetch", fetch_seconds, rows=len(batch), bytes_in=sum(_row_bytes(row) for row in batch))
+
+        yield batch
+
+
+def _parse_row(row, projected: bool) -> dict | None:
+    # Returns None for rows that are skipped - purged entries are already filtered in SQL when projected
+    if projected:
+        return query_builder.parse_projected_row(row)
+
+    try:
+        parsed = json.loads(row[3])
+
+    except json.JSONDecodeError:
+        logger.warning("Invalid JSON in form_data, skipping row.")
+
+        return None
+
+    return None if "purged" in parsed else parsed
+
+
+def _row_bytes(row) -> int:
+    # The size of the submission's text columns, i.e. form_data or the projected columns
+    return sum(len(value) for value in row[3:] if isinstance(value, (str, bytes)))
+
+
+def _serial_number(form: dict):
+    try:
+        return form["entity"]["serial"][0]["value"]
+
+    except (KeyError, IndexError, TypeError):
+        return None
 
-    return extracted_data
+
+def _row_watermark(form_submitted_date, form_id) -> dict:
+    if isinstance(form_submitted_date, str):
+        form_submitted_date = datetime.fromisoformat(form_submitted_date)
+
+    return make_watermark(form_submitted_date, form_id)
 
 
 def upload_pdf_to_sharepoint(
@@ -151,44 +336,153 @@ def upload_pdf_to_sharepoint(
     folder_name: str,
     os2_api_key: str,
     file_url: str,
-) -> None:
+) -> dict:
     """Main function to upload a PDF to Sharepoint."""
 
-    print("Upload PDF to Sharepoint started.")
+    return upload_pdfs_to_sharepoint(sharepoint_api, folder_name, os2_api_key, {"": file_url})
+
+
+def upload_pdfs_to_sharepoint(
+    sharepoint_api: Sharepoint,
+    folder_name: str,
+    os2_api_key: str,
+    pdf_urls: dict[str, str],
+    sharepoint_kwargs: dict | None = None,
+) -> dict:
+    """
+    Upload the PDFs of several submissions to Sharepoint, given as {serial number: PDF url}.
+
+    The folder is listed once with sharepoint_api, and PDFs already in it are skipped. The rest are downloaded from
+    the OS2Forms API and uploaded with PDF_TRANSFER_MAX_RETRIES retries per file. A client context must not be shared
+    between threads, so the transfers only run in parallel when sharepoint_kwargs is given - each of the at most
+    PDF_TRANSFER_CONCURRENCY transfers in flight then leases a client for the same site from helpers.sharepoint_pool.
+    Otherwise they run one at a time on sharepoint_api.
+
+    Returns a summary with the uploaded, skipped and failed file names, the failed ones with their error.
+    """
+
+    logger.info(f"Upload of {len(pdf_urls)} PDFs to Sharepoint started.")
+
+    existing_pdf_names = {file["Name"] for file in sharepoint_rest.list_files(sharepoint_api, folder_name)}
+
+    summary = {"uploaded": [], "skipped": [], "failed": {}}
+    transfers = {}
+
+    for file_url in pdf_urls.values():
+        final_filename = pdf_file_name(file_url)
+
+        if final_filename in existing_pdf_names or final_filename in transfers:
+            summary["skipped"].append(final_filename)
+
+            continue
 
-    existing_pdfs = sharepoint_api.fetch_files_list(folder_name=folder_name)
+        transfers[final_filename] = file_url
 
-    if existing_pdfs:
-        existing_pdf_names = {file["Name"] for file in existing_pdfs}
+    if sharepoint_kwargs is None:
+        errors = {
+            final_filename: _try_transfer_pdf(sharepoint_api, folder_name, os2_api_key, file_url, final_filename)
+            for final_filename, file_url in transfers.items()
+        }
 
     else:
-        existing_pdf_names = set()
+        with ThreadPoolExecutor(max_workers=config.PDF_TRANSFER_CONCURRENCY) as executor:
+            futures = {
+                executor.submit(
+                    _transfer_pdf_with_leased_client, sharepoint_kwargs, sharepoint_api, folder_name, os2_api_key,
+                    file_url, final_filename,
+                ): final_filename
+                for final_filename, file_url in transfers.items()
+            }
 
-    path = urlparse(file_url).path
-    filename = path.split("/")[-1]
-    final_filename = f"{unquote(filename)}"
+            errors = {futures[future]: future.result() for future in as_completed(futures)}
 
-    print(file_url)
-    print(final_filename)
+    for final_filename, error in errors.items():
+        if error is None:
+            summary["uploaded"].append(final_filename)
+
+        else:
+            summary["failed"][final_filename] = error
+            logger.error(f"Failed to transfer {final_filename}: {error}")
+
+    logger.info(
+        f"PDF upload finished - {len(summary['uploaded'])} uploaded, {len(summary['skipped'])} already in Sharepoint, "
+        f"{len(summary['failed'])} failed."
+    )
+
+    return summary
+
+
+def pdf_file_name(file_url: str) -> str:
+    """Return the file name a PDF is stored under in Sharepoint - the unquoted last part of its url."""
+
+    return unquote(urlparse(file_url).path.split("/")[-1])
 
-    if final_filename in existing_pdf_names:
-        print(f"File {final_filename} already exists in Sharepoint. Skipping download.")
 
-        return
+def _transfer_pdf_with_leased_client(
+    sharepoint_kwargs: dict,
+    sharepoint_api: Sharepoint,
+    folder_name: str,
+    os2_api_key: str,
+    file_url: str,
+    final_filename: str,
+) -> str | None:
+    # Imported here, so modes that never upload do not load the client pool
+    from helpers import sharepoint_pool  # pylint: disable=import-outside-toplevel
 
-    print("Downloading PDF from OS2Forms API.")
     try:
-        downloaded_file = download_file_bytes(file_url, os2_api_key)
+        leased_api = sharepoint_pool.checkout_client(
+            sharepoint_kwargs,
+            site_url=sharepoint_api.site_url,
+            site_name=sharepoint_api.site_name,
+            document_library=sharepoint_api.document_library,
+        )
 
-    except requests.RequestException as error:
-        print(f"Failed to download file: {error}")
+    except Exception as error:
+        return f"could not authenticate to SharePoint: {error}"
+
+    try:
+        return _try_transfer_pdf(leased_api, folder_name, os2_api_key, file_url, final_filename)
+
+    finally:
+        sharepoint_pool.return_client(leased_api)
 
-    # Upload the file to Sharepoint
-    sharepoint_api.upload_file_from_bytes(
-        binary_content=downloaded_file,
-        file_name=final_filename,
-        folder_name=folder_name,
-    )
+
+def _try_transfer_pdf(
+    sharepoint_api: Sharepoint,
+    folder_name: str,
+    os2_api_key: str,
+    file_url: str,
+    final_filename: str,
+) -> str | None:
+    # Returns the error of a failed transfer, so every failure ends up in the summary - None if it succeeded
+    try:
+        _transfer_pdf(sharepoint_api, folder_name, os2_api_key, file_url, final_filename)
+
+        return None
+
+    except Exception as error:
+        return f"{type(error).__name__}: {error}"
+
+
+def _transfer_pdf(sharepoint_api: Sharepoint, folder_name: str, os2_api_key: str, file_url: str, final_filename: str):
+    for attempt in range(1, config.PDF_TRANSFER_MAX_RETRIES + 2):
+        try:
+            # The download is piped into the upload chunk by chunk, instead of being read into memory first
+            with open_file_stream(file_url, os2_api_key) as pdf_stream:
+                sharepoint_rest.upload_file(sharepoint_api, folder_name, final_filename, pdf_stream)
+
+            return
+
+        # Only network and HTTP errors are retried - any other error fails the transfer at once
+        except requests.RequestException as error:
+            if attempt > config.PDF_TRANSFER_MAX_RETRIES:
+                raise
+
+            backoff = config.RETRY_BASE_DELAY * (2 ** (attempt - 1))
+
+            logger.warning(f"Failed to transfer {final_filename} (attempt {attempt}): {error}. Retrying in {backoff:.2f}s.")
+
+            time.sleep(backoff)
 
 
 def download_file_bytes(url: str, os2_api_key: str) -> bytes:
@@ -213,3 +507,29 @@ def download_file_bytes(url: str, os2_api_key: str) -> bytes:
     response.raise_for_status()
 
     return response.content
+
+
+@contextmanager
+def open_file_stream(url: str, os2_api_key: str) -> Iterator[BinaryIO]:
+    """Opens a streamed download of a file from the OS2Forms API, as a readable file-like object.
+
+    Parameters:
+    url (str): The URL from which the file will be downloaded.
+    os2_api_key (str): The API-key for OS2Forms api.
+
+    Yields:
+    BinaryIO: The response body, read from the connection as it is consumed.
+
+    Raises:
+    requests.RequestException: If the HTTP request fails for any reason.
+    """
+
+    headers = {"Content-Type": "application/json", "api-key": f"{os2_api_key}"}
+
+    with requests.get(url, headers=headers, timeout=60, stream=True) as response:
+        response.raise_for_status()
+
+        # Decode any transfer compression while reading, like response.content does
+        response.raw.decode_content = True
+
+        yield response.raw
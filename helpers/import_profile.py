@@ -0,0 +1,99 @@
+"""
+Module to profile the import time of each mode of main.py.
+
+Each mode is imported in a fresh interpreter with -X importtime, so the numbers match a cold start of the process.
+The report lists the slowest modules per mode and fails if a mode exceeds its import time budget, or loads a module
+that it should only load on first use.
+"""
+
+import os
+import subprocess
+import sys
+import time
+
+from helpers import config
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+REPORT_TOP_MODULES = 15
+
+
+def profile_mode(mode: str) -> dict:
+    """
+    Import main.py and the modules of a mode in a fresh interpreter.
+    Returns the wall time in seconds and a list of (module, self us, cumulative us) in import order.
+    """
+
+    code = f"import importlib, main; [importlib.import_module(m) for m in main.MODE_MODULES[{mode!r}]]"
+
+    start = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=REPO_DIR,
+        capture_output=True,
+        text=True,
+        check=False,
+    )
+    wall_time = time.perf_counter() - start
+
+    if result.returncode != 0:
+        raise RuntimeError(f"Importing mode {mode} failed:\n{result.stderr[-2000:]}")
+
+    return {"wall_time": wall_time, "modules": parse_importtime(result.stderr)}
+
+
+def parse_importtime(output: str) -> list[tuple[str, int, int]]:
+    """Parse -X importtime output into (module, self us, cumulative us) tuples, nested modules keep their indent."""
+
+    modules = []
+
+    for line in output.splitlines():
+        if not line.startswith("import time:"):
+            continue
+
+        try:
+            self_us, cumulative_us, module = line[len("import time:"):].split("|", 2)
+            modules.append((module.rstrip()[1:], int(self_us), int(cumulative_us)))
+
+        except ValueError:
+            continue  # the header line
+
+    return modules
+
+
+def import_time(profile: dict) -> float:
+    """Return the seconds a profiled mode spent importing, the cumulative time of its top level imports."""
+
+    return sum(cumulative_us for name, _, cumulative_us in profile["modules"] if not name.startswith(" ")) / 1_000_000
+
+
+def report(modes: list[str]) -> int:
+    """Print an import time report for the modes. Returns 1 if any mode is over budget, else 0."""
+
+    exit_code = 0
+
+    for mode in modes:
+        profile = profile_mode(mode)
+
+        top_level = [m for m in profile["modules"] if not m[0].startswith(" ")]
+        mode_import_time = import_time(profile)
+        loaded = {name.strip() for name, _, _ in profile["modules"]}
+
+        budget = config.IMPORT_TIME_BUDGET_SECONDS.get(mode)
+        deferred = [m for m in config.DEFERRED_IMPORTS.get(mode, ()) if m in loaded]
+
+        print(f"\n{mode}: {mode_import_time:.3f}s importing {len(loaded)} modules ({profile['wall_time']:.3f}s wall time)")
+        print(f"{'self ms':>10} {'cumul. ms':>10}  module")
+
+        for name, self_us, cumulative_us in sorted(top_level, key=lambda m: m[2], reverse=True)[:REPORT_TOP_MODULES]:
+            print(f"{self_us / 1000:>10.1f} {cumulative_us / 1000:>10.1f}  {name}")
+
+        if budget is not None and mode_import_time > budget:
+            print(f"FAIL: {mode} imports in {mode_import_time:.3f}s, the budget is {budget:.3f}s")
+            exit_code = 1
+
+        if deferred:
+            print(f"FAIL: {mode} loads {', '.join(deferred)} at startup, instead of on first use")
+            exit_code = 1
+
+    return exit_code
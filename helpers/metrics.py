@@ -0,0 +1,263 @@
+"""
+Module for timing and throughput metrics of the stages of a run.
+
+Stages are measured with spans, e.g. `with metrics.span("transform", form=form_id) as span: span.add(rows=n)`,
+recording duration, rows and bytes in and out. Spans are aggregated per stage and form - a span without a form
+inherits the form of the span it is nested in. Nested stages are included in the time of their parents.
+
+Every span is recorded in the run's totals, and in any collector opened with collect() in the same context, e.g.
+for the metrics of a single work item. The current collector and form are context variables, so they follow
+asyncio tasks and asyncio.to_thread - spans in plain worker threads are only recorded in the run's totals.
+
+When a run ends, its summary is written as JSON to METRICS_DIR, and as a Prometheus textfile to
+METRICS_PROMETHEUS_TEXTFILE_DIR if set.
+"""
+
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+
+from collections.abc import Iterator
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import asdict, dataclass, field
+from datetime import datetime
+
+from helpers import config
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class StageMetrics:
+    """Aggregated metrics of one stage for one form"""
+
+    count: int = 0
+    seconds: float = 0.0
+    max_seconds: float = 0.0
+    rows: int = 0
+    bytes_in: int = 0
+    bytes_out: int = 0
+
+
+@dataclass
+class Span:
+    """Rows and bytes handled by a running span"""
+
+    rows: int = 0
+    bytes_in: int = 0
+    bytes_out: int = 0
+
+    def add(self, rows: int = 0, bytes_in: int = 0, bytes_out: int = 0) -> None:
+        """Count rows and bytes handled in the span."""
+
+        self.rows += rows
+        self.bytes_in += bytes_in
+        self.bytes_out += bytes_out
+
+
+@dataclass
+class Collector:
+    """Stage metrics recorded while the collector is open, and in its parent collectors"""
+
+    parent: "Collector | None" = None
+    started: float = field(default_factory=time.perf_counter)
+    stages: dict[tuple[str, str], StageMetrics] = field(default_factory=dict)
+    lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    def record(self, stage: str, form: str, seconds: float, rows: int, bytes_in: int, bytes_out: int) -> None:
+        """Add a measurement to the stage's totals here and in every parent collector."""
+
+        collector = self
+
+        while collector is not None:
+            with collector.lock:
+                metrics = collector.stages.setdefault((stage, form), StageMetrics())
+
+                metrics.count += 1
+                metrics.seconds += seconds
+                metrics.max_seconds = max(metrics.max_seconds, seconds)
+                metrics.rows += rows
+                metrics.bytes_in += bytes_in
+                metrics.bytes_out += bytes_out
+
+            collector = collector.parent
+
+    def summary(self) -> dict:
+        """Return the elapsed time and the metrics of each stage, slowest stage first."""
+
+        with self.lock:
+            stages = sorted(self.stages.items(), key=lambda entry: entry[1].seconds, reverse=True)
+
+            return {
+                "seconds": round(time.perf_counter() - self.started, 3),
+                "stages": [
+                    {
+                        "stage": stage,
+                        "form": form,
+                        **asdict(metrics),
+                        "rows_per_second": metrics.rows / metrics.seconds if metrics.seconds else None,
+                    }
+                    for (stage, form), metrics in stages
+                ],
+            }
+
+
+_RUN = Collector()
+_COLLECTOR: ContextVar[Collector | None] = ContextVar("metrics_collector", default=None)
+_FORM: ContextVar[str] = ContextVar("metrics_form", default="")
+
+
+@contextmanager
+def span(stage: str, form: str | None = None) -> Iterator[Span]:
+    """Measure a stage - the yielded span counts the rows and bytes it handles."""
+
+    form = form or _FORM.get()
+    token = _FORM.set(form)
+
+    current = Span()
+    started = time.perf_counter()
+
+    try:
+        yield current
+
+    finally:
+        _FORM.reset(token)
+        record(stage, time.perf_counter() - started, form, current.rows, current.bytes_in, current.bytes_out)
+
+
+def record(stage: str, seconds: float, form: str | None = None, rows: int = 0, bytes_in: int = 0, bytes_out: int = 0):
+    """Record a measurement taken without a span, e.g. time accumulated over many small steps."""
+
+    (_COLLECTOR.get() or _RUN).record(stage, form or _FORM.get(), seconds, rows, bytes_in, bytes_out)
+
+
+@contextmanager
+def collect() -> Iterator[Collector]:
+    """Collect the metrics of the spans in this context separately, while still recording them in the run's totals."""
+
+    collector = Collector(parent=_COLLECTOR.get() or _RUN)
+    token = _COLLECTOR.set(collector)
+
+    try:
+        yield collector
+
+    finally:
+        _COLLECTOR.reset(token)
+
+
+@contextmanager
+def run(mode: str) -> Iterator[Collector]:
+    """Measure a run of a mode, e.g. "queue", and write its summary when it ends."""
+
+    global _RUN  # pylint: disable=global-statement
+
+    _RUN = Collector()
+    started = datetime.now()
+
+    try:
+        yield _RUN
+
+    finally:
+        summary = {"mode": mode, "started": started.isoformat(timespec="seconds"), **_RUN.summary()}
+
+        try:
+            write_summary(summary)
+
+        except OSError as e:
+            logger.warning(f"Could not write the metrics summary: {e}")
+
+        for stage in summary["stages"][:10]:
+            logger.info(
+                f"Metrics - {stage['stage']} {stage['form'] or ''}: {stage['seconds']:.2f}s in {stage['count']} spans, "
+                f"{stage['rows']} rows, {stage['bytes_in']} bytes in, {stage['bytes_out']} bytes out"
+            )
+
+
+def item_summary(collector: Collector) -> str:
+    """Return a compact JSON summary of a collector, small enough for a work item's status message."""
+
+    summary = collector.summary()
+
+    return json.dumps({
+        "seconds": summary["seconds"],
+        "stages": {
+            stage["stage"]: {
+                "seconds": round(stage["seconds"], 3),
+                "rows": stage["rows"],
+                "bytes_in": stage["bytes_in"],
+                "bytes_out": stage["bytes_out"],
+            }
+            for stage in summary["stages"]
+        },
+    }, separators=(",", ":"))
+
+
+def write_summary(summary: dict) -> None:
+    """Write a run summary as JSON to METRICS_DIR, and as a Prometheus textfile if a textfile dir is configured."""
+
+    os.makedirs(config.METRICS_DIR, exist_ok=True)
+
+    started = summary["started"].replace(":", "")
+    _write_atomically(
+        os.path.join(config.METRICS_DIR, f"run-{started}-{summary['mode']}.json"),
+        json.dumps(summary, indent=2),
+    )
+
+    if config.METRICS_PROMETHEUS_TEXTFILE_DIR:
+        os.makedirs(config.METRICS_PROMETHEUS_TEXTFILE_DIR, exist_ok=True)
+
+        _write_atomically(
+            os.path.join(config.METRICS_PROMETHEUS_TEXTFILE_DIR, f"formulardata_{summary['mode']}.prom"),
+            prometheus_text(summary),
+        )
+
+
+def prometheus_text(summary: dict) -> str:
+    """Return a run summary in the Prometheus text exposition format."""
+
+    mode = _label_value(summary["mode"])
+
+    lines = [
+        "# HELP formulardata_run_seconds Duration of the last run.",
+        "# TYPE formulardata_run_seconds gauge",
+        f'formulardata_run_seconds{{mode="{mode}"}} {summary["seconds"]}',
+    ]
+
+    for name, key, description in (
+        ("formulardata_stage_seconds", "seconds", "Time spent in a stage in the last run."),
+        ("formulardata_stage_spans", "count", "Number of times a stage was measured in the last run."),
+        ("formulardata_stage_rows", "rows", "Rows handled by a stage in the last run."),
+        ("formulardata_stage_bytes_in", "bytes_in", "Bytes read by a stage in the last run."),
+        ("formulardata_stage_bytes_out", "bytes_out", "Bytes written by a stage in the last run."),
+    ):
+        lines.append(f"# HELP {name} {description}")
+        lines.append(f"# TYPE {name} gauge")
+
+        for stage in summary["stages"]:
+            labels = f'mode="{mode}",stage="{_label_value(stage["stage"])}",form="{_label_value(stage["form"])}"'
+            lines.append(f"{name}{{{labels}}} {stage[key]}")
+
+    return "\n".join(lines) + "\n"
+
+
+def _label_value(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _write_atomically(path: str, content: str) -> None:
+    # The textfile collector may read at any time, so files are replaced whole - and concurrent runs of a mode
+    # each write a temp file of their own, which the collector skips as it does not end in .prom
+    with tempfile.NamedTemporaryFile("w", dir=os.path.dirname(path), suffix=".tmp", delete=False, encoding="utf-8") as f:
+        f.write(content)
+
+    try:
+        os.replace(f.name, path)
+
+    except OSError:
+        os.remove(f.name)
+
+        raise
@@ -0,0 +1,200 @@
+"""
+Module for the formats work item submissions are stored in.
+
+Submissions are a list of row dicts, or, with WORK_ITEM_FORMAT = "columns", a columnar table with the column names
+once and one array of values per column: {"version": 1, "format": "columns", "columns": [...], "row_count": n,
+"arrays": [...]}. Columns with few distinct values are dictionary encoded as {"dictionary": [...], "codes": [...]}.
+
+With WORK_ITEM_COMPRESSION set, either format is stored in a versioned envelope, {"version": 1, "encoding": "gzip",
+"data": "<base64>"}. Submissions repeat the same long column labels and answers in every row, so they compress
+several-fold. Items without an envelope, or in the row format, are read as is.
+"""
+
+import base64
+import gzip
+import json
+import logging
+
+from helpers import config
+
+ENVELOPE_VERSION = 1
+TABLE_VERSION = 1
+
+# Dictionary encode a column when it has at most this share of distinct values
+DICTIONARY_MAX_DISTINCT_RATIO = 0.5
+
+logger = logging.getLogger(__name__)
+
+try:
+    from compression import zstd as _zstd  # Python 3.14+
+
+except ImportError:
+    try:
+        import zstandard as _zstd
+
+    except ImportError:
+        _zstd = None
+
+
+def encode_submissions(submissions: list[dict], columns: list[str] | tuple[str, ...] | None = None):
+    """
+    Return the submissions in the configured WORK_ITEM_FORMAT, compressed with WORK_ITEM_COMPRESSION if it is set.
+    The columnar format needs the columns of the rows, and is only used if every row has exactly those columns.
+    """
+
+    if config.WORK_ITEM_FORMAT == "columns" and columns is not None:
+        submissions = encode_table(submissions, list(columns)) or submissions
+
+    encoding = config.WORK_ITEM_COMPRESSION
+
+    if not encoding:
+        return submissions
+
+    if encoding == "zstd" and _zstd is None:
+        logger.warning("zstd is not available - compressing work items with gzip")
+        encoding = "gzip"
+
+    raw = json.dumps(submissions, ensure_ascii=False, default=str, separators=(",", ":")).encode("utf-8")
+
+    return {
+        "version": ENVELOPE_VERSION,
+        "encoding": encoding,
+        "data": base64.b64encode(_compress(raw, encoding)).decode("ascii"),
+    }
+
+
+def decode_submissions(submissions):
+    """Return the submissions of a work item with any compression removed - a list of row dicts or a columnar table."""
+
+    if not is_envelope(submissions):
+        return submissions
+
+    if submissions["version"] > ENVELOPE_VERSION:
+        raise ValueError(f"Work item envelope version {submissions['version']} is not supported")
+
+    raw = _decompress(base64.b64decode(submissions["data"]), submissions["encoding"])
+
+    return json.loads(raw)
+
+
+def encode_table(rows: list[dict], columns: list[str]) -> dict | None:
+    """Return the rows as a columnar table, or None if not every row has exactly the given columns."""
+
+    if any(list(row) != columns for row in rows):
+        return None
+
+    value_columns = zip(*(row.values() for row in rows)) if rows else [()] * len(columns)
+    arrays = [_encode_array(list(values)) for values in value_columns]
+
+    return {
+        "version": TABLE_VERSION,
+        "format": "columns",
+        "columns": columns,
+        "row_count": len(rows),
+        "arrays": arrays,
+    }
+
+
+def submission_columns(submissions, columns: list[str]) -> dict[str, list]:
+    """
+    Return the values of each of the given columns, in that order, from decoded submissions in either format.
+    Columns missing from the submissions are filled with None.
+    """
+
+    if is_table(submissions):
+        table_arrays = dict(zip(submissions["columns"], submissions["arrays"]))
+        row_count = submissions["row_count"]
+
+        return {
+            column: _decode_array(table_arrays[column]) if column in table_arrays else [None] * row_count
+            for column in columns
+        }
+
+    return {column: [row.get(column, None) for row in submissions] for column in columns}
+
+
+def submission_rows(submissions) -> list[dict]:
+    """Return decoded submissions in either format as row dicts."""
+
+    if not is_table(submissions):
+        return submissions
+
+    columns = submissions["columns"]
+    arrays = [_decode_array(array) for array in submissions["arrays"]]
+
+    return [dict(zip(columns, values)) for values in zip(*arrays)] if columns else [{}] * submissions["row_count"]
+
+
+def is_table(submissions) -> bool:
+    """Return whether decoded submissions are in the columnar format."""
+
+    if isinstance(submissions, dict) and submissions.get("format") == "columns":
+        if submissions["version"] > TABLE_VERSION:
+            raise ValueError(f"Work item table version {submissions['version']} is not supported")
+
+        return True
+
+    return False
+
+
+def is_envelope(submissions) -> bool:
+    """Return whether the submissions are stored in an envelope."""
+
+    return isinstance(submissions, dict) and "version" in submissions and "encoding" in submissions
+
+
+def _encode_array(values: list):
+    # Only scalar values can be dictionary keys - columns holding lists or dicts are stored plainly
+    if not values or not all(value is None or isinstance(value, (str, int, float, bool)) for value in values):
+        return values
+
+    codes_by_value: dict = {}
+    codes = []
+
+    for value in values:
+        # Keyed by type as well, so e.g. 1, 1.0 and True keep their own entries
+        key = (type(value), value)
+
+        if key not in codes_by_value:
+            codes_by_value[key] = len(codes_by_value)
+
+        codes.append(codes_by_value[key])
+
+    if len(codes_by_value) > len(values) * DICTIONARY_MAX_DISTINCT_RATIO:
+        return values
+
+    return {"dictionary": [value for _, value in codes_by_value], "codes": codes}
+
+
+def _decode_array(array) -> list:
+    if isinstance(array, dict):
+        dictionary = array["dictionary"]
+
+        return [dictionary[code] for code in array["codes"]]
+
+    return array
+
+
+def _compress(raw: bytes, encoding: str) -> bytes:
+    if encoding == "gzip":
+        # mtime=0 keeps the output deterministic for the same submissions
+        return gzip.compress(raw, compresslevel=config.WORK_ITEM_COMPRESSION_LEVEL, mtime=0)
+
+    if encoding == "zstd":
+        # Positional, like the zstandard fallback's module-level compress takes the level
+        return _zstd.compress(raw, config.WORK_ITEM_COMPRESSION_LEVEL)
+
+    raise ValueError(f"Unknown work item compression '{encoding}'")
+
+
+def _decompress(data: bytes, encoding: str) -> bytes:
+    if encoding == "gzip":
+        return gzip.decompress(data)
+
+    if encoding == "zstd":
+        if _zstd is None:
+            raise ValueError("Work item is compressed with zstd, but zstd is not available")
+
+        return _zstd.decompress(data)
+
+    raise ValueError(f"Unknown work item compression '{encoding}'")
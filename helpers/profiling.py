@@ -0,0 +1,446 @@
+"""
+Module for an opt-in profiling mode, enabled with --profile on main.py.
+
+Each mode (--queue, --process, --finalize) runs under cProfile and tracemalloc, and its reports are written to a
+directory per run under PROFILE_DIR: the top functions by cumulative time, the raw profile for pstats or snakeviz,
+peak memory and the top allocation sites near the peak, and the stage metrics of the mode (see helpers.metrics).
+
+    python main.py --process --profile [--profile-target=<form key or work item reference>] [--profile-sampling]
+
+With --profile-target, only the work items of that form, or the item with that reference, are profiled - each in
+a report of its own - and the modes are not profiled as a whole. To profile the queue mode for one form, select
+only that form. --profile-sampling replaces cProfile with a sampling profiler, which reads the stack of every
+thread each PROFILE_SAMPLE_INTERVAL_SECONDS, and traces allocations one frame deep, for when cProfile's overhead
+is too high. The target is given with "=", as a form key on its own would also select that form for --queue.
+
+Profiling never changes what a run does: if profiling cannot start, or a report cannot be written, a warning is
+logged and the run carries on. cProfile and tracemalloc see every thread, and only one profile is active at a
+time - targeted items processed in parallel lanes are profiled one at a time, and their reports include whatever
+the other lanes did meanwhile.
+"""
+
+import cProfile
+import io
+import json
+import logging
+import os
+import pstats
+import re
+import sys
+import threading
+import time
+import tracemalloc
+
+from collections import Counter
+from collections.abc import Iterator
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from datetime import datetime
+
+from helpers import config, metrics
+
+PROFILE_FLAG = "--profile"
+SAMPLING_FLAG = "--profile-sampling"
+TARGET_PREFIX = "--profile-target="
+
+logger = logging.getLogger(__name__)
+
+# Only one profile can be active at a time
+_LOCK = threading.Lock()
+
+_RUN_DIR: str | None = None
+
+
+@dataclass
+class ProfileOptions:
+    """What to profile, and how"""
+
+    target: str | None = None  # a form key or work item reference - None profiles every mode as a whole
+    sampling: bool = False
+
+    def matches(self, reference: str, form_key: str | None) -> bool:
+        """Return whether a work item is targeted."""
+
+        return self.target in (reference, form_key)
+
+
+def options_from_argv(argv: list[str]) -> ProfileOptions | None:
+    """Return the profiling options given on the command line, or None if profiling is not enabled."""
+
+    if PROFILE_FLAG not in argv and SAMPLING_FLAG not in argv:
+        return None
+
+    target = next((arg.removeprefix(TARGET_PREFIX) for arg in argv if arg.startswith(TARGET_PREFIX)), None)
+
+    return ProfileOptions(target=target or None, sampling=SAMPLING_FLAG in argv)
+
+
+@contextmanager
+def profile_mode(mode: str, run_metrics: metrics.Collector | None = None) -> Iterator[None]:
+    """Profile a mode, e.g. "process", if --profile is given without a target."""
+
+    options = options_from_argv(sys.argv)
+
+    if options is None or options.target:
+        yield
+
+        return
+
+    with _profiled(mode, options, run_metrics):
+        yield
+
+
+@contextmanager
+def profile_item(reference: str, form_key: str | None, item_metrics: metrics.Collector | None = None) -> Iterator[None]:
+    """Profile the processing of a work item, if it is the target given with --profile-target."""
+
+    options = options_from_argv(sys.argv)
+
+    if options is None or not options.target or not options.matches(reference, form_key):
+        yield
+
+        return
+
+    with _profiled(f"process-{reference}", options, item_metrics):
+        yield
+
+
+@contextmanager
+def _profiled(name: str, options: ProfileOptions, collector: metrics.Collector | None) -> Iterator[None]:
+    session = _start_session(name, options)
+
+    if session is None:
+        yield
+
+        return
+
+    try:
+        yield
+
+    finally:
+        try:
+            session.stop()
+            directory = session.write_reports(collector)
+
+            logger.info(f"Profile of {name} written to {directory}")
+
+        except Exception as e:
+            logger.warning(f"Could not write the profile of {name}: {e}")
+
+        finally:
+            _LOCK.release()
+
+
+def _start_session(name: str, options: ProfileOptions) -> "_Session | None":
+    if not _LOCK.acquire(blocking=False):
+        logger.warning(f"Not profiling {name} - another profile is already active")
+
+        return None
+
+    try:
+        return _Session.start(name, options)
+
+    except Exception as e:
+        # e.g. when another profiling tool is already active in the process
+        logger.warning(f"Could not start profiling {name}: {e}")
+        _LOCK.release()
+
+        return None
+
+
+@dataclass
+class _Session:
+    """An active profile, and what it measured once stopped"""
+
+    name: str
+    options: ProfileOptions
+    started_at: datetime = field(default_factory=datetime.now)
+    started: float = field(default_factory=time.perf_counter)
+    seconds: float = 0.0
+    profiler: cProfile.Profile | None = None
+    sampler: "_Sampler | None" = None
+    snapshots: "_PeakSnapshots | None" = None
+    started_tracemalloc: bool = False
+    peak_bytes: int = 0
+
+    @classmethod
+    def start(cls, name: str, options: ProfileOptions) -> "_Session":
+        """Start tracing allocations, and profiling with cProfile or the sampling profiler."""
+
+        session = cls(name=name, options=options)
+
+        # Tracing that was started outside of this module, e.g. with PYTHONTRACEMALLOC, is left running when done
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(1 if options.sampling else config.PROFILE_TRACEMALLOC_FRAMES)
+            session.started_tracemalloc = True
+
+        tracemalloc.reset_peak()
+        session.snapshots = _PeakSnapshots()
+        session.snapshots.start()
+
+        if options.sampling:
+            session.sampler = _Sampler(
+                config.PROFILE_SAMPLE_INTERVAL_SECONDS,
+                ignored_threads={session.snapshots.ident},
+            )
+            session.sampler.start()
+
+        else:
+            session.profiler = cProfile.Profile()
+
+            try:
+                session.profiler.enable()
+
+            except Exception:
+                session.profiler = None
+                session.stop()
+
+                raise
+
+        return session
+
+    def stop(self) -> None:
+        """Stop profiling and tracing."""
+
+        self.seconds = time.perf_counter() - self.started
+
+        if self.profiler is not None:
+            self.profiler.disable()
+
+        if self.sampler is not None:
+            self.sampler.stop()
+
+        self.peak_bytes = tracemalloc.get_traced_memory()[1]
+
+        if self.snapshots is not None:
+            self.snapshots.stop()
+
+        if self.started_tracemalloc:
+            tracemalloc.stop()
+
+    def write_reports(self, collector: metrics.Collector | None) -> str:
+        """Write the reports to a directory of their own in the run's directory, and return its path."""
+
+        directory = _report_directory(self.name)
+
+        if self.profiler is not None:
+            top_functions = _write_cpu_report(directory, self.profiler)
+
+        else:
+            top_functions = _write_sample_report(directory, self.sampler)
+
+        top_allocations = _write_memory_report(directory, self.peak_bytes, self.snapshots.snapshot)
+
+        summary = {
+            "name": self.name,
+            "target": self.options.target,
+            "sampling": self.options.sampling,
+            "started": self.started_at.isoformat(timespec="seconds"),
+            "seconds": round(self.seconds, 3),
+            "peak_traced_bytes": self.peak_bytes,
+            "top_functions": top_functions[:20],
+            "top_allocations": top_allocations[:20],
+            "stages": collector.summary()["stages"] if collector is not None else [],
+        }
+
+        with open(os.path.join(directory, "summary.json"), "w", encoding="utf-8") as f:
+            json.dump(summary, f, indent=2)
+
+        return directory
+
+
+class _Sampler(threading.Thread):
+    """Counts the functions on the stack of every other thread, each interval"""
+
+    def __init__(self, interval: float, ignored_threads: set[int]):
+        super().__init__(name="profiling-sampler", daemon=True)
+
+        self.interval = interval
+        self.ignored_threads = ignored_threads
+        self.samples = 0
+        self.own: Counter = Counter()  # lines at the top of a stack
+        self.cumulative: Counter = Counter()  # functions anywhere in a stack, counted once per sample
+        self._stopped = threading.Event()
+
+    def run(self) -> None:
+        while not self._stopped.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():  # pylint: disable=protected-access
+                if thread_id == self.ident or thread_id in self.ignored_threads:
+                    continue
+
+                self.samples += 1
+                self.own[(frame.f_code.co_filename, frame.f_lineno, frame.f_code.co_name)] += 1
+
+                seen = set()
+
+                while frame is not None:
+                    code = frame.f_code
+                    function = (code.co_filename, code.co_firstlineno, code.co_name)
+
+                    if function not in seen:
+                        seen.add(function)
+                        self.cumulative[function] += 1
+
+                    frame = frame.f_back
+
+    def stop(self) -> None:
+        """Stop sampling and wait for the last sample."""
+
+        self._stopped.set()
+        self.join()
+
+
+class _PeakSnapshots(threading.Thread):
+    """
+    Takes a tracemalloc snapshot each time traced memory has grown by PROFILE_SNAPSHOT_GROWTH since the last one,
+    so the allocation sites are reported close to the peak rather than after everything has been freed.
+    """
+
+    def __init__(self):
+        super().__init__(name="profiling-snapshots", daemon=True)
+
+        self.snapshot: tracemalloc.Snapshot | None = None
+        self.snapshot_bytes = 0
+        self._stopped = threading.Event()
+
+    def run(self) -> None:
+        while not self._stopped.wait(config.PROFILE_MEMORY_CHECK_SECONDS):
+            self._take_if_grown()
+
+    def stop(self) -> None:
+        """Stop watching, taking a last snapshot if memory never grew enough for one."""
+
+        self._stopped.set()
+        self.join()
+
+        if self.snapshot is None and tracemalloc.is_tracing():
+            self.snapshot = tracemalloc.take_snapshot()
+
+    def _take_if_grown(self) -> None:
+        current = tracemalloc.get_traced_memory()[0]
+
+        if current > max(self.snapshot_bytes * config.PROFILE_SNAPSHOT_GROWTH, 2**20):
+            self.snapshot = tracemalloc.take_snapshot()
+            self.snapshot_bytes = current
+
+
+def _write_cpu_report(directory: str, profiler: cProfile.Profile) -> list[dict]:
+    profiler.dump_stats(os.path.join(directory, "cpu.prof"))
+
+    stream = io.StringIO()
+    stats = pstats.Stats(profiler, stream=stream).sort_stats(pstats.SortKey.CUMULATIVE)
+    stats.print_stats(config.PROFILE_TOP_FUNCTIONS)
+
+    with open(os.path.join(directory, "cpu.txt"), "w", encoding="utf-8") as f:
+        f.write(stream.getvalue())
+
+    functions = sorted(stats.stats.items(), key=lambda entry: entry[1][3], reverse=True)  # pylint: disable=no-member
+
+    return [
+        {
+            "function": _function_name(function),
+            "calls": calls,
+            "own_seconds": round(own_seconds, 6),
+            "cumulative_seconds": round(cumulative_seconds, 6),
+        }
+        for function, (_, calls, own_seconds, cumulative_seconds, _) in functions[:config.PROFILE_TOP_FUNCTIONS]
+    ]
+
+
+def _write_sample_report(directory: str, sampler: _Sampler) -> list[dict]:
+    samples = max(sampler.samples, 1)
+
+    top_functions = [
+        {
+            "function": _function_name(function),
+            "cumulative_share": round(count / samples, 4),
+        }
+        for function, count in sampler.cumulative.most_common(config.PROFILE_TOP_FUNCTIONS)
+    ]
+
+    lines = [f"{sampler.samples} stack samples, every {sampler.interval}s of every thread", ""]
+    lines.append("Top functions by share of samples on the stack:")
+    lines.extend(f"{entry['cumulative_share']:>8.2%}  {entry['function']}" for entry in top_functions)
+    lines.append("")
+    lines.append("Top lines by share of samples at the top of the stack:")
+    lines.extend(
+        f"{count / samples:>8.2%}  {_function_name(line)}"
+        for line, count in sampler.own.most_common(config.PROFILE_TOP_FUNCTIONS)
+    )
+
+    with open(os.path.join(directory, "cpu_samples.txt"), "w", encoding="utf-8") as f:
+        f.write("\n".join(lines) + "\n")
+
+    return top_functions
+
+
+def _write_memory_report(directory: str, peak_bytes: int, snapshot: tracemalloc.Snapshot | None) -> list[dict]:
+    lines = [f"Peak traced memory: {peak_bytes / 2**20:.1f} MiB"]
+    top_allocations = []
+
+    if snapshot is not None:
+        snapshot = snapshot.filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+            tracemalloc.Filter(False, "<unknown>"),
+        ))
+
+        statistics = snapshot.statistics("lineno")[:config.PROFILE_TOP_ALLOCATIONS]
+
+        snapshot_bytes = sum(statistic.size for statistic in snapshot.statistics("filename"))
+        lines.append(f"Top allocation sites, in a snapshot of {snapshot_bytes / 2**20:.1f} MiB near the peak:")
+
+        for statistic in statistics:
+            frame = statistic.traceback[0]
+
+            top_allocations.append({
+                "site": f"{frame.filename}:{frame.lineno}",
+                "bytes": statistic.size,
+                "blocks": statistic.count,
+            })
+            lines.append(
+                f"{statistic.size / 2**20:>10.2f} MiB {statistic.count:>10} blocks  {frame.filename}:{frame.lineno}"
+            )
+
+        # Where the largest allocations come from, as deep as tracemalloc kept the stack
+        if snapshot.traceback_limit > 1:
+            lines.append("")
+            lines.append("Tracebacks of the largest allocations:")
+
+            for statistic in snapshot.statistics("traceback")[:5]:
+                lines.append(f"{statistic.size / 2**20:.2f} MiB in {statistic.count} blocks")
+                lines.extend(statistic.traceback.format(most_recent_first=True))
+                lines.append("")
+
+    with open(os.path.join(directory, "memory.txt"), "w", encoding="utf-8") as f:
+        f.write("\n".join(lines) + "\n")
+
+    return top_allocations
+
+
+def _report_directory(name: str) -> str:
+    global _RUN_DIR  # pylint: disable=global-statement
+
+    # All profiles of one invocation of main.py share a run directory
+    if _RUN_DIR is None:
+        _RUN_DIR = os.path.join(config.PROFILE_DIR, datetime.now().strftime("%Y-%m-%dT%H%M%S"))
+
+    base = os.path.join(_RUN_DIR, re.sub(r"[^\w.-]", "_", name))
+    directory = base
+    suffix = 1
+
+    # An item processed twice in a run, e.g. when retried, gets a report for each time
+    while os.path.exists(directory):
+        suffix += 1
+        directory = f"{base}-{suffix}"
+
+    os.makedirs(directory)
+
+    return directory
+
+
+def _function_name(function: tuple) -> str:
+    filename, lineno, name = function
+
+    return f"{filename}:{lineno}({name})"
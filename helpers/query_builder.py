@@ -0,0 +1,215 @@
+"""
+Module to build the queries against the journalizing view.
+
+With projection pushdown the formular mapping is compiled into JSON projections, so only the mapped fields of
+form_data['data'], the entity serial/created/completed fields and the pdf attachments are sent over the wire.
+Purged entries are filtered in SQL. Both SQL Server (OPENJSON/JSON_QUERY) and SQLite (JSON1) are supported,
+the latter as a local stand-in for the view.
+"""
+
+import json
+
+from datetime import datetime
+
+from helpers import config
+from helpers.watermark import watermark_since
+
+MSSQL = "mssql"
+SQLITE = "sqlite"
+
+JOURNALIZING_VIEWS = {
+    MSSQL: "[RPA].[journalizing].view_Journalizing",
+    SQLITE: "view_Journalizing",
+}
+
+ENTITY_FIELDS = ("serial", "created", "completed")
+
+# SQLite json_each type names, SQL Server OPENJSON types are numbers - see decode_projected_value
+_SQLITE_JSON_TYPES = {"null", "true", "false", "integer", "real", "text", "array", "object"}
+
+
+def projected_data_keys(formular_mapping: dict, include_attachments: bool = False) -> list[str]:
+    """
+    Return the top level keys of form_data['data'] used by a formular mapping.
+    Nested table mappings are projected as their whole table object.
+    """
+
+    keys = list(formular_mapping)
+
+    if include_attachments:
+        keys.append("attachments")
+
+    return keys
+
+
+def build_forms_query(
+    dialect: str,
+    form_watermarks: dict[str, dict | None],
+    form_projections: dict[str, list[str]] | None = None,
+) -> tuple[str, list]:
+    """
+    Build the query for the submissions of several form types, ordered by form type and newest first.
+
+    form_watermarks maps each form type to its high-water mark, or None to scan all of its submissions.
+    form_projections maps each form type to the keys of form_data['data'] to project - if None the whole
+    form_data document is selected instead.
+
+    Returns the query and its positional parameters.
+    """
+
+    if dialect not in JOURNALIZING_VIEWS:
+        raise ValueError(f"Unsupported database dialect: {dialect}")
+
+    submitted_date = "CAST(form_submitted_date AS datetime)" if dialect == MSSQL else "form_submitted_date"
+
+    form_types = list(form_watermarks)
+    params = list(form_types)
+    watermark_filters = []
+
+    for form_type, watermark in form_watermarks.items():
+        since = watermark_since(watermark)
+
+        if since is None:
+            watermark_filters.append("form_type = ?")
+            params.append(form_type)
+
+        elif config.WATERMARK_LOOKBACK_HOURS > 0:
+            watermark_filters.append(f"(form_type = ? AND {submitted_date} >= ?)")
+            params.extend([form_type, _date_param(dialect, since)])
+
+        else:
+            watermark_filters.append(f"""(form_type = ? AND (
+                {submitted_date} > ?
+                OR ({submitted_date} = ? AND form_id >= ?)
+            ))""")
+            params.extend([form_type, _date_param(dialect, since), _date_param(dialect, since), watermark["form_id"]])
+
+    if form_projections is None:
+        select_columns = "form_data"
+        projection_filter = ""
+
+    else:
+        select_columns = _projection_columns(dialect, form_projections)
+        projection_filter = _projection_filter(dialect)
+
+    query = f"""
+        SELECT
+            form_type,
+            form_id,
+            {submitted_date} AS form_submitted_date,
+            {select_columns}
+        FROM
+            {JOURNALIZING_VIEWS[dialect]}
+        WHERE
+            form_type IN ({", ".join("?" for _ in form_types)})
+            AND form_data IS NOT NULL
+            AND form_submitted_date IS NOT NULL
+            AND ({" OR ".join(watermark_filters)})
+            {projection_filter}
+        ORDER BY form_type, form_submitted_date DESC, form_id DESC
+    """
+
+    return query, params
+
+
+def parse_projected_row(row) -> dict:
+    """
+    Rebuild a submission from a projected row, in the same shape as the parsed form_data document:
+    {"data": {...mapped fields}, "entity": {"serial": [...], "created": [...], "completed": [...]}}
+    """
+
+    *_, serial, created, completed, projected_data = row
+
+    entity = {}
+
+    for key, value in zip(ENTITY_FIELDS, (serial, created, completed)):
+        if value is not None:
+            entity[key] = json.loads(value) if isinstance(value, str) else value
+
+    data = {}
+
+    if projected_data:
+        for entry in json.loads(projected_data):
+            data[entry["key"]] = decode_projected_value(entry.get("value"), entry.get("type"))
+
+    return {"data": data, "entity": entity}
+
+
+def decode_projected_value(value, value_type):
+    """
+    Decode a projected value back into the python value json.loads would have produced for it.
+
+    SQL Server's OPENJSON types are 0 null, 1 string, 2 number, 3 boolean, 4 array and 5 object,
+    with every value returned as text. SQLite's json_each types are names, and values are already typed.
+    """
+
+    if value_type in _SQLITE_JSON_TYPES:
+        if value_type == "null":
+            return None
+
+        if value_type in ("true", "false"):
+            return value_type == "true"
+
+        if value_type in ("array", "object") and isinstance(value, str):
+            return json.loads(value)
+
+        return value
+
+    if value is None or value_type == 0:
+        return None
+
+    if value_type == 1:
+        return value
+
+    return json.loads(value)
+
+
+def _projection_columns(dialect: str, form_projections: dict[str, list[str]]) -> str:
+    key_filters = " OR ".join(
+        f"(form_type = {_sql_literal(form_type)} AND d.[key] IN ({', '.join(_sql_literal(k) for k in keys)}))"
+        for form_type, keys in form_projections.items()
+    )
+
+    if dialect == MSSQL:
+        entity_columns = ",\n            ".join(
+            f"JSON_QUERY(form_data, '$.entity.{field}') AS entity_{field}" for field in ENTITY_FIELDS
+        )
+
+        return f"""{entity_columns},
+            (
+                SELECT d.[key], d.[value], d.[type]
+                FROM OPENJSON(form_data, '$.data') AS d
+                WHERE {key_filters}
+                FOR JSON PATH
+            ) AS projected_data"""
+
+    entity_columns = ",\n            ".join(
+        f"json_extract(form_data, '$.entity.{field}') AS entity_{field}" for field in ENTITY_FIELDS
+    )
+
+    return f"""{entity_columns},
+            (
+                SELECT json_group_array(json_object('key', d.key, 'value', d.value, 'type', d.type))
+                FROM json_each(form_data, '$.data') AS d
+                WHERE {key_filters.replace("d.[key]", "d.key")}
+            ) AS projected_data"""
+
+
+def _projection_filter(dialect: str) -> str:
+    if dialect == MSSQL:
+        # Purged entries are those with a purged key, whatever its value - like the "purged" in parsed check
+        return """AND ISJSON(form_data) = 1
+            AND NOT EXISTS (SELECT 1 FROM OPENJSON(form_data) WHERE [key] = 'purged')"""
+
+    # json_type is 'null' for a null value, and only NULL for a missing key
+    return """AND json_valid(form_data)
+            AND json_type(form_data, '$.purged') IS NULL"""
+
+
+def _date_param(dialect: str, value: datetime):
+    # SQLite stores the submitted date as ISO text
+    return value.isoformat(sep=" ") if dialect == SQLITE else value
+
+
+def _sql_literal(value: str) -> str:
+    return "'" + str(value).replace("'", "''") + "'"
@@ -0,0 +1,134 @@
+"""
+Module for lazily resolved credentials and constants from the RPA database.
+
+Values are only fetched on first use, all missing values in one request share one database connection, and
+resolved values are cached in memory for SECRETS_TTL_SECONDS. Optionally, the cache is also kept on disk,
+encrypted with the OPENORCHESTRATORKEY Fernet key, so a cold start does not need the database at all.
+"""
+
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+
+from helpers import config
+
+logger = logging.getLogger(__name__)
+
+_CACHE: dict[str, tuple[float, dict]] = {}
+_LOCK = threading.Lock()
+
+
+def get_credential(name: str) -> dict:
+    """Return a credential as returned by RPAConnection.get_credential, e.g. {"username": ..., "decrypted_password": ...}"""
+
+    return _resolve([("credential", name)])[0]
+
+
+def get_constant(name: str) -> dict:
+    """Return a constant as returned by RPAConnection.get_constant, e.g. {"constant_name": ..., "value": ...}"""
+
+    return _resolve([("constant", name)])[0]
+
+
+def get_constants(*names: str) -> list[dict]:
+    """Return several constants, fetching any that are not cached in a single database connection."""
+
+    return _resolve([("constant", name) for name in names])
+
+
+def clear() -> None:
+    """Drop all cached values, in memory and on disk."""
+
+    with _LOCK:
+        _CACHE.clear()
+
+        if os.path.exists(config.SECRETS_DISK_CACHE_FILE):
+            os.remove(config.SECRETS_DISK_CACHE_FILE)
+
+
+def _resolve(keys: list[tuple[str, str]]) -> list[dict]:
+    with _LOCK:
+        if not _CACHE:
+            _load_disk_cache()
+
+        now = time.time()
+        missing = [key for key in keys if _cache_key(*key) not in _CACHE or _CACHE[_cache_key(*key)][0] < now]
+
+        if missing:
+            _fetch(missing)
+            _save_disk_cache()
+
+        return [_CACHE[_cache_key(*key)][1] for key in keys]
+
+
+def _fetch(keys: list[tuple[str, str]]) -> None:
+    # Imported here, so runs that never need a secret do not pay for the database driver
+    from mbu_dev_shared_components.database.connection import RPAConnection  # pylint: disable=import-outside-toplevel
+
+    logger.info(f"Fetching {len(keys)} secrets/constants from the RPA database")
+
+    expires_at = time.time() + config.SECRETS_TTL_SECONDS
+
+    rpa_conn = RPAConnection(db_env="PROD", commit=False)
+    with rpa_conn:
+        for kind, name in keys:
+            value = rpa_conn.get_credential(name) if kind == "credential" else rpa_conn.get_constant(name)
+
+            _CACHE[_cache_key(kind, name)] = (expires_at, value)
+
+
+def _cache_key(kind: str, name: str) -> str:
+    return f"{kind}:{name}"
+
+
+def _encryptor():
+    if not config.SECRETS_DISK_CACHE or not os.getenv("OPENORCHESTRATORKEY"):
+        return None
+
+    from mbu_dev_shared_components.utils.fernet_encryptor import Encryptor  # pylint: disable=import-outside-toplevel
+
+    return Encryptor()
+
+
+def _load_disk_cache() -> None:
+    encryptor = _encryptor()
+
+    if encryptor is None or not os.path.exists(config.SECRETS_DISK_CACHE_FILE):
+        return
+
+    try:
+        with open(config.SECRETS_DISK_CACHE_FILE, "rb") as f:
+            entries = json.loads(encryptor.decrypt(f.read()))
+
+    except Exception as e:
+        logger.warning(f"Could not read the secrets disk cache, ignoring it: {e}")
+
+        return
+
+    for key, (expires_at, value) in entries.items():
+        _CACHE[key] = (expires_at, value)
+
+
+def _save_disk_cache() -> None:
+    encryptor = _encryptor()
+
+    if encryptor is None:
+        return
+
+    cache_dir = os.path.dirname(config.SECRETS_DISK_CACHE_FILE)
+    os.makedirs(cache_dir, exist_ok=True)
+
+    # Runs starting at the same time each get a temp file of their own, and the cache file is replaced whole
+    with tempfile.NamedTemporaryFile(dir=cache_dir, suffix=".tmp", delete=False) as f:
+        f.write(encryptor.encrypt(json.dumps(_CACHE, default=str)))
+
+    try:
+        os.replace(f.name, config.SECRETS_DISK_CACHE_FILE)
+
+    except OSError:
+        os.remove(f.name)
+
+        raise
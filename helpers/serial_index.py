@@ -0,0 +1,181 @@
+"""
+Module for a local index of the serial numbers in each SharePoint workbook.
+
+The index is a small SQLite file per workbook in the local state dir, stamped with the eTag of the workbook it
+was built from. As long as the eTag matches, the serial numbers are read from the index instead of downloading and
+parsing the workbook. When it does not match, the workbook is downloaded once and only the serial number column is
+read, in streaming read-only mode, to rebuild the index.
+"""
+
+import hashlib
+import logging
+import os
+import sqlite3
+
+from contextlib import closing
+from io import BytesIO
+
+from openpyxl import load_workbook
+
+from mbu_msoffice_integration.sharepoint_class import Sharepoint
+
+from helpers import config, metrics, sharepoint_rest
+
+SERIAL_NUMBER_COLUMN = "Serial number"
+
+logger = logging.getLogger(__name__)
+
+
+def load_serials(
+    sharepoint_api: Sharepoint,
+    folder_name: str,
+    excel_file_name: str,
+    sheet_name: str,
+    etag: str | None,
+) -> set:
+    """
+    Return the serial numbers in the workbook with the given eTag, from the index if it is up to date,
+    otherwise by reading the serial number column of the workbook and rebuilding the index.
+    """
+
+    index_path = _index_path(sharepoint_api.site_name, folder_name, excel_file_name)
+
+    if etag and _read_etag(index_path) == etag:
+        serials = _read_serials(index_path)
+        logger.info(f"Serial index for '{excel_file_name}' is up to date - {len(serials)} serial numbers")
+
+        return serials
+
+    logger.info(f"Serial index for '{excel_file_name}' is missing or stale - reading the workbook")
+
+    with metrics.span("workbook_download") as span:
+        excel_file = sharepoint_api.fetch_file_using_open_binary(excel_file_name, folder_name)
+        span.add(bytes_in=len(excel_file or b""))
+
+    with metrics.span("workbook_parse") as span:
+        serials = read_serial_column(excel_file, sheet_name)
+        span.add(rows=len(serials), bytes_in=len(excel_file or b""))
+
+    _write_index(index_path, serials, etag, replace=True)
+
+    return serials
+
+
+def workbook_etag(sharepoint_api: Sharepoint, folder_name: str, excel_file_name: str) -> str | None:
+    """
+    Return the current eTag of a workbook, or None if it does not exist.
+
+    A failed lookup is raised, so it is not mistaken for a missing workbook.
+    """
+
+    files = sharepoint_rest.list_files(sharepoint_api, folder_name)
+
+    return next((f.get("ETag") for f in files if f.get("Name") == excel_file_name), None)
+
+
+def add_serials(
+    sharepoint_api: Sharepoint,
+    folder_name: str,
+    excel_file_name: str,
+    serials: list,
+    previous_etag: str | None,
+    new_workbook: bool = False,
+) -> None:
+    """
+    Add newly written serial numbers to the workbook's index. Call after the workbook has been written and formatted.
+
+    previous_etag is the eTag the workbook had before it was written. The index is only stamped with the new eTag
+    if it matched the workbook before the write (or the workbook is new) - otherwise it is left invalid, so it is
+    rebuilt from the workbook on next use.
+    """
+
+    index_path = _index_path(sharepoint_api.site_name, folder_name, excel_file_name)
+
+    index_was_current = new_workbook or (previous_etag is not None and _read_etag(index_path) == previous_etag)
+
+    etag = None
+
+    if index_was_current:
+        # The workbook is already written, so a failed lookup only leaves the index to be rebuilt
+        try:
+            etag = workbook_etag(sharepoint_api, folder_name, excel_file_name)
+
+        except Exception as e:
+            logger.warning(f"Could not look up the eTag of '{excel_file_name}' - its serial index is rebuilt on next use: {e}")
+
+    # An unchanged eTag means the write did not go through (the Sharepoint client only prints upload errors)
+    if etag == previous_etag:
+        etag = None
+
+    _write_index(index_path, serials, etag, replace=new_workbook)
+
+
+def read_serial_column(excel_file: bytes, sheet_name: str) -> set:
+    """Read only the serial number column of a workbook, without loading the rest of the sheet."""
+
+    workbook = load_workbook(BytesIO(excel_file), read_only=True, data_only=True)
+
+    try:
+        worksheet = workbook[sheet_name]
+
+        header = next(worksheet.iter_rows(min_row=1, max_row=1, values_only=True), ())
+        column = list(header).index(SERIAL_NUMBER_COLUMN) + 1
+
+        return {
+            _normalize_serial(value)
+            for (value,) in worksheet.iter_rows(min_row=2, min_col=column, max_col=column, values_only=True)
+            if value is not None
+        }
+
+    finally:
+        workbook.close()
+
+
+def _normalize_serial(value):
+    # Whole numbers may be stored as floats in the workbook
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+
+    return value
+
+
+def _index_path(site_name: str, folder_name: str, excel_file_name: str) -> str:
+    key = hashlib.sha1(f"{site_name}/{folder_name}/{excel_file_name}".encode("utf-8")).hexdigest()
+
+    return os.path.join(config.SERIAL_INDEX_DIR, f"{key}.sqlite")
+
+
+def _connect(index_path: str) -> sqlite3.Connection:
+    os.makedirs(os.path.dirname(index_path), exist_ok=True)
+
+    conn = sqlite3.connect(index_path)
+    conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+    conn.execute("CREATE TABLE IF NOT EXISTS serials (serial PRIMARY KEY) WITHOUT ROWID")
+
+    return conn
+
+
+def _read_etag(index_path: str) -> str | None:
+    if not os.path.exists(index_path):
+        return None
+
+    with closing(_connect(index_path)) as conn:
+        row = conn.execute("SELECT value FROM meta WHERE key = 'etag'").fetchone()
+
+    return row[0] if row else None
+
+
+def _read_serials(index_path: str) -> set:
+    with closing(_connect(index_path)) as conn:
+        return {serial for (serial,) in conn.execute("SELECT serial FROM serials")}
+
+
+def _write_index(index_path: str, serials, etag: str | None, replace: bool) -> None:
+    # The connection commits the transaction on exit, and closing() closes it
+    with closing(_connect(index_path)) as conn:
+        with conn:
+            if replace:
+                conn.execute("DELETE FROM serials")
+
+            conn.executemany("INSERT OR IGNORE INTO serials (serial) VALUES (?)", ((s,) for s in serials))
+            conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('etag', ?)", (etag,))
@@ -0,0 +1,222 @@
+"""
+Module for a local, size-bounded cache of SharePoint file contents.
+
+Entries are keyed by site, folder and file, and validated with a conditional request (If-None-Match with the
+cached eTag), so an unchanged file is never transferred twice. The least recently used entries are evicted once
+the cache grows beyond the configured size.
+
+Workbooks contain personal data, so contents are encrypted at rest with the OPENORCHESTRATORKEY Fernet key, like
+helpers.secrets_provider - without the key, nothing is cached and every file is downloaded. Files are written to a
+unique temp file first, so several processes can share the cache directory.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+
+from mbu_msoffice_integration.sharepoint_class import Sharepoint
+
+from helpers import config, sharepoint_rest
+
+logger = logging.getLogger(__name__)
+
+_LOCK = threading.Lock()
+
+STATS = {"hits": 0, "misses": 0, "bytes_saved": 0, "bytes_downloaded": 0}
+
+
+class CachedSharepoint(Sharepoint):
+    """
+    Sharepoint client that reads files through the local cache.
+    append_row_to_sharepoint_excel and format_and_sort_excel_file download through fetch_file_using_open_binary,
+    so they read through the cache as well.
+    """
+
+    def fetch_file_using_open_binary(self, file_name: str, folder_name: str) -> bytes | None:
+        try:
+            return fetch_file(self, folder_name, file_name)
+
+        except Exception as e:
+            logger.info(f"Cached download of '{file_name}' failed, downloading directly: {e}")
+
+            return super().fetch_file_using_open_binary(file_name, folder_name)
+
+
+def fetch_file(sharepoint_api: Sharepoint, folder_name: str, file_name: str) -> bytes:
+    """Return the content of a file, from the cache if SharePoint reports it unchanged."""
+
+    return fetch_file_with_etag(sharepoint_api, folder_name, file_name)[0]
+
+
+def fetch_file_with_etag(sharepoint_api: Sharepoint, folder_name: str, file_name: str) -> tuple[bytes, str | None]:
+    """Return the content and eTag of a file, from the cache if SharePoint reports it unchanged."""
+
+    key = _cache_key(sharepoint_api.site_name, folder_name, file_name)
+    cipher = _cipher()
+
+    with _LOCK:
+        entry = _read_index().get(key) if cipher else None
+
+    cached_etag = entry["etag"] if entry and os.path.exists(_content_path(key)) else None
+
+    content, etag = sharepoint_rest.download_file(sharepoint_api, folder_name, file_name, if_none_match=cached_etag)
+
+    if content is None:
+        content = _read_content(key, cipher)
+
+        if content is not None:
+            with _LOCK:
+                STATS["hits"] += 1
+                STATS["bytes_saved"] += len(content)
+
+                _touch(key)
+
+            return content, cached_etag
+
+        # The cached copy could not be read, e.g. after a key change, so the file is downloaded again
+        content, etag = sharepoint_rest.download_file(sharepoint_api, folder_name, file_name)
+
+    with _LOCK:
+        STATS["misses"] += 1
+        STATS["bytes_downloaded"] += len(content)
+
+    store(sharepoint_api, folder_name, file_name, content, etag)
+
+    return content, etag
+
+
+def store(sharepoint_api: Sharepoint, folder_name: str, file_name: str, content: bytes, etag: str | None) -> None:
+    """Store the content of a file with its eTag, e.g. right after uploading it. Without an eTag, the entry is dropped."""
+
+    cipher = _cipher()
+
+    if cipher is None:
+        return
+
+    key = _cache_key(sharepoint_api.site_name, folder_name, file_name)
+
+    with _LOCK:
+        index = _read_index()
+
+        if not etag or len(content) > config.SHAREPOINT_CACHE_MAX_BYTES:
+            index.pop(key, None)
+            _remove_content(key)
+            _write_index(index)
+
+            return
+
+        encrypted = cipher.encrypt(bytes(content))
+        _replace_file(_content_path(key), encrypted)
+
+        index[key] = {"etag": etag, "size": len(encrypted), "last_used": time.time()}
+
+        _evict(index)
+        _write_index(index)
+
+
+def log_stats() -> None:
+    """Log cache hits, misses and bytes saved for the run."""
+
+    logger.info(
+        f"SharePoint file cache: {STATS['hits']} hits, {STATS['misses']} misses, "
+        f"{STATS['bytes_saved']:,} bytes saved, {STATS['bytes_downloaded']:,} bytes downloaded"
+    )
+
+
+def _cipher():
+    if not os.getenv("OPENORCHESTRATORKEY"):
+        return None
+
+    from mbu_dev_shared_components.utils.fernet_encryptor import Encryptor  # pylint: disable=import-outside-toplevel
+
+    # Encryptor only encrypts strings, so contents are encrypted with its Fernet cipher directly
+    return Encryptor().cipher_suite
+
+
+def _read_content(key: str, cipher) -> bytes | None:
+    try:
+        with open(_content_path(key), "rb") as f:
+            return cipher.decrypt(f.read())
+
+    except Exception as e:
+        logger.warning(f"Could not read cached file {key}, dropping it: {e}")
+
+    with _LOCK:
+        index = _read_index()
+        index.pop(key, None)
+        _remove_content(key)
+        _write_index(index)
+
+    return None
+
+
+def _evict(index: dict) -> None:
+    total_size = sum(entry["size"] for entry in index.values())
+
+    for key in sorted(index, key=lambda k: index[k]["last_used"]):
+        if total_size <= config.SHAREPOINT_CACHE_MAX_BYTES:
+            break
+
+        total_size -= index.pop(key)["size"]
+        _remove_content(key)
+
+
+def _touch(key: str) -> None:
+    index = _read_index()
+
+    if key in index:
+        index[key]["last_used"] = time.time()
+        _write_index(index)
+
+
+def _cache_key(site_name: str, folder_name: str, file_name: str) -> str:
+    return hashlib.sha1(f"{site_name}/{folder_name}/{file_name}".encode("utf-8")).hexdigest()
+
+
+def _content_path(key: str) -> str:
+    return os.path.join(config.SHAREPOINT_CACHE_DIR, f"{key}.bin")
+
+
+def _remove_content(key: str) -> None:
+    try:
+        os.remove(_content_path(key))
+
+    except FileNotFoundError:
+        pass
+
+
+def _index_path() -> str:
+    return os.path.join(config.SHAREPOINT_CACHE_DIR, "index.json")
+
+
+def _read_index() -> dict:
+    try:
+        with open(_index_path(), encoding="utf-8") as f:
+            return json.load(f)
+
+    except (OSError, json.JSONDecodeError):
+        return {}
+
+
+def _write_index(index: dict) -> None:
+    _replace_file(_index_path(), json.dumps(index).encode("utf-8"))
+
+
+def _replace_file(path: str, content: bytes) -> None:
+    os.makedirs(config.SHAREPOINT_CACHE_DIR, exist_ok=True)
+
+    # A temp file of its own per write, so processes sharing the cache never write to the same temp file
+    with tempfile.NamedTemporaryFile(dir=config.SHAREPOINT_CACHE_DIR, suffix=".tmp", delete=False) as f:
+        f.write(content)
+
+    try:
+        os.replace(f.name, path)
+
+    except OSError:
+        os.remove(f.name)
+
+        raise
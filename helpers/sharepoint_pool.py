@@ -0,0 +1,130 @@
+"""
+Module for a process-wide pool of authenticated SharePoint clients.
+
+Clients are keyed by tenant, app, site and document library, so consecutive work items on the same site reuse
+one client and its access token instead of authenticating and resolving the site again. The token itself is
+cached and refreshed by the client's MSAL application - the pool replaces a client proactively once it reaches
+its maximum age, and evicts clients that have been idle too long or that exceed the pool size.
+
+A client context is not thread safe, so a client is leased to one work item at a time: checkout_client takes it
+out of the pool and return_client puts it back. Items working on the same site at once each get a client of their own.
+"""
+
+import logging
+import threading
+import time
+
+from dataclasses import dataclass
+
+from helpers import config
+from helpers.sharepoint_cache import CachedSharepoint
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class PooledClient:
+    """A pooled client with its pool key, and its creation and last use timestamps"""
+
+    key: tuple
+    client: CachedSharepoint
+    created_at: float
+    last_used: float
+
+
+_IDLE: dict[tuple, list[PooledClient]] = {}  # clients not leased to any thread, per key
+_LEASED: dict[int, PooledClient] = {}  # by id of the client, which the entry keeps alive while leased
+_LOCK = threading.Lock()
+
+
+def checkout_client(
+    sharepoint_kwargs: dict,
+    site_url: str,
+    site_name: str,
+    document_library: str,
+) -> CachedSharepoint:
+    """
+    Take an idle client for the site out of the pool, creating and authenticating a new one if there is none.
+    The client is not handed to any other thread until it is given back with return_client.
+    Clients that fail to authenticate are returned but never pooled, so the next checkout retries.
+    """
+
+    key = (sharepoint_kwargs["tenant"], sharepoint_kwargs["client_id"], site_url, site_name, document_library)
+    now = time.monotonic()
+
+    with _LOCK:
+        _evict_idle()
+
+        idle = _IDLE.get(key, [])
+
+        while idle:
+            pooled = idle.pop()
+
+            if now - pooled.created_at < config.SHAREPOINT_CLIENT_MAX_AGE_SECONDS:
+                pooled.last_used = now
+                _LEASED[id(pooled.client)] = pooled
+
+                return pooled.client
+
+            logger.info(f"Refreshing SharePoint client for site '{site_name}'")
+
+    # Authenticated outside the lock, so checkouts for other sites are not blocked
+    client = CachedSharepoint(
+        tenant=sharepoint_kwargs["tenant"],
+        client_id=sharepoint_kwargs["client_id"],
+        thumbprint=sharepoint_kwargs["thumbprint"],
+        cert_path=sharepoint_kwargs["cert_path"],
+        site_url=site_url,
+        site_name=site_name,
+        document_library=document_library,
+    )
+
+    if client.ctx is not None:
+        with _LOCK:
+            _LEASED[id(client)] = PooledClient(key=key, client=client, created_at=now, last_used=now)
+
+    return client
+
+
+def return_client(client: CachedSharepoint) -> None:
+    """Give a client taken with checkout_client back to the pool, for the next checkout on its site."""
+
+    with _LOCK:
+        pooled = _LEASED.pop(id(client), None)
+
+        if pooled is None:
+            return
+
+        pooled.last_used = time.monotonic()
+        _IDLE.setdefault(pooled.key, []).append(pooled)
+
+        _evict_oldest()
+
+
+def clear() -> None:
+    """Drop all idle clients. Leased clients are dropped when they are returned."""
+
+    with _LOCK:
+        _IDLE.clear()
+        _LEASED.clear()
+
+
+def _evict_idle() -> None:
+    now = time.monotonic()
+
+    for key, idle in list(_IDLE.items()):
+        idle[:] = [pooled for pooled in idle if now - pooled.last_used <= config.SHAREPOINT_CLIENT_IDLE_SECONDS]
+
+        if not idle:
+            del _IDLE[key]
+
+
+def _evict_oldest() -> None:
+    while sum(len(idle) for idle in _IDLE.values()) > config.SHAREPOINT_POOL_MAX_CLIENTS:
+        key = min(_IDLE, key=lambda k: _IDLE[k][0].last_used)
+
+        # Idle clients are appended as they are returned, so the first one of a key was used longest ago
+        _IDLE[key].pop(0)
+
+        if not _IDLE[key]:
+            del _IDLE[key]
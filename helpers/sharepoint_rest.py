@@ -0,0 +1,294 @@
+"""
+Module for the SharePoint REST calls that the Sharepoint class does not expose, e.g. file eTags.
+
+Requests are authenticated with the client context of an existing Sharepoint client and sent over a shared
+keep-alive session.
+"""
+
+import threading
+import time
+import urllib.parse
+import uuid
+
+from collections.abc import Iterator
+from io import BytesIO
+from typing import BinaryIO
+
+import requests
+
+from mbu_msoffice_integration.sharepoint_class import Sharepoint
+from office365.runtime.http.request_options import RequestOptions
+
+from helpers import config
+
+REQUEST_TIMEOUT = 60
+
+_SESSIONS = threading.local()
+
+
+class FileChangedError(RuntimeError):
+    """Raised when a file was changed by someone else since the eTag it was replaced against"""
+
+
+def site_url(sharepoint_api: Sharepoint) -> str:
+    """Return the full url of the client's site."""
+
+    return f"{sharepoint_api.site_url}/{sharepoint_api.site_type}/{sharepoint_api.site_name}"
+
+
+def server_relative_url(sharepoint_api: Sharepoint, folder_name: str, file_name: str | None = None) -> str:
+    """Return the server relative url of a folder, or a file in it, in the client's document library."""
+
+    url = f"/{sharepoint_api.site_type}/{sharepoint_api.site_name}/{sharepoint_api.document_library}/{folder_name}"
+
+    return f"{url}/{file_name}" if file_name else url
+
+
+def list_files(sharepoint_api: Sharepoint, folder_name: str) -> list[dict]:
+    """
+    Retrieve the files in a folder with their Name, ETag, TimeLastModified and Length.
+    """
+
+    folder_url = server_relative_url(sharepoint_api, folder_name)
+
+    response = send(
+        sharepoint_api,
+        "GET",
+        f"/_api/web/GetFolderByServerRelativeUrl({_odata_string(folder_url)})/Files"
+        "?$select=Name,ETag,TimeLastModified,Length",
+    )
+    response.raise_for_status()
+
+    return response.json().get("value", [])
+
+
+def download_file(
+    sharepoint_api: Sharepoint,
+    folder_name: str,
+    file_name: str,
+    if_none_match: str | None = None,
+) -> tuple[bytes | None, str | None]:
+    """
+    Download a file, conditionally if an eTag is given.
+
+    Returns the content and eTag of the file, or (None, if_none_match) if the file has not changed since that eTag.
+    """
+
+    file_url = server_relative_url(sharepoint_api, folder_name, file_name)
+
+    response = send(
+        sharepoint_api,
+        "GET",
+        f"/_api/web/GetFileByServerRelativeUrl({_odata_string(file_url)})/$value",
+        headers={"If-None-Match": if_none_match} if if_none_match else None,
+    )
+
+    if response.status_code == 304:
+        return None, if_none_match
+
+    response.raise_for_status()
+
+    return response.content, response.headers.get("ETag")
+
+
+def file_etag(sharepoint_api: Sharepoint, folder_name: str, file_name: str) -> str | None:
+    """Return the current eTag of a file, or None if it does not exist."""
+
+    file_url = server_relative_url(sharepoint_api, folder_name, file_name)
+
+    response = send(sharepoint_api, "GET", f"/_api/web/GetFileByServerRelativeUrl({_odata_string(file_url)})?$select=ETag")
+
+    if response.status_code == 404:
+        return None
+
+    response.raise_for_status()
+
+    return response.json().get("ETag")
+
+
+def replace_file(sharepoint_api: Sharepoint, folder_name: str, file_name: str, content, if_match: str) -> str | None:
+    """
+    Replace the content of an existing file in a single request, only if its eTag still matches if_match.
+    Returns the new eTag, and raises FileChangedError if the file has been changed since.
+    """
+
+    file_url = server_relative_url(sharepoint_api, folder_name, file_name)
+
+    response = send(
+        sharepoint_api,
+        "POST",
+        f"/_api/web/GetFileByServerRelativeUrl({_odata_string(file_url)})/$value",
+        headers={"X-HTTP-Method": "PUT", "If-Match": if_match},
+        data=content,
+    )
+
+    if response.status_code == 412:
+        raise FileChangedError(f"'{file_name}' was changed since eTag {if_match}")
+
+    response.raise_for_status()
+
+    return response.headers.get("ETag") or file_etag(sharepoint_api, folder_name, file_name)
+
+
+def upload_file(
+    sharepoint_api: Sharepoint,
+    folder_name: str,
+    file_name: str,
+    content: bytes | BinaryIO,
+    chunk_size: int | None = None,
+) -> None:
+    """
+    Upload a file to a folder, overwriting any existing file. Raises on failure, unlike Sharepoint.upload_file_from_bytes.
+
+    The content can be bytes or a readable stream, e.g. a BytesIO or a streamed download. It is read and sent in
+    chunks of UPLOAD_CHUNK_SIZE, so at most two chunks are held in memory. Content larger than one chunk is sent in
+    an upload session, where each chunk is retried on its own before the session is cancelled.
+    """
+
+    chunks = _read_chunks(content, chunk_size or config.UPLOAD_CHUNK_SIZE)
+
+    first_chunk = next(chunks, b"")
+    next_chunk = next(chunks, None)
+
+    if next_chunk is None:
+        _add_file(sharepoint_api, folder_name, file_name, first_chunk)
+
+        return
+
+    # Upload sessions need an existing file to write to
+    _add_file(sharepoint_api, folder_name, file_name, b"")
+
+    file_url = server_relative_url(sharepoint_api, folder_name, file_name)
+    file_path = f"/_api/web/GetFileByServerRelativeUrl({_odata_string(file_url)})"
+    upload_id = f"guid'{uuid.uuid4()}'"
+
+    try:
+        offset = _send_chunk(sharepoint_api, f"{file_path}/StartUpload(uploadId={upload_id})", first_chunk, 0)
+
+        # Look one chunk ahead, since the last chunk has to be sent with FinishUpload
+        for following_chunk in chunks:
+            offset = _send_chunk(
+                sharepoint_api,
+                f"{file_path}/ContinueUpload(uploadId={upload_id},fileOffset={offset})",
+                next_chunk,
+                offset,
+            )
+            next_chunk = following_chunk
+
+        _send_chunk(sharepoint_api, f"{file_path}/FinishUpload(uploadId={upload_id},fileOffset={offset})", next_chunk, offset)
+
+    except Exception:
+        try:
+            send(sharepoint_api, "POST", f"{file_path}/CancelUpload(uploadId={upload_id})")
+
+        except requests.RequestException:
+            pass
+
+        raise
+
+
+def send(sharepoint_api: Sharepoint, method: str, api_path: str, headers: dict | None = None, **kwargs) -> requests.Response:
+    """Send an authenticated request to a path below the client's site url."""
+
+    url = f"{site_url(sharepoint_api)}{api_path}"
+
+    request_headers = {"Accept": "application/json;odata=nometadata"}
+    request_headers.update(authorization_headers(sharepoint_api, url))
+    request_headers.update(headers or {})
+
+    return _session().request(method, url, headers=request_headers, timeout=REQUEST_TIMEOUT, **kwargs)
+
+
+def authorization_headers(sharepoint_api: Sharepoint, url: str) -> dict:
+    """Return the authorization headers the client context would add to a request for the url."""
+
+    if sharepoint_api.ctx is None:
+        raise ConnectionError(f"Sharepoint client for site '{sharepoint_api.site_name}' is not authenticated")
+
+    request = RequestOptions(url=url)
+    sharepoint_api.ctx.authentication_context.authenticate_request(request)
+
+    return request.headers
+
+
+def _add_file(sharepoint_api: Sharepoint, folder_name: str, file_name: str, content) -> None:
+    folder_url = server_relative_url(sharepoint_api, folder_name)
+
+    response = send(
+        sharepoint_api,
+        "POST",
+        f"/_api/web/GetFolderByServerRelativeUrl({_odata_string(folder_url)})/Files"
+        f"/add(url={_odata_string(file_name)},overwrite=true)",
+        data=content,
+    )
+    response.raise_for_status()
+
+
+def _send_chunk(sharepoint_api: Sharepoint, api_path: str, chunk, offset: int) -> int:
+    # Returns the file offset after the chunk, as reported by SharePoint
+    for attempt in range(1, config.UPLOAD_CHUNK_MAX_RETRIES + 2):
+        try:
+            response = send(sharepoint_api, "POST", api_path, data=chunk)
+            response.raise_for_status()
+
+            break
+
+        except requests.RequestException:
+            if attempt > config.UPLOAD_CHUNK_MAX_RETRIES:
+                raise
+
+            time.sleep(config.RETRY_BASE_DELAY * (2 ** (attempt - 1)))
+
+    try:
+        return int(response.json()["value"])
+
+    except (ValueError, KeyError, TypeError):
+        return offset + len(chunk)
+
+
+def _read_chunks(content, chunk_size: int) -> Iterator[memoryview]:
+    # In-memory content is sliced without copying, streams are read into one new buffer per chunk
+    if isinstance(content, (bytes, bytearray, memoryview)):
+        content = memoryview(content)
+
+    elif isinstance(content, BytesIO):
+        content = content.getbuffer()[content.tell():]
+
+    if isinstance(content, memoryview):
+        for offset in range(0, len(content), chunk_size):
+            yield content[offset:offset + chunk_size]
+
+        return
+
+    while True:
+        chunk = memoryview(bytearray(chunk_size))
+        size = 0
+
+        while size < chunk_size:
+            read = content.readinto(chunk[size:])
+
+            if not read:
+                break
+
+            size += read
+
+        if size:
+            yield chunk[:size]
+
+        if size < chunk_size:
+            return
+
+
+def _session() -> requests.Session:
+    # One keep-alive session per thread, since sessions are not guaranteed to be thread safe
+    session = getattr(_SESSIONS, "session", None)
+
+    if session is None:
+        session = requests.Session()
+        _SESSIONS.session = session
+
+    return session
+
+
+def _odata_string(value: str) -> str:
+    return urllib.parse.quote("'" + value.replace("'", "''") + "'")
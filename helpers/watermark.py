@@ -0,0 +1,109 @@
+"""
+Module for persisting per-form high-water marks used for incremental extraction.
+
+Marks are kept in WATERMARK_FILE under STATE_DIR, which must persist between runs for extraction to be incremental.
+A form without a mark - e.g. on the first run, or when the file is missing or unreadable - is read in full.
+"""
+
+import json
+import logging
+import os
+import tempfile
+
+from datetime import datetime, timedelta
+
+from helpers import config
+
+logger = logging.getLogger(__name__)
+
+_PENDING_WATERMARKS: dict[str, dict] = {}
+
+
+def load_watermark(form_type: str) -> dict | None:
+    """
+    Return the persisted high-water mark for the given form type, or None if no mark exists.
+    """
+
+    if not config.INCREMENTAL_EXTRACTION:
+        return None
+
+    return _read_watermarks().get(form_type)
+
+
+def make_watermark(form_submitted_date: datetime, form_id) -> dict:
+    """Build a high-water mark from the submitted date and id of a journalizing row."""
+
+    return {
+        "form_submitted_date": form_submitted_date.isoformat(),
+        "form_id": form_id,
+    }
+
+
+def watermark_since(watermark: dict | None) -> datetime | None:
+    """
+    Return the lower bound to query from for the given mark, including the configured lookback
+    that protects against rows synced to the view after newer ones.
+    """
+
+    if not watermark:
+        return None
+
+    since = datetime.fromisoformat(watermark["form_submitted_date"])
+
+    return since - timedelta(hours=config.WATERMARK_LOOKBACK_HOURS)
+
+
+def stage_watermark(form_type: str, watermark: dict | None) -> None:
+    """Stage a new mark for the form. It is only persisted once commit_watermarks is called."""
+
+    if config.INCREMENTAL_EXTRACTION and watermark:
+        _PENDING_WATERMARKS[form_type] = watermark
+
+
+def commit_watermarks() -> None:
+    """Persist all staged marks, e.g. after the work items have been added to the queue."""
+
+    if not _PENDING_WATERMARKS:
+        return
+
+    watermarks = _read_watermarks()
+    watermarks.update(_PENDING_WATERMARKS)
+
+    watermark_dir = os.path.dirname(config.WATERMARK_FILE)
+    os.makedirs(watermark_dir, exist_ok=True)
+
+    # Concurrent runs each write a uniquely named temp file, so neither can replace the marks with a half-written file
+    with tempfile.NamedTemporaryFile("w", dir=watermark_dir, suffix=".tmp", delete=False, encoding="utf-8") as f:
+        json.dump(watermarks, f, indent=2, ensure_ascii=False, default=str)
+
+    try:
+        os.replace(f.name, config.WATERMARK_FILE)
+
+    except OSError:
+        os.remove(f.name)
+
+        raise
+
+    logger.info(f"Committed watermarks for: {', '.join(sorted(_PENDING_WATERMARKS))}")
+
+    _PENDING_WATERMARKS.clear()
+
+
+def discard_watermarks() -> None:
+    """Drop all staged marks, so the next run scans from the previous marks again."""
+
+    _PENDING_WATERMARKS.clear()
+
+
+def _read_watermarks() -> dict:
+    if not os.path.exists(config.WATERMARK_FILE):
+        return {}
+
+    try:
+        with open(config.WATERMARK_FILE, encoding="utf-8") as f:
+            return json.load(f)
+
+    except (OSError, json.JSONDecodeError) as e:
+        logger.warning(f"Could not read watermark file, falling back to full scan: {e}")
+
+        return {}
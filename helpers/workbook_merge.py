@@ -0,0 +1,275 @@
+"""
+Module to write new rows into a workbook locally, with one download and one upload per work item.
+
+The rows in the workbook and the new rows are both ordered by serial number, descending, so they are combined in
+a single linear merge, instead of appending the rows and re-sorting the whole sheet. Only the new rows, and columns
+whose width changes, are formatted - the result matches what format_and_sort_excel_file does with WORKBOOK_FORMAT.
+The workbook is replaced with an If-Match eTag guard, so a concurrent change is never overwritten; the merge is
+retried on the new version instead.
+"""
+
+import heapq
+import logging
+import math
+
+from io import BytesIO
+
+from openpyxl import Workbook, load_workbook
+from openpyxl.styles import Alignment, Font
+from openpyxl.worksheet.worksheet import Worksheet
+
+from mbu_msoffice_integration.sharepoint_class import Sharepoint
+
+from helpers import config, sharepoint_cache, sharepoint_rest
+
+# Formatting of the workbooks, also passed to format_and_sort_excel_file in append mode
+WORKBOOK_FORMAT = {
+    "sorting_keys": [{"key": "A", "ascending": False, "type": "int"}],
+    "bold_rows": [1],
+    "align_horizontal": "left",
+    "align_vertical": "top",
+    "italic_rows": None,
+    "font_config": None,
+    "column_widths": 100,
+    "freeze_panes": "A2",
+}
+
+ROW_HEIGHT_PER_LINE = 20
+
+logger = logging.getLogger(__name__)
+
+
+def merge_into_workbook(
+    sharepoint_api: Sharepoint,
+    folder_name: str,
+    excel_file_name: str,
+    sheet_name: str,
+    new_rows: list[dict],
+) -> None:
+    """Merge new rows into an existing workbook, retrying on the new version if it is changed concurrently."""
+
+    for attempt in range(1, config.EXCEL_MERGE_MAX_RETRIES + 2):
+        content, etag = sharepoint_cache.fetch_file_with_etag(sharepoint_api, folder_name, excel_file_name)
+
+        workbook = load_workbook(BytesIO(content))
+
+        if sheet_name not in workbook.sheetnames:
+            raise ValueError(f"Sheet '{sheet_name}' not found in '{excel_file_name}'")
+
+        merge_rows(workbook[sheet_name], new_rows)
+
+        excel_stream = BytesIO()
+        workbook.save(excel_stream)
+
+        try:
+            new_etag = sharepoint_rest.replace_file(
+                sharepoint_api,
+                folder_name,
+                excel_file_name,
+                excel_stream.getbuffer(),
+                if_match=etag or sharepoint_rest.file_etag(sharepoint_api, folder_name, excel_file_name),
+            )
+
+        except sharepoint_rest.FileChangedError:
+            if attempt > config.EXCEL_MERGE_MAX_RETRIES:
+                raise
+
+            logger.info(f"'{excel_file_name}' was changed concurrently - merging again (attempt {attempt})")
+
+            continue
+
+        # The next item for this workbook starts from the uploaded version, without downloading it again
+        sharepoint_cache.store(sharepoint_api, folder_name, excel_file_name, excel_stream.getbuffer(), new_etag)
+
+        return
+
+
+def create_workbook(
+    sharepoint_api: Sharepoint,
+    folder_name: str,
+    excel_file_name: str,
+    sheet_name: str,
+    columns: list[str],
+    rows: list[dict],
+) -> None:
+    """Create a new, formatted workbook with the rows, sorted like merge_into_workbook sorts them."""
+
+    workbook = Workbook()
+    worksheet = workbook.active
+    worksheet.title = sheet_name
+
+    worksheet.append(columns)
+
+    merge_rows(worksheet, rows)
+
+    excel_stream = BytesIO()
+    workbook.save(excel_stream)
+
+    sharepoint_rest.upload_file(sharepoint_api, folder_name, excel_file_name, excel_stream)
+
+    etag = sharepoint_rest.file_etag(sharepoint_api, folder_name, excel_file_name)
+    sharepoint_cache.store(sharepoint_api, folder_name, excel_file_name, excel_stream.getbuffer(), etag)
+
+
+def merge_rows(worksheet: Worksheet, new_rows: list[dict]) -> None:
+    """
+    Merge new rows into a worksheet whose rows are sorted by serial number (column A), descending.
+    Empty rows are dropped, and values missing from a new row are written as "", like append_row_to_sharepoint_excel.
+    """
+
+    headers = [cell.value for cell in worksheet[1]]
+    old_max_row = worksheet.max_row
+    is_new_sheet = old_max_row == 1
+
+    # Existing rows keep their measured height, new rows are measured below
+    existing_items = []
+
+    for row_index, row in enumerate(worksheet.iter_rows(min_row=2, values_only=True), start=2):
+        if any(value is not None for value in row):
+            values = list(row) + [None] * (len(headers) - len(row))
+            existing_items.append((values, worksheet.row_dimensions[row_index].height))
+
+    new = sorted(([row.get(header, "") for header in headers] for row in new_rows), key=_sort_key, reverse=True)
+    new_items = [(values, None) for values in new]
+
+    if _is_sorted_descending([values for values, _ in existing_items]):
+        merged = list(heapq.merge(existing_items, new_items, key=lambda item: _sort_key(item[0]), reverse=True))
+
+    else:
+        logger.info(f"Sheet '{worksheet.title}' is not sorted by serial number - sorting all rows")
+        merged = sorted(existing_items + new_items, key=lambda item: _sort_key(item[0]), reverse=True)
+
+    column_widths, wrapped_columns, rewrap = _update_column_widths(worksheet, headers, new, is_new_sheet)
+
+    # Rewrite the values in merged order - cells that already existed keep their formatting
+    for row_index, (values, _) in enumerate(merged, start=2):
+        for column_index, value in enumerate(values, start=1):
+            cell = worksheet.cell(row=row_index, column=column_index)
+
+            if cell.value != value:
+                cell.value = value
+
+        if row_index > old_max_row:
+            _format_row(worksheet, row_index, len(headers), wrapped_columns, bold=False)
+
+    # Dropped empty rows leave stale rows at the bottom
+    last_row = len(merged) + 1
+
+    if old_max_row > last_row:
+        worksheet.delete_rows(last_row + 1, old_max_row - last_row)
+
+    if is_new_sheet:
+        _format_row(worksheet, 1, len(headers), wrapped_columns, bold=True)
+
+    # Heights only change for new rows, unless a column became wrapped
+    if rewrap or is_new_sheet:
+        worksheet.row_dimensions[1].height = _row_height(headers, column_widths, wrapped_columns)
+
+    for row_index, (values, height) in enumerate(merged, start=2):
+        if height is None or rewrap:
+            height = _row_height(values, column_widths, wrapped_columns)
+
+        if worksheet.row_dimensions[row_index].height != height:
+            worksheet.row_dimensions[row_index].height = height
+
+    worksheet.freeze_panes = WORKBOOK_FORMAT["freeze_panes"]
+
+
+def _sort_key(values: list):
+    # Numeric serial numbers first, descending - like sorting column A as "int" with non-numbers last
+    try:
+        return (1, float(values[0]))
+
+    except (TypeError, ValueError, IndexError):
+        return (0, 0.0)
+
+
+def _is_sorted_descending(rows: list[list]) -> bool:
+    return all(_sort_key(a) >= _sort_key(b) for a, b in zip(rows, rows[1:]))
+
+
+def _update_column_widths(
+    worksheet: Worksheet,
+    headers: list,
+    new: list[list],
+    is_new_sheet: bool,
+) -> tuple[dict[int, float], set[int], bool]:
+    """
+    Widen columns for the new values, capped at the configured width, wrapping columns whose content exceeds it.
+    Returns the widths and wrapped columns by column index, and whether any column became wrapped.
+    """
+
+    width_limit = WORKBOOK_FORMAT["column_widths"]
+
+    column_widths = {}
+    wrapped_columns = set()
+    rewrap = False
+
+    for column_index, header in enumerate(headers, start=1):
+        header_cell = worksheet.cell(row=1, column=column_index)
+        column_letter = header_cell.column_letter
+
+        width = worksheet.column_dimensions[column_letter].width if not is_new_sheet else None
+        is_wrapped = bool(header_cell.alignment and header_cell.alignment.wrap_text) and not is_new_sheet
+
+        content_length = max(
+            [len(str(header or "")) if width is None else width - 2]
+            + [len(str(values[column_index - 1] or "")) for values in new]
+        )
+
+        if not is_wrapped and content_length + 2 > width_limit:
+            width = width_limit
+            is_wrapped = True
+            rewrap = not is_new_sheet
+
+            _wrap_column(worksheet, column_index)
+
+        elif not is_wrapped:
+            width = content_length + 2
+
+        if worksheet.column_dimensions[column_letter].width != width:
+            worksheet.column_dimensions[column_letter].width = width
+
+        column_widths[column_index] = width
+
+        if is_wrapped:
+            wrapped_columns.add(column_index)
+
+    return column_widths, wrapped_columns, rewrap
+
+
+def _wrap_column(worksheet: Worksheet, column_index: int) -> None:
+    for (cell,) in worksheet.iter_rows(min_col=column_index, max_col=column_index):
+        cell.alignment = _alignment(wrap_text=True)
+
+
+def _format_row(worksheet: Worksheet, row_index: int, column_count: int, wrapped_columns: set[int], bold: bool) -> None:
+    font = Font(bold=bold, italic=False)
+
+    for column_index in range(1, column_count + 1):
+        cell = worksheet.cell(row=row_index, column=column_index)
+
+        cell.font = font
+        cell.alignment = _alignment(wrap_text=column_index in wrapped_columns)
+
+
+def _alignment(wrap_text: bool) -> Alignment:
+    return Alignment(
+        horizontal=WORKBOOK_FORMAT["align_horizontal"],
+        vertical=WORKBOOK_FORMAT["align_vertical"],
+        wrap_text=wrap_text or None,
+    )
+
+
+def _row_height(values: list, column_widths: dict[int, float], wrapped_columns: set[int]) -> int:
+    max_line_count = 1
+
+    for column_index in wrapped_columns:
+        value = values[column_index - 1] if column_index <= len(values) else None
+
+        if value:
+            chars_per_line = (column_widths[column_index] or 10) * 1.2
+            line_count = sum(math.ceil(len(line) / chars_per_line) for line in str(value).split("\n"))
+            max_line_count = max(max_line_count, line_count)
+
+    return max_line_count * ROW_HEIGHT_PER_LINE
@@ -14,13 +14,20 @@ from automation_server_client import AutomationServer, Workqueue
 from mbu_rpa_core.exceptions import BusinessError, ProcessError
 from mbu_rpa_core.process_states import CompletedState
 
-from helpers import ats_functions, config
-
-from processes.application_handler import close, reset, startup
-from processes.error_handling import ErrorContext, handle_error
-from processes.finalize_process import finalize_process
-from processes.process_item import process_item
-from processes.queue_handler import concurrent_add, retrieve_items_for_queue
+from helpers import ats_functions, config, metrics, profiling
+
+# Each mode imports its modules when it runs, so e.g. --finalize never loads pandas, sqlalchemy or PIL.
+# Keep MODE_MODULES in sync with the imports in the mode functions - it is what --import-profile measures.
+MODE_MODULES = {
+    "--queue": ("helpers.db", "helpers.sharepoint_cache", "helpers.watermark", "processes.queue_handler"),
+    "--process": (
+        "helpers.sharepoint_cache",
+        "processes.application_handler",
+        "processes.error_handling",
+        "processes.process_item",
+    ),
+    "--finalize": ("processes.error_handling", "processes.finalize_process"),
+}
 
 load_dotenv()  # Loads variables from .env
 
@@ -54,98 +61,216 @@ logger = logging.getLogger(__name__)
 async def populate_queue(workqueue: Workqueue):
     """Populate the workqueue with items to be processed."""
 
-    logger.info("Populating workqueue...")
+    # pylint: disable=import-outside-toplevel
+    from helpers import db, sharepoint_cache, watermark
+    from processes.queue_handler import concurrent_add, retrieve_items_for_queue
 
-    items_to_queue = retrieve_items_for_queue(sharepoint_kwargs=SHAREPOINT_KWARGS)
+    logger.info("Populating workqueue...")
 
     queue_references = {str(r) for r in ats_functions.get_workqueue_items(workqueue)}
 
-    new_items: list[dict] = []
+    try:
+        # Submissions in an item queued earlier today are left out, so only the rest of a partly queued run is queued
+        items_to_queue = retrieve_items_for_queue(sharepoint_kwargs=SHAREPOINT_KWARGS, queue_references=queue_references)
+
+    finally:
+        db.dispose_engines()
+
+    new_items = [item for item in items_to_queue if str(item.get("reference") or "") not in queue_references]
 
-    for item in items_to_queue:
-        reference = str(item.get("reference") or "")
+    failures = await concurrent_add(workqueue, new_items)
 
-        if reference and reference in queue_references:
-            continue
+    # Only move the high-water marks forward once every new item is safely in the queue
+    if failures == 0:
+        watermark.commit_watermarks()
 
-        new_items.append(item)
+    else:
+        logger.warning("Not all items were added - keeping previous watermarks")
+        watermark.discard_watermarks()
 
-    await concurrent_add(workqueue, new_items)
+    sharepoint_cache.log_stats()
     logger.info("Finished populating workqueue.")
 
 
 async def process_workqueue(workqueue: Workqueue):
     """Process items from the workqueue."""
 
+    # pylint: disable=import-outside-toplevel
+    from helpers import sharepoint_cache
+    from processes.application_handler import close, reset, startup
+
     logger.info("Processing workqueue...")
 
     startup(logger=logger)
 
-    error_count = 0
+    if config.PROCESS_CONCURRENCY > 1:
+        await process_workqueue_in_lanes(workqueue)
+
+    else:
+        error_count = 0
+
+        while error_count < config.MAX_RETRY:
+            for item in workqueue:
+                if handle_item(item, workqueue):
+                    error_count += 1
+
+                    reset(logger=logger)
+
+            break
+
+    sharepoint_cache.log_stats()
+    logger.info("Finished processing workqueue.")
+    close(logger=logger)
+
+
+async def process_workqueue_in_lanes(workqueue: Workqueue):
+    """
+    Process items from the workqueue in parallel, with at most PROCESS_CONCURRENCY items in progress.
+    Items writing the same workbook share a lane and are processed in order, so appends and sorts cannot race.
+    """
+
+    from processes.application_handler import reset  # pylint: disable=import-outside-toplevel
 
-    while error_count < config.MAX_RETRY:
-        for item in workqueue:
+    slots = asyncio.Semaphore(config.PROCESS_CONCURRENCY)
+    lanes: dict[tuple, asyncio.Queue] = {}
+    lane_tasks = []
+    error_counts: dict[tuple, int] = {}
+
+    async def run_lane(lane_key: tuple, lane: asyncio.Queue):
+        error_counts[lane_key] = 0
+
+        while (item := await lane.get()) is not None:
             try:
-                with item:
-                    data, reference = ats_functions.get_item_info(item)
+                if await asyncio.to_thread(handle_item, item, workqueue):
+                    error_counts[lane_key] += 1
+
+                    if error_counts[lane_key] == config.MAX_RETRY:
+                        logger.warning(f"Lane {lane_key} reached {config.MAX_RETRY} process errors")
+
+                    await asyncio.to_thread(reset, logger=logger)
+
+            finally:
+                slots.release()
+
+    items = iter(workqueue)
+
+    while True:
+        # Only fetch the next item when a slot is free, since fetching marks it as in progress
+        await slots.acquire()
+
+        item = await asyncio.to_thread(next, items, None)
+
+        if item is None:
+            slots.release()
+            break
+
+        lane_key = workbook_lane_key(item)
 
-                    try:
-                        logger.info(f"Processing item with reference: {reference}")
-                        process_item(item_data=data, sharepoint_kwargs=SHAREPOINT_KWARGS)
+        if lane_key not in lanes:
+            lanes[lane_key] = asyncio.Queue()
+            lane_tasks.append(asyncio.create_task(run_lane(lane_key, lanes[lane_key])))
 
-                        logger.info(f"Finished processing item with reference: {reference}")
+        lanes[lane_key].put_nowait(item)
 
-                        completed_state = CompletedState.completed("Process completed without exceptions")
-                        item.complete(str(completed_state))
+    for lane in lanes.values():
+        lane.put_nowait(None)
 
-                        continue
+    await asyncio.gather(*lane_tasks)
 
-                    except BusinessError as e:
-                        context = ErrorContext(
-                            item=item,
-                            action=item.pending_user,
-                            send_mail=False,
-                            process_name=workqueue.name,
-                        )
+    logger.info(f"Processed workqueue in {len(lanes)} lanes - process errors per lane: {error_counts}")
 
-                        handle_error(
-                            error=e,
-                            log=logger.info,
-                            context=context,
-                        )
 
-                    except Exception as e:
-                        pe = ProcessError(str(e))
+def workbook_lane_key(item) -> tuple:
+    """Return the (site_name, folder_name, excel_file_name) the item writes to."""
 
-                        raise pe from e
+    try:
+        data, _ = ats_functions.get_item_info(item, decode_submissions=False)
+        item_config = data.get("config", {})
+
+        return (item_config["site_name"], item_config["folder_name"], item_config["excel_file_name"])
+
+    except Exception:
+        # Items that cannot be unpacked fail in handle_item - they share a lane of their own
+        return ("", "", "")
+
+
+def handle_item(item, workqueue: Workqueue) -> bool:
+    """
+    Process a single work item and complete, fail or mark it pending user.
+    Returns True if the item failed with a ProcessError.
+    """
+
+    # pylint: disable=import-outside-toplevel
+    from processes.error_handling import ErrorContext, handle_error
+    from processes.process_item import process_item
+
+    try:
+        with item:
+            data, reference = ats_functions.get_item_info(item)
+
+            try:
+                logger.info(f"Processing item with reference: {reference}")
+
+                form_key = data.get("config", {}).get("os2_webform_id")
+
+                with metrics.collect() as item_metrics, profiling.profile_item(reference, form_key, item_metrics):
+                    process_item(item_data=data, sharepoint_kwargs=SHAREPOINT_KWARGS)
+
+                logger.info(f"Finished processing item with reference: {reference}")
+
+                # The item's stage timings are kept with it, e.g. to find the slow workbooks of a run
+                completed_state = CompletedState.completed(
+                    f"Process completed without exceptions - metrics: {metrics.item_summary(item_metrics)}"
+                )
+                item.complete(str(completed_state))
+
+                return False
 
-            except ProcessError as e:
+            except BusinessError as e:
                 context = ErrorContext(
                     item=item,
-                    action=item.fail,
-                    send_mail=True,
+                    action=item.pending_user,
+                    send_mail=False,
                     process_name=workqueue.name,
                 )
 
                 handle_error(
                     error=e,
-                    log=logger.error,
+                    log=logger.info,
                     context=context,
                 )
 
-                error_count += 1
+            except Exception as e:
+                pe = ProcessError(str(e))
 
-                reset(logger=logger)
+                raise pe from e
 
-        break
+    except ProcessError as e:
+        context = ErrorContext(
+            item=item,
+            action=item.fail,
+            send_mail=True,
+            process_name=workqueue.name,
+        )
 
-    logger.info("Finished processing workqueue.")
-    close(logger=logger)
+        handle_error(
+            error=e,
+            log=logger.error,
+            context=context,
+        )
+
+        return True
+
+    return False
 
 
 async def finalize(workqueue: Workqueue):
     """Finalize process."""
 
+    # pylint: disable=import-outside-toplevel
+    from processes.error_handling import ErrorContext, handle_error
+    from processes.finalize_process import finalize_process
+
     logger.info("Finalizing process...")
 
     try:
@@ -167,6 +292,12 @@ async def finalize(workqueue: Workqueue):
 
 
 if __name__ == "__main__":
+    if "--import-profile" in sys.argv:
+        # Report the import time of each requested mode (all modes if none are given), exits 1 if over budget
+        from helpers import import_profile  # pylint: disable=import-outside-toplevel
+
+        sys.exit(import_profile.report([mode for mode in MODE_MODULES if mode in sys.argv] or list(MODE_MODULES)))
+
     ats_functions.init_logger()
 
     ats = AutomationServer.from_environment()
@@ -175,15 +306,19 @@ if __name__ == "__main__":
     process = ats.process
 
     # Queue management
+    # Each mode writes a summary of its stage metrics to METRICS_DIR when it ends, and is profiled with --profile
     if "--queue" in sys.argv:
-        asyncio.run(populate_queue(prod_workqueue))
+        with metrics.run("queue") as run_metrics, profiling.profile_mode("queue", run_metrics):
+            asyncio.run(populate_queue(prod_workqueue))
 
     if "--process" in sys.argv:
         # Process workqueue
-        asyncio.run(process_workqueue(prod_workqueue))
+        with metrics.run("process") as run_metrics, profiling.profile_mode("process", run_metrics):
+            asyncio.run(process_workqueue(prod_workqueue))
 
     if "--finalize" in sys.argv:
         # Finalize process
-        asyncio.run(finalize(prod_workqueue))
+        with metrics.run("finalize") as run_metrics, profiling.profile_mode("finalize", run_metrics):
+            asyncio.run(finalize(prod_workqueue))
 
     sys.exit(0)
@@ -2,16 +2,15 @@
 
 import base64
 import json
-import smtplib
 from collections.abc import Callable
 from dataclasses import dataclass
 from email.message import EmailMessage
 from io import BytesIO
 
 from automation_server_client import WorkItem
-from mbu_dev_shared_components.database.connection import RPAConnection
 from mbu_rpa_core.exceptions import BusinessError, ProcessError
-from PIL import ImageGrab
+
+from helpers import config, error_notifications
 
 
 @dataclass
@@ -51,7 +50,14 @@ def handle_error(
         if context.action:
             context.action(error_json)
     log(log_msg)
-    if context.send_mail:
+    if context.send_mail and config.ERROR_MAIL_DIGEST:
+        # Queued for the next error digest, so the item loop never waits for the mail
+        error_notifications.notify(
+            error_info=error.__dictinfo__(),
+            process_name=context.process_name,
+            grab_screenshot=grab_screenshot if context.add_screenshot else None,
+        )
+    elif context.send_mail:
         send_error_email(
             error=error,
             add_screenshot=context.add_screenshot,
@@ -75,19 +81,12 @@ def send_error_email(
     Raises:
         Exception: If sending the email fails.
     """
-    rpa_conn = RPAConnection(db_env="PROD", commit=False)
-    with rpa_conn:
-        error_email = rpa_conn.get_constant("Error Email")["value"]
-        error_sender = rpa_conn.get_constant("Email Friend")[
-            "value"
-        ]  # Find in database...
-        smtp_server = rpa_conn.get_constant("smtp_server")["value"]
-        smtp_port = rpa_conn.get_constant("smtp_port")["value"]
+    settings = error_notifications.mail_settings()
 
     # Create message
     msg = EmailMessage()
-    msg["to"] = error_email
-    msg["from"] = error_sender
+    msg["to"] = settings.recipient
+    msg["from"] = settings.sender
     msg["subject"] = "Error screenshot" + f": {process_name}" if process_name else ""
 
     # Create an HTML message with the exception and screenshot
@@ -120,8 +119,7 @@ def send_error_email(
     msg.add_alternative(html_message, subtype="html")
 
     # Send message
-    with smtplib.SMTP(smtp_server, smtp_port) as smtp:
-        smtp.starttls()
+    with error_notifications.open_smtp(settings) as smtp:
         smtp.send_message(msg)
 
 
@@ -134,6 +132,9 @@ def grab_screenshot() -> str:
     Raises:
         Exception: If screenshot capture fails.
     """
+    # Imported here, since PIL is slow to load and only needed when an error mail includes a screenshot
+    from PIL import ImageGrab  # pylint: disable=import-outside-toplevel
+
     # Take screenshot and convert to base64
     screenshot = ImageGrab.grab()
     buffer = BytesIO()
@@ -2,18 +2,27 @@
 
 import logging
 
-import pandas as pd
-
-from dotenv import load_dotenv
-
+from dataclasses import dataclass
 from io import BytesIO
 
-from mbu_dev_shared_components.database.connection import RPAConnection
+from dotenv import load_dotenv
 
 from mbu_msoffice_integration.sharepoint_class import Sharepoint
-
-from helpers import helper_functions
-from helpers.config import WEBFORMS_CONFIG
+from mbu_rpa_core.exceptions import ProcessError
+
+from helpers import (
+    form_transform,
+    helper_functions,
+    metrics,
+    payload_codec,
+    secrets_provider,
+    serial_index,
+    sharepoint_pool,
+    sharepoint_rest,
+    workbook_merge,
+)
+from helpers.config import EXCEL_WRITE_MODE, WEBFORMS_CONFIG
+from helpers.form_transform import SERIAL_NUMBER_COLUMN
 
 load_dotenv()  # Loads variables from .env
 
@@ -22,10 +31,6 @@ SHAREPOINT_DOCUMENT_LIBRARY = "Delte dokumenter"
 
 SHEET_NAME = "Besvarelser"
 
-RPA_CONN = RPAConnection(db_env="PROD", commit=False)
-with RPA_CONN:
-    OS2_API_KEY = RPA_CONN.get_credential("os2_api").get("decrypted_password", "")
-
 logger = logging.getLogger(__name__)
 
 
@@ -33,48 +38,133 @@ def process_item(item_data: dict, sharepoint_kwargs: dict):
     """Function to handle item processing"""
 
     config = item_data.get("config", {})
+    os2_webform_id = config.get("os2_webform_id")
+
+    # The client is leased to this item for all its steps, since a client context must not be shared between threads
+    try:
+        with metrics.span("auth", form=os2_webform_id):
+            sharepoint_api = sharepoint_pool.checkout_client(
+                sharepoint_kwargs,
+                site_url=SHAREPOINT_SITE_URL,
+                site_name=config["site_name"],
+                document_library=SHAREPOINT_DOCUMENT_LIBRARY,
+            )
+
+    except Exception as e:
+        logger.info(f"Error when trying to authenticate: {e}")
+
+        raise
+
+    try:
+        _process_item_with_client(item_data, sharepoint_api, sharepoint_kwargs)
+
+    finally:
+        sharepoint_pool.return_client(sharepoint_api)
+
 
-    site_name = config["site_name"]
-    folder_name = config["folder_name"]
-    excel_file_name = config["excel_file_name"]
+@dataclass
+class TargetWorkbook:
+    """The workbook a work item writes to, and the client leased to the item for writing it"""
+
+    sharepoint_api: Sharepoint
+    folder_name: str
+    excel_file_name: str
+    os2_webform_id: str
+
+
+def _process_item_with_client(item_data: dict, sharepoint_api: Sharepoint, sharepoint_kwargs: dict):
+    config = item_data.get("config", {})
+
+    workbook = TargetWorkbook(
+        sharepoint_api=sharepoint_api,
+        folder_name=config["folder_name"],
+        excel_file_name=config["excel_file_name"],
+        os2_webform_id=config.get("os2_webform_id"),
+    )
     excel_file_exists = config.get("excel_file_exists", False)
 
-    os2_webform_id = config.get("os2_webform_id")
+    # Row dicts, or a columnar table - row dicts are only built for the paths that append them
+    submissions = item_data.get("submissions", [])
 
-    formular_mapping = WEBFORMS_CONFIG[os2_webform_id]["formular_mapping"]
+    # Every stage below is labelled with the form, and collected per item by the caller (see helpers.metrics)
+    with metrics.span("workbook_etag", form=workbook.os2_webform_id):
+        previous_etag = serial_index.workbook_etag(sharepoint_api, workbook.folder_name, workbook.excel_file_name)
 
-    upload_pdfs_to_sharepoint_folder_name = config.get("upload_pdfs_to_sharepoint_folder_name", "")
-    file_url = config.get("file_url", "")
+    # When new submissions are split into chunks, the first chunk processed creates the workbook and the rest append
+    if not excel_file_exists and previous_etag:
+        logger.info(f"Excel file '{workbook.excel_file_name}' was created by an earlier chunk - appending instead")
+        excel_file_exists = True
 
-    new_submissions = item_data.get("submissions", [])
+    # In merge mode, the workbook is downloaded, merged, formatted and uploaded once per item
+    if EXCEL_WRITE_MODE == "merge":
+        workbook_written = _merge_into_workbook(workbook, submissions, excel_file_exists)
+
+    # If the Excel file does not exist, we create it with all existing submissions
+    elif not excel_file_exists:
+        workbook_written = _create_workbook(workbook, submissions)
+
+    else:
+        workbook_written = _append_to_workbook(workbook, submissions)
+
+    if EXCEL_WRITE_MODE == "append":
+        _format_and_sort(workbook)
+
+    if workbook_written:
+        _index_serials(workbook, submissions, previous_etag, new_workbook=not excel_file_exists)
+
+    _upload_pdfs(workbook, config, sharepoint_kwargs)
+
+
+def _merge_into_workbook(workbook: TargetWorkbook, submissions, excel_file_exists: bool) -> bool:
+    new_submissions = payload_codec.submission_rows(submissions)
+
+    logger.info(f"Merging {len(new_submissions)} new rows into excel file '{workbook.excel_file_name}'")
 
     try:
-        sharepoint_api = Sharepoint(
-            tenant=sharepoint_kwargs["tenant"],
-            client_id=sharepoint_kwargs["client_id"],
-            thumbprint=sharepoint_kwargs["thumbprint"],
-            cert_path=sharepoint_kwargs["cert_path"],
-            site_url=SHAREPOINT_SITE_URL,
-            site_name=site_name,
-            document_library=SHAREPOINT_DOCUMENT_LIBRARY,
-        )
+        with metrics.span("merge", form=workbook.os2_webform_id) as span:
+            if excel_file_exists:
+                workbook_merge.merge_into_workbook(
+                    workbook.sharepoint_api,
+                    workbook.folder_name,
+                    workbook.excel_file_name,
+                    sheet_name=SHEET_NAME,
+                    new_rows=new_submissions,
+                )
+
+            else:
+                workbook_merge.create_workbook(
+                    workbook.sharepoint_api,
+                    workbook.folder_name,
+                    workbook.excel_file_name,
+                    sheet_name=SHEET_NAME,
+                    columns=_column_order(workbook.os2_webform_id),
+                    rows=new_submissions,
+                )
+
+            span.add(rows=len(new_submissions))
+
+        return True
 
     except Exception as e:
-        logger.info(f"Error when trying to authenticate: {e}")
+        logger.info(f"Error when trying to merge rows into excel file in SharePoint: {e}")
+
+        return False
 
-    # If the Excel file does not exist, we create it with all existing submissions
-    if not excel_file_exists:
-        logger.info(f"Excel file '{excel_file_name}' not found - creating new")
 
-        # Force column order according to formular_mapping
-        column_order = list(formular_mapping.values())
+def _create_workbook(workbook: TargetWorkbook, submissions) -> bool:
+    logger.info(f"Excel file '{workbook.excel_file_name}' not found - creating new")
 
-        normalized_submissions = [
-            {col: row.get(col, None) for col in column_order}
-            for row in new_submissions
-        ]
+    with metrics.span("create", form=workbook.os2_webform_id) as span:
+        import pandas as pd  # pylint: disable=import-outside-toplevel
 
-        all_submissions_df = pd.DataFrame(normalized_submissions, columns=column_order)
+        # Force column order according to formular_mapping - nested tables are flattened into their columns
+        column_order = _column_order(workbook.os2_webform_id)
+
+        # Built column by column, straight from the submissions
+        all_submissions_df = pd.DataFrame(
+            payload_codec.submission_columns(submissions, column_order),
+            columns=column_order,
+        )
 
         # Ensure no extra columns slipped in
         all_submissions_df = all_submissions_df[column_order]
@@ -88,55 +178,104 @@ def process_item(item_data: dict, sharepoint_kwargs: dict):
         )
         excel_stream.seek(0)
 
-        try:
-            sharepoint_api.upload_file_from_bytes(
-                binary_content=excel_stream.getvalue(),
-                file_name=excel_file_name,
-                folder_name=folder_name,
-            )
+        span.add(rows=len(all_submissions_df), bytes_out=excel_stream.getbuffer().nbytes)
+
+    try:
+        # Uploaded straight from the stream's buffer, in chunks for large workbooks
+        with metrics.span("upload", form=workbook.os2_webform_id) as span:
+            sharepoint_rest.upload_file(workbook.sharepoint_api, workbook.folder_name, workbook.excel_file_name, excel_stream)
+            span.add(bytes_out=excel_stream.getbuffer().nbytes)
 
-        except Exception as e:
-            logger.info(f"Error when trying to upload excel file to SharePoint: {e}")
+        return True
 
-    elif excel_file_exists:
-        logger.info(f"Excel file '{excel_file_name}' already exists - appending new rows")
+    except Exception as e:
+        logger.info(f"Error when trying to upload excel file to SharePoint: {e}")
 
-        try:
-            sharepoint_api.append_row_to_sharepoint_excel(
-                folder_name=folder_name,
-                excel_file_name=excel_file_name,
+        return False
+
+
+def _append_to_workbook(workbook: TargetWorkbook, submissions) -> bool:
+    logger.info(f"Excel file '{workbook.excel_file_name}' already exists - appending new rows")
+
+    try:
+        with metrics.span("append", form=workbook.os2_webform_id) as span:
+            new_rows = payload_codec.submission_rows(submissions)
+
+            workbook.sharepoint_api.append_row_to_sharepoint_excel(
+                folder_name=workbook.folder_name,
+                excel_file_name=workbook.excel_file_name,
                 sheet_name=SHEET_NAME,
-                new_rows=new_submissions,
+                new_rows=new_rows,
             )
+            span.add(rows=len(new_rows))
+
+        return True
+
+    except Exception as e:
+        logger.info(f"Error when trying to append row to existing excel file in SharePoint: {e}")
 
-        except Exception as e:
-            logger.info(f"Error when trying to append row to existing excel file in SharePoint: {e}")
+        return False
 
+
+def _format_and_sort(workbook: TargetWorkbook) -> None:
     logger.info("Formatting and sorting excel file")
+
     try:
-        sharepoint_api.format_and_sort_excel_file(
-            folder_name=folder_name,
-            excel_file_name=excel_file_name,
-            sheet_name=SHEET_NAME,
-            sorting_keys=[{"key": "A", "ascending": False, "type": "int"}],
-            bold_rows=[1],
-            align_horizontal="left",
-            align_vertical="top",
-            italic_rows=None,
-            font_config=None,
-            column_widths=100,
-            freeze_panes="A2",
-        )
+        with metrics.span("format_and_sort", form=workbook.os2_webform_id):
+            workbook.sharepoint_api.format_and_sort_excel_file(
+                folder_name=workbook.folder_name,
+                excel_file_name=workbook.excel_file_name,
+                sheet_name=SHEET_NAME,
+                **workbook_merge.WORKBOOK_FORMAT,
+            )
 
     except Exception as e:
         logger.info(f"Error when trying format and sort excel file: {e}")
 
-    if upload_pdfs_to_sharepoint_folder_name != "":
-        logger.info("Uploading PDFs to SharePoint")
 
-        helper_functions.upload_pdf_to_sharepoint(
-            sharepoint_api=sharepoint_api,
+def _index_serials(workbook: TargetWorkbook, submissions, previous_etag: str | None, new_workbook: bool) -> None:
+    with metrics.span("serial_index", form=workbook.os2_webform_id) as span:
+        serials = payload_codec.submission_columns(submissions, [SERIAL_NUMBER_COLUMN])[SERIAL_NUMBER_COLUMN]
+
+        serial_index.add_serials(
+            workbook.sharepoint_api,
+            workbook.folder_name,
+            workbook.excel_file_name,
+            serials=serials,
+            previous_etag=previous_etag,
+            new_workbook=new_workbook,
+        )
+        span.add(rows=len(serials))
+
+
+def _upload_pdfs(workbook: TargetWorkbook, config: dict, sharepoint_kwargs: dict) -> None:
+    upload_pdfs_to_sharepoint_folder_name = config.get("upload_pdfs_to_sharepoint_folder_name", "")
+    pdf_urls = config.get("pdf_urls") or {}
+
+    # Items queued before pdf_urls was introduced carry a single file_url
+    if not pdf_urls and config.get("file_url"):
+        pdf_urls = {"": config["file_url"]}
+
+    if upload_pdfs_to_sharepoint_folder_name == "" or not pdf_urls:
+        return
+
+    logger.info(f"Uploading {len(pdf_urls)} PDFs to SharePoint")
+
+    # The transfers run on worker threads, each with its own leased client, so they are measured as one stage here
+    with metrics.span("pdf_upload", form=workbook.os2_webform_id) as span:
+        pdf_summary = helper_functions.upload_pdfs_to_sharepoint(
+            sharepoint_api=workbook.sharepoint_api,
             folder_name=upload_pdfs_to_sharepoint_folder_name,
-            os2_api_key=OS2_API_KEY,
-            file_url=file_url,
+            os2_api_key=secrets_provider.get_credential("os2_api").get("decrypted_password", ""),
+            pdf_urls=pdf_urls,
+            sharepoint_kwargs=sharepoint_kwargs,
         )
+        span.add(rows=len(pdf_summary["uploaded"]))
+
+    # Failing the item reports the missing PDFs - when it is run again, the PDFs already in Sharepoint are skipped
+    if pdf_summary["failed"]:
+        raise ProcessError(f"Failed to upload {len(pdf_summary['failed'])} PDFs: {sorted(pdf_summary['failed'])}")
+
+
+def _column_order(os2_webform_id: str) -> list[str]:
+    return list(form_transform.compile_mapping(WEBFORMS_CONFIG[os2_webform_id]["formular_mapping"]).columns)
@@ -2,56 +2,175 @@
 
 import sys
 import os
-import asyncio
 import logging
 import json
 import copy
-
-from automation_server_client import Workqueue
-
 import datetime
+import math
+import re
+import time
 
-from io import BytesIO
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
 
-import pandas as pd
+from automation_server_client import Workqueue
 
 from mbu_msoffice_integration.sharepoint_class import Sharepoint
 
 from helpers import config
 from helpers.config import WEBFORMS_CONFIG
 
-from helpers import helper_functions
+from helpers import (
+    ats_client,
+    form_transform,
+    helper_functions,
+    metrics,
+    payload_codec,
+    query_builder,
+    serial_index,
+    sharepoint_pool,
+    sharepoint_rest,
+)
+from helpers.watermark import load_watermark, stage_watermark
 
 SHAREPOINT_SITE_URL = "https://aarhuskommune.sharepoint.com"
 SHAREPOINT_DOCUMENT_LIBRARY = "Delte dokumenter"
 
+SHEET_NAME = "Besvarelser"
+
 TODAYS_DATE = datetime.date.today()
 
+# e.g. "sundung_aarhus_2025-01-31_100-199", or "sundung_aarhus_2025-01-31" for an unchunked work item
+_WORK_ITEM_REFERENCE = re.compile(r"^(?P<form>.*)_\d{4}-\d{2}-\d{2}(?:_(?P<low>\d+)-(?P<high>\d+))?$")
+
 logger = logging.getLogger(__name__)
 
 
-def retrieve_items_for_queue(sharepoint_kwargs: dict) -> list[dict]:
+@dataclass
+class ScanProgress:
+    """How far the scan of a webform's submissions got, and the high-water marks it started from and found"""
+
+    submission_count: int = 0
+    watermark: dict | None = None  # the committed mark the scan started from
+    newest_watermark: dict | None = None
+    oldest_new_watermark: dict | None = None
+
+
+@dataclass
+class NewSubmissions:
+    """A webform's submissions that are not in its workbook yet"""
+
+    pending_forms: list[tuple] = field(default_factory=list)  # parsed, waiting to be transformed in a batch
+    rows: list[dict] = field(default_factory=list)
+    pdf_urls: dict = field(default_factory=dict)  # {serial number: PDF url}
+
+
+@dataclass
+class FormQueueRun:
+    """State for populating the queue for a single webform"""
+
+    os2_webform_id: str
+    form_config: dict
+    formular_mapping: dict
+    serial_set: set = field(default_factory=set)
+    queued_serial_ranges: list[tuple[float, float]] = field(default_factory=list)  # in work items queued today
+    scan: ScanProgress = field(default_factory=ScanProgress)
+    new: NewSubmissions = field(default_factory=NewSubmissions)
+
+
+def get_selected_form_ids() -> list[str]:
+    """
+    Return the webform ids to populate the queue for.
+    Either every configured form with --all-forms, or each form key given in sys.argv.
+    """
+
+    if "--all-forms" in sys.argv:
+        return list(WEBFORMS_CONFIG)
+
+    return [key for key in WEBFORMS_CONFIG if f"--{key}" in sys.argv or key in sys.argv]
+
+
+def retrieve_items_for_queue(sharepoint_kwargs: dict, queue_references: set[str] | None = None) -> list[dict]:
     """
     Function to populate the workqueue with items.
+
+    Handles every selected form in one run: the SharePoint lookups run concurrently, each with a client leased
+    from the pool, and the submissions for all forms are fetched with a single query.
+
+    Submissions in a work item already queued today, by the serial ranges in queue_references, are left out,
+    so a run that only queued some of its chunks queues the rest when it is run again the same day. The queued
+    work items not yet written to the workbook also bound where reading may stop early (see unwritten_serial_floor).
     """
 
-    new_submissions = []
     queue_items = []
 
     db_conn_string = os.getenv("DBCONNECTIONSTRINGPROD")
 
-    os2_webform_id = next(
-        (key for key in WEBFORMS_CONFIG if f"--{key}" in sys.argv or key in sys.argv),
-        None
-    )
+    os2_webform_ids = get_selected_form_ids()
 
-    if not os2_webform_id:
+    if not os2_webform_ids:
         raise ValueError("No matching form key found in sys.argv")
 
-    form_config = WEBFORMS_CONFIG[os2_webform_id].copy()
-    form_config = copy.deepcopy(WEBFORMS_CONFIG[os2_webform_id])
+    logger.info(f"Webform_ids: {', '.join(os2_webform_ids)}")
+
+    form_runs = [_create_form_run(os2_webform_id) for os2_webform_id in os2_webform_ids]
+
+    for form_run in form_runs:
+        form_run.queued_serial_ranges = queued_serial_ranges(queue_references or set(), form_run.os2_webform_id)
+
+    with ThreadPoolExecutor(max_workers=config.MAX_CONCURRENCY) as executor:
+        logger.info("STEP 1 - Looking for existing excel files")
+        found = list(executor.map(lambda form_run: _lookup_existing_serials(form_run, sharepoint_kwargs), form_runs))
+
+    # Forms whose workbook could not be looked up are skipped until the next run
+    form_runs = [form_run for form_run, ok in zip(form_runs, found) if ok]
+
+    if not form_runs:
+        return queue_items
+
+    logger.info("STEP 2 - Streaming submissions and identifying new ones to append")
+    runs_by_form_id = {form_run.os2_webform_id: form_run for form_run in form_runs}
+
+    submissions = helper_functions.iter_multi_forms_data(
+        conn_string=db_conn_string,
+        form_watermarks={form_run.os2_webform_id: form_run.scan.watermark for form_run in form_runs},
+        known_serials={form_run.os2_webform_id: form_run.serial_set for form_run in form_runs},
+        stop_after_known=config.STOP_AFTER_KNOWN_SERIALS,
+        stop_below_serials={
+            form_run.os2_webform_id: unwritten_serial_floor(
+                queue_references or set(), form_run.os2_webform_id, form_run.serial_set
+            )
+            for form_run in form_runs
+        },
+        form_projections=_form_projections(form_runs) if config.JSON_PROJECTION_PUSHDOWN else None,
+    )
+
+    # Time spent comparing serial numbers, recorded per form once the stream is done
+    diff_seconds = dict.fromkeys(runs_by_form_id, 0.0)
+
+    for os2_webform_id, form, row_watermark in submissions:
+        form_run = runs_by_form_id[os2_webform_id]
+
+        started = time.perf_counter()
+        _add_submission(form_run, form, row_watermark)
+        diff_seconds[os2_webform_id] += time.perf_counter() - started
 
-    logger.info(f"Webform_id: {os2_webform_id}")
+        # New submissions are transformed in batches, so only one batch of parsed forms is held at a time
+        if len(form_run.new.pending_forms) >= config.FORMS_FETCH_BATCH_SIZE:
+            _transform_pending_forms(form_run)
+
+    for os2_webform_id, seconds in diff_seconds.items():
+        metrics.record("diff", seconds, form=os2_webform_id, rows=runs_by_form_id[os2_webform_id].scan.submission_count)
+
+    logger.info("STEP 3 - Appending work_items with new submissions to workqueue")
+    for form_run in form_runs:
+        queue_items.extend(_build_queue_items(form_run))
+
+    return queue_items
+
+
+def _create_form_run(os2_webform_id: str) -> FormQueueRun:
+    form_config = copy.deepcopy(WEBFORMS_CONFIG[os2_webform_id])
 
     ### FOR DEV TESTING ONLY - OVERRIDE SITE AND FOLDER NAME TO AVOID POLLUTING ACTUAL FOLDERS ###
     # testing = True
@@ -62,175 +181,335 @@ def retrieve_items_for_queue(sharepoint_kwargs: dict) -> list[dict]:
     #         form_config["upload_pdfs_to_sharepoint_folder_name"] = "Automation_Server/pdf"
     ### FOR DEV TESTING ONLY - OVERRIDE SITE AND FOLDER NAME TO AVOID POLLUTING ACTUAL FOLDERS ###
 
-    site_name = form_config["site_name"]
-    folder_name = form_config["folder_name"]
-    excel_file_name = form_config["excel_file_name"]
-
     formular_mapping = form_config["formular_mapping"]
     del form_config["formular_mapping"]
 
     form_config["os2_webform_id"] = os2_webform_id
+    form_config["excel_file_exists"] = False
 
-    upload_pdfs_to_sharepoint_folder_name = form_config.get("upload_pdfs_to_sharepoint_folder_name", "")
+    return FormQueueRun(
+        os2_webform_id=os2_webform_id,
+        form_config=form_config,
+        formular_mapping=formular_mapping,
+    )
 
-    form_config["excel_file_exists"] = False
+
+def _lookup_existing_serials(form_run: FormQueueRun, sharepoint_kwargs: dict) -> bool:
+    """
+    Load the serial numbers of the form's workbook, if it exists. Returns False if the workbook could not be looked up,
+    e.g. because authentication or listing the library failed - the form must then be skipped, since queueing it
+    as if it had no workbook would queue its whole history again.
+    """
 
     try:
-        sharepoint_api = Sharepoint(
-            tenant=sharepoint_kwargs["tenant"],
-            client_id=sharepoint_kwargs["client_id"],
-            thumbprint=sharepoint_kwargs["thumbprint"],
-            cert_path=sharepoint_kwargs["cert_path"],
+        # Forms are looked up in parallel, so each lookup leases a client of its own
+        sharepoint_api = sharepoint_pool.checkout_client(
+            sharepoint_kwargs,
             site_url=SHAREPOINT_SITE_URL,
-            site_name=site_name,
+            site_name=form_run.form_config["site_name"],
             document_library=SHAREPOINT_DOCUMENT_LIBRARY,
         )
 
     except Exception as e:
-        logger.info(f"Error when trying to authenticate: {e}")
+        logger.error(f"{form_run.os2_webform_id}: Skipping form - could not authenticate to SharePoint: {e}")
 
-    logger.info("STEP 1 - Fetching all submissions")
-    all_submissions = helper_functions.get_forms_data(
-        conn_string=db_conn_string,
-        form_type=os2_webform_id,
-    )
+        return False
+
+    try:
+        _load_existing_serials(form_run, sharepoint_api)
 
-    logger.info(f"OS2 submissions retrieved - {len(all_submissions)} total submissions found")
+        return True
 
-    if len(all_submissions) == 0:
-        logger.info(f"There are no submissions for webform - {os2_webform_id}")
+    except Exception as e:
+        logger.error(f"{form_run.os2_webform_id}: Skipping form - could not look up its workbook in SharePoint: {e}")
 
-        return queue_items
+        return False
 
-    serial_set = set()
+    finally:
+        sharepoint_pool.return_client(sharepoint_api)
 
-    logger.info("STEP 2 - Looking for existing excel file")
-    try:
-        files_in_sharepoint = sharepoint_api.fetch_files_list(folder_name=folder_name)
-        file_names = [f["Name"] for f in files_in_sharepoint]
 
-    except Exception as e:
-        logger.info(f"Error when trying to fetch existing files in SharePoint: {e}")
+def _load_existing_serials(form_run: FormQueueRun, sharepoint_api: Sharepoint) -> None:
+    form_config = form_run.form_config
+
+    folder_name = form_config["folder_name"]
+    excel_file_name = form_config["excel_file_name"]
+
+    with metrics.span("workbook_list", form=form_run.os2_webform_id) as span:
+        files_in_sharepoint = sharepoint_rest.list_files(sharepoint_api, folder_name)
+        files_by_name = {f["Name"]: f for f in files_in_sharepoint}
+        span.add(rows=len(files_by_name))
 
-    if excel_file_name in file_names:
+    if excel_file_name in files_by_name:
         form_config["excel_file_exists"] = True
 
-        # If the Excel file exists, we fetch it and load it into a DataFrame, so we can compare serial numbers
-        excel_file = sharepoint_api.fetch_file_using_open_binary(
-            excel_file_name,
-            folder_name
+        # If the Excel file exists, we load its serial numbers from the local index, so we can compare serial numbers.
+        # The workbook is only downloaded when its eTag no longer matches the index
+        with metrics.span("serial_lookup", form=form_run.os2_webform_id) as span:
+            form_run.serial_set = serial_index.load_serials(
+                sharepoint_api,
+                folder_name,
+                excel_file_name,
+                sheet_name=SHEET_NAME,
+                etag=files_by_name[excel_file_name].get("ETag"),
+            )
+            span.add(rows=len(form_run.serial_set))
+        logger.info(f"{form_run.os2_webform_id}: Excel file already exists - {len(form_run.serial_set)} serial numbers found in existing sheet")
+
+        # Only scan incrementally when the workbook exists - a new workbook needs every submission
+        form_run.scan.watermark = load_watermark(form_run.os2_webform_id)
+
+
+def _form_projections(form_runs: list[FormQueueRun]) -> dict[str, list[str]]:
+    return {
+        form_run.os2_webform_id: query_builder.projected_data_keys(
+            form_run.formular_mapping,
+            include_attachments=bool(form_run.form_config.get("upload_pdfs_to_sharepoint_folder_name")),
         )
+        for form_run in form_runs
+    }
 
-        excel_stream = BytesIO(excel_file)
-        excel_file_df = pd.read_excel(io=excel_stream, sheet_name="Besvarelser")
 
-        # Create a set of serial numbers from the Excel file
-        serial_set = set(excel_file_df["Serial number"].tolist())
-        logger.info(f"Excel file already exists - {len(excel_file_df)} rows found in existing sheet")
+def _add_submission(form_run: FormQueueRun, form: dict, row_watermark: dict) -> None:
+    form_run.scan.submission_count += 1
 
-    # Loop through all active submissions and transform them to the correct format
-    logger.info("STEP 3 - Looping submissions and identifying new ones to append")
-    for form in all_submissions:
-        form_serial_number = form["entity"]["serial"][0]["value"]
+    # Submissions are ordered newest first
+    form_run.scan.newest_watermark = form_run.scan.newest_watermark or row_watermark
 
-        # If the form's serial number is already in the Excel file, skip it
-        if form_serial_number in serial_set:
-            continue
+    form_serial_number = form["entity"]["serial"][0]["value"]
 
-        transformed_row = helper_functions.transform_form_submission(
-            form_serial_number,
-            form,
-            formular_mapping
-        )
+    # If the form's serial number is already in the Excel file, skip it
+    if form_serial_number in form_run.serial_set:
+        return
 
-        if upload_pdfs_to_sharepoint_folder_name:
-            form_config["upload_pdfs_to_sharepoint_folder_name"] = upload_pdfs_to_sharepoint_folder_name
-            form_config["file_url"] = form["data"]["attachments"]["besvarelse_i_pdf_format"]["url"]
+    # The last new submission seen is the oldest one
+    form_run.scan.oldest_new_watermark = row_watermark
+
+    # Submissions in an item queued today are not written yet, but must not be queued twice
+    if _is_queued(form_run, form_serial_number):
+        return
 
-        new_submissions.append(transformed_row)
+    upload_pdfs_to_sharepoint_folder_name = form_run.form_config.get("upload_pdfs_to_sharepoint_folder_name", "")
 
-    if len(new_submissions) > 0:
-        logger.info(f"New submissions found: {len(new_submissions)}.")
+    if upload_pdfs_to_sharepoint_folder_name:
+        pdf_url = form["data"].get("attachments", {}).get("besvarelse_i_pdf_format", {}).get("url")
 
-        logger.info("STEP 4 - Appending work_item with new submissions to workqueue")
-        work_item_data = {
-            "reference": f"{os2_webform_id}_{TODAYS_DATE}",
-            "data": {"config": form_config, "submissions": new_submissions},
-        }
+        if pdf_url:
+            form_run.new.pdf_urls[form_serial_number] = pdf_url
+
+    form_run.new.pending_forms.append((form_serial_number, form))
+
+
+def _transform_pending_forms(form_run: FormQueueRun) -> None:
+    if not form_run.new.pending_forms:
+        return
 
-        queue_items.append(work_item_data)
+    with metrics.span("transform", form=form_run.os2_webform_id) as span:
+        compiled_mapping = form_transform.compile_mapping(form_run.formular_mapping)
 
-    else:
-        logger.info("No new submissions found.")
+        form_run.new.rows.extend(form_transform.transform_to_rows(compiled_mapping, form_run.new.pending_forms))
+        span.add(rows=len(form_run.new.pending_forms))
+
+        form_run.new.pending_forms.clear()
+
+
+def _build_queue_items(form_run: FormQueueRun) -> list[dict]:
+    os2_webform_id = form_run.os2_webform_id
+
+    _transform_pending_forms(form_run)
+
+    logger.info(f"{os2_webform_id}: OS2 submissions read - {form_run.scan.submission_count} submissions streamed")
+
+    if form_run.scan.submission_count == 0:
+        logger.info(f"There are no submissions for webform - {os2_webform_id}")
+
+        return []
+
+    # Next scan starts from the oldest submission not yet in the workbook, so items that fail
+    # processing are picked up again - or from the newest submission if everything is written
+    stage_watermark(os2_webform_id, form_run.scan.oldest_new_watermark or form_run.scan.newest_watermark)
+
+    if len(form_run.new.rows) == 0:
+        logger.info(f"{os2_webform_id}: No new submissions found.")
+
+        return []
+
+    logger.info(f"{os2_webform_id}: New submissions found: {len(form_run.new.rows)}.")
+
+    with metrics.span("build_items", form=os2_webform_id) as span:
+        chunks = chunk_submissions(form_run.new.rows)
+
+        columns = form_transform.compile_mapping(form_run.formular_mapping).columns
+
+        queue_items = []
+
+        for chunk_index, chunk in enumerate(chunks):
+            serials = [row["Serial number"] for row in chunk]
+
+            chunk_config = dict(form_run.form_config)
+            chunk_config["chunk"] = {"index": chunk_index, "count": len(chunks)}
+
+            if form_run.new.pdf_urls:
+                chunk_config["pdf_urls"] = {
+                    str(serial): form_run.new.pdf_urls[serial] for serial in serials if serial in form_run.new.pdf_urls
+                }
+
+            # Deterministic reference per form, date and serial range - serial numbers may be text, so they are
+            # compared as numbers, like _is_queued reads the range back
+            queue_items.append({
+                "reference": f"{os2_webform_id}_{TODAYS_DATE}_{min(serials, key=int)}-{max(serials, key=int)}",
+                "data": {"config": chunk_config, "submissions": payload_codec.encode_submissions(chunk, columns)},
+            })
+
+        span.add(rows=len(form_run.new.rows))
+
+    logger.info(f"{os2_webform_id}: Split into {len(queue_items)} work items.")
 
     return queue_items
 
 
-def create_sort_key(item: dict) -> str:
+def chunk_submissions(submissions: list[dict]) -> list[list[dict]]:
     """
-    Create a sort key based on the entire JSON structure.
-    Converts the item to a sorted JSON string for consistent ordering.
+    Split submissions into chunks of at most WORK_ITEM_MAX_SUBMISSIONS submissions
+    and at most WORK_ITEM_MAX_BYTES of serialized JSON (a single larger submission gets a chunk of its own).
     """
-    return json.dumps(item, sort_keys=True, ensure_ascii=False)
 
+    chunks = []
+    chunk = []
+    chunk_bytes = 0
+
+    for row in submissions:
+        row_bytes = len(json.dumps(row, ensure_ascii=False, default=str).encode("utf-8"))
+
+        if chunk and (
+            len(chunk) >= config.WORK_ITEM_MAX_SUBMISSIONS
+            or chunk_bytes + row_bytes > config.WORK_ITEM_MAX_BYTES
+        ):
+            chunks.append(chunk)
+            chunk = []
+            chunk_bytes = 0
 
-async def concurrent_add(workqueue: Workqueue, items: list[dict]) -> None:
+        chunk.append(row)
+        chunk_bytes += row_bytes
+
+    if chunk:
+        chunks.append(chunk)
+
+    return chunks
+
+
+def work_item_day_key(reference: str) -> str:
+    """
+    Return the form and date part of a work item reference, e.g. "sundung_aarhus_2025-01-31"
+    for both "sundung_aarhus_2025-01-31" and the chunked "sundung_aarhus_2025-01-31_100-199".
     """
-    Populate the workqueue with items to be processed.
-    Uses concurrency and retries with exponential backoff.
 
-    Args:
-        workqueue (Workqueue): The workqueue to populate.
-        items (list[dict]): List of items to add to the queue.
-        logger (logging.Logger): Logger for logging messages.
+    match = re.match(r"^(.*_\d{4}-\d{2}-\d{2})(_\d+-\d+)?$", reference)
 
-    Returns:
-        None
+    return match.group(1) if match else reference
 
-    Raises:
-        Exception: If adding an item fails after all retries.
+
+def queued_serial_ranges(queue_references: set[str], os2_webform_id: str) -> list[tuple[float, float]]:
+    """
+    Return the serial number ranges of the form's work items queued today, e.g. (100, 199) for the chunked
+    "sundung_aarhus_2025-01-31_100-199". An unchunked reference covers every serial number.
     """
-    sem = asyncio.Semaphore(config.MAX_CONCURRENCY)
 
-    async def add_one(it: dict):
-        reference = str(it.get("reference") or "")
-        data = {"item": it}
+    day_key = f"{os2_webform_id}_{TODAYS_DATE}"
+    ranges = []
+
+    for reference in queue_references:
+        if work_item_day_key(reference) != day_key:
+            continue
 
-        async with sem:
-            for attempt in range(1, config.MAX_RETRIES + 1):
-                try:
-                    await asyncio.to_thread(workqueue.add_item, data, reference)
-                    logger.info(f"Added item to queue with reference: {reference}")
-                    return True
+        match = re.search(r"_(\d+)-(\d+)$", reference.removeprefix(day_key))
 
-                except Exception as e:
-                    if attempt >= config.MAX_RETRIES:
-                        logger.error(
-                            f"Failed to add item {reference} after {attempt} attempts: {e}"
-                        )
-                        return False
+        ranges.append((int(match.group(1)), int(match.group(2))) if match else (-math.inf, math.inf))
 
-                    backoff = config.RETRY_BASE_DELAY * (2 ** (attempt - 1))
+    return ranges
 
-                    logger.warning(
-                        f"Error adding {reference} (attempt {attempt}/{config.MAX_RETRIES}). "
-                        f"Retrying in {backoff:.2f}s... {e}"
-                    )
-                    await asyncio.sleep(backoff)
 
+def unwritten_serial_floor(queue_references: set[str], os2_webform_id: str, serial_set: set) -> float:
+    """
+    Return the lowest serial number of the form's queued work items that are not in the workbook yet, e.g. a chunk
+    that failed or is still pending, or math.inf if every one of them is written.
+
+    A chunk counts as written once the first and last serial number of its reference are in the workbook. An unchunked
+    reference does not tell which serial numbers it carries, so it gives -math.inf and reading never stops early.
+    """
+
+    floor = math.inf
+
+    for reference in queue_references:
+        match = _WORK_ITEM_REFERENCE.match(reference)
+
+        if not match or match["form"] != os2_webform_id:
+            continue
+
+        if match["low"] is None:
+            return -math.inf
+
+        low, high = int(match["low"]), int(match["high"])
+
+        if not (_is_known_serial(low, serial_set) and _is_known_serial(high, serial_set)):
+            floor = min(floor, low)
+
+    return floor
+
+
+def _is_known_serial(serial: int, serial_set: set) -> bool:
+    # The workbook may hold a serial number as text
+    return serial in serial_set or str(serial) in serial_set
+
+
+def _is_queued(form_run: FormQueueRun, form_serial_number) -> bool:
+    if not form_run.queued_serial_ranges:
+        return False
+
+    try:
+        serial = int(form_serial_number)
+
+    except (TypeError, ValueError):
+        return False
+
+    return any(low <= serial <= high for low, high in form_run.queued_serial_ranges)
+
+
+def create_sort_key(item: dict) -> str:
+    """
+    Create a sort key based on the item reference.
+    References are unique per form, date and serial range, so the ordering is stable without serializing the item.
+    """
+    return str(item.get("reference") or "")
+
+
+async def concurrent_add(workqueue: Workqueue, items: list[dict]) -> int:
+    """
+    Populate the workqueue with items to be processed.
+    Uses an async client with pooled connections, bulk requests if configured, and retries with exponential backoff.
+
+    Args:
+        workqueue (Workqueue): The workqueue to populate.
+        items (list[dict]): List of items to add to the queue.
+
+    Returns:
+        int: The number of items that could not be added.
+    """
     if not items:
         logger.info("No new items to add.")
-        return
+        return 0
 
     sorted_items = sorted(items, key=create_sort_key)
     logger.info(
-        f"Processing {len(sorted_items)} items sorted by complete JSON structure"
+        f"Processing {len(sorted_items)} items sorted by reference"
     )
 
-    results = await asyncio.gather(*(add_one(i) for i in sorted_items))
+    results = await ats_client.add_items(os.getenv("ATS_URL"), os.getenv("ATS_TOKEN"), workqueue.id, sorted_items)
     successes = sum(1 for r in results if r)
     failures = len(results) - successes
 
     logger.info(
         f"Summary: {successes} succeeded, {failures} failed out of {len(results)}"
     )
+
+    return failures
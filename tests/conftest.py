@@ -0,0 +1,56 @@
+"""Shared fixtures for the tests"""
+
+import json
+import sqlite3
+
+from contextlib import closing
+from datetime import datetime, timedelta
+
+import pytest
+
+from helpers import config
+
+
+@pytest.fixture
+def state_dir(tmp_path, monkeypatch):
+    """Keep the local state of a test in a temporary directory."""
+
+    monkeypatch.setattr(config, "STATE_DIR", str(tmp_path))
+    monkeypatch.setattr(config, "WATERMARK_FILE", str(tmp_path / "watermarks.json"))
+
+    return tmp_path
+
+
+@pytest.fixture
+def journalizing_db(tmp_path):
+    """Return a function writing a SQLite stand-in for the journalizing view, returning its SQLAlchemy URL."""
+
+    def write(form_type: str, serials: list[int], purged: dict[int, object] | None = None) -> str:
+        path = tmp_path / f"{form_type}.db"
+
+        with closing(sqlite3.connect(path)) as conn, conn:
+            conn.execute(
+                "CREATE TABLE view_Journalizing "
+                "(form_id INTEGER PRIMARY KEY, form_type TEXT, form_data TEXT, form_submitted_date TEXT)"
+            )
+
+            for serial in serials:
+                form_data = {"data": {"navn": f"Svar {serial}"}, "entity": {"serial": [{"value": serial}]}}
+
+                if purged and serial in purged:
+                    form_data["purged"] = purged[serial]
+
+                conn.execute(
+                    "INSERT INTO view_Journalizing VALUES (?, ?, ?, ?)",
+                    (serial, form_type, json.dumps(form_data), submitted_date(serial).isoformat(sep=" ")),
+                )
+
+        return f"sqlite:///{path}"
+
+    return write
+
+
+def submitted_date(serial: int) -> datetime:
+    """The submitted date of a submission in the journalizing_db stand-in, one hour per serial number."""
+
+    return datetime(2025, 1, 1) + timedelta(hours=serial)
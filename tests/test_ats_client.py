@@ -0,0 +1,129 @@
+"""Tests for adding work items with the async ATS client, against the local Automation Server"""
+
+import asyncio
+import json
+
+import httpx
+import pytest
+
+from benchmarks import fault_injection
+from benchmarks.local_ats_server import WORKQUEUE_ID, LocalAtsServer
+from helpers import ats_client, config
+
+ADD_ENDPOINT = "POST /workqueues/{id}/add"
+
+
+class ThrottledFirst(fault_injection.Faults):
+    """Throttles the first calls, then lets every call through"""
+
+    def __init__(self, throttled_calls: int):
+        super().__init__(retry_after_seconds=0.01)
+
+        self.throttled_calls = throttled_calls
+
+    def inject(self) -> str | None:
+        if self.throttled_calls > 0:
+            self.throttled_calls -= 1
+
+            return fault_injection.THROTTLE
+
+        return None
+
+
+@pytest.fixture(autouse=True)
+def fast_retries(monkeypatch):
+    monkeypatch.setattr(config, "RETRY_BASE_DELAY", 0.01)
+    monkeypatch.setattr(config, "ATS_REQUEST_MAX_RETRIES", 3)
+    monkeypatch.setattr(config, "ATS_BULK_ENQUEUE_PATH", None)
+
+
+@pytest.fixture
+def start_server():
+    servers = []
+
+    def start(faults: fault_injection.Faults | None = None) -> LocalAtsServer:
+        servers.append(LocalAtsServer(faults).start())
+
+        return servers[-1]
+
+    yield start
+
+    for server in servers:
+        server.stop()
+
+
+def _add(server_url: str, items: list[dict]) -> list[bool]:
+    return asyncio.run(ats_client.add_items(server_url, "token", WORKQUEUE_ID, items))
+
+
+def test_payload_matches_workqueue_add_item(monkeypatch):
+    # Workqueue.add_item(data, reference) posts {"data": json.dumps(data), "reference": reference}
+    sent = []
+
+    async def post(self, path, json=None, **kwargs):  # pylint: disable=redefined-outer-name,unused-argument
+        sent.append((path, json))
+
+        return httpx.Response(200, json={}, request=httpx.Request("POST", f"http://ats{path}"))
+
+    monkeypatch.setattr(httpx.AsyncClient, "post", post)
+
+    item = {"reference": "form_2025-01-31_1-2", "data": {"config": {"site_name": "Sø"}, "submissions": [{"Serial number": 1}]}}
+
+    assert _add("http://ats", [item]) == [True]
+    assert sent == [(
+        f"/workqueues/{WORKQUEUE_ID}/add",
+        {"reference": "form_2025-01-31_1-2", "data": sent[0][1]["data"]},
+    )]
+    assert json.loads(sent[0][1]["data"]) == {"item": item}
+
+
+def test_added_items_read_back_like_add_item_items(start_server):
+    server = start_server()
+    item = {"reference": "form_2025-01-31_1-2", "data": {"config": {"site_name": "Sø"}, "submissions": []}}
+
+    assert _add(server.url, [item]) == [True]
+
+    stored = next(iter(server.items.values()))
+
+    # ats_functions.get_item_info reads item.data["item"]["data"] and item.data["item"]["reference"]
+    assert stored["reference"] == "form_2025-01-31_1-2"
+    assert stored["data"] == {"item": item}
+
+
+def test_rate_limited_requests_are_retried(start_server):
+    server = start_server(ThrottledFirst(throttled_calls=2))
+
+    assert _add(server.url, [{"reference": "a", "data": {}}]) == [True]
+    assert server.stats[f"{ADD_ENDPOINT} 429"] == 2
+    assert server.stats[f"{ADD_ENDPOINT} 200"] == 1
+
+
+def test_server_errors_are_retried_up_to_the_limit(start_server):
+    server = start_server(fault_injection.Faults(failure_rate=1.0))
+
+    assert _add(server.url, [{"reference": "a", "data": {}}]) == [False]
+    assert server.stats[f"{ADD_ENDPOINT} 500"] == config.ATS_REQUEST_MAX_RETRIES + 1
+
+
+def test_client_errors_are_not_retried(start_server, monkeypatch):
+    monkeypatch.setattr(config, "ATS_ADD_ITEM_PATH", "/workqueues/{workqueue_id}/missing")
+    server = start_server()
+
+    assert _add(server.url, [{"reference": "a", "data": {}}]) == [False]
+    assert sum(server.stats.values()) == 1
+
+
+def test_transport_errors_are_retried(start_server, monkeypatch):
+    backoffs = []
+
+    async def sleep(seconds):
+        backoffs.append(seconds)
+
+    monkeypatch.setattr(ats_client.asyncio, "sleep", sleep)
+
+    server = start_server()
+    url = server.url
+    server.stop()
+
+    assert _add(url, [{"reference": "a", "data": {}}]) == [False]
+    assert len(backoffs) == config.ATS_REQUEST_MAX_RETRIES
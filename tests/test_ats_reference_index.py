@@ -0,0 +1,116 @@
+"""Tests for the incremental index of workqueue references, against the local Automation Server"""
+
+import logging
+
+import pytest
+
+from benchmarks.local_ats_server import WORKQUEUE_ID, LocalAtsServer
+from helpers import ats_reference_index, config
+
+ITEMS_ENDPOINT = "GET /workqueues/{id}/items 200"
+
+
+@pytest.fixture(autouse=True)
+def small_pages(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "ATS_PAGE_SIZE", 10)
+    monkeypatch.setattr(config, "ATS_PAGES_IN_FLIGHT", 2)
+    monkeypatch.setattr(config, "ATS_REFERENCE_INDEX_DIR", str(tmp_path))
+
+
+@pytest.fixture
+def start_server():
+    """Return a function starting a local Automation Server, paging newest or oldest first."""
+
+    servers = []
+
+    def start(newest_first: bool) -> LocalAtsServer:
+        servers.append(LocalAtsServer(newest_first=newest_first).start())
+
+        return servers[-1]
+
+    yield start
+
+    for server in servers:
+        server.stop()
+
+
+@pytest.fixture(params=[False, True], ids=["oldest first", "newest first"])
+def server(request, start_server):
+    return start_server(newest_first=request.param)
+
+
+def _add_items(server: LocalAtsServer, start: int, count: int) -> None:
+    for number in range(start, start + count):
+        server.add_item(WORKQUEUE_ID, f"reference_{number}", "{}")
+
+
+def _references(server: LocalAtsServer) -> set[str]:
+    server.stats.clear()
+
+    return ats_reference_index.get_references(server.url, "token", WORKQUEUE_ID)
+
+
+def test_all_references_are_read_in_either_order(server):
+    _add_items(server, 1, 35)
+
+    assert _references(server) == {f"reference_{number}" for number in range(1, 36)}
+
+
+def test_new_items_are_found_on_the_next_run_in_either_order(server):
+    _add_items(server, 1, 35)
+    _references(server)
+
+    _add_items(server, 36, 12)
+
+    assert _references(server) == {f"reference_{number}" for number in range(1, 48)}
+
+
+def test_oldest_first_resumes_from_the_last_complete_page(start_server, caplog):
+    server = start_server(newest_first=False)
+
+    _add_items(server, 1, 35)
+    _references(server)
+    _add_items(server, 36, 12)
+
+    with caplog.at_level(logging.WARNING):
+        _references(server)
+
+    # The anchor page 3, then pages 4 and 5 with the new items, and the empty page 6 fetched alongside page 5
+    assert 0 < server.stats[ITEMS_ENDPOINT] <= 4
+    assert not caplog.records
+
+
+def test_newest_first_warns_and_reads_every_page(start_server, caplog):
+    server = start_server(newest_first=True)
+
+    _add_items(server, 1, 35)
+    _references(server)
+    _add_items(server, 36, 1)
+
+    with caplog.at_level(logging.WARNING):
+        _references(server)
+
+    assert "ordered newest first" in caplog.text
+    assert server.stats[ITEMS_ENDPOINT] >= 5
+
+
+def test_deleted_items_move_the_anchor(start_server, caplog):
+    server = start_server(newest_first=False)
+
+    _add_items(server, 1, 35)
+    _references(server)
+    server.remove_item(1)
+
+    with caplog.at_level(logging.WARNING):
+        references = _references(server)
+
+    assert "items were deleted or reordered" in caplog.text
+    assert references == {f"reference_{number}" for number in range(2, 36)}
+
+
+def test_index_is_written_without_leaving_temp_files(server, tmp_path):
+    _add_items(server, 1, 35)
+    _references(server)
+    _references(server)
+
+    assert [path.suffix for path in tmp_path.rglob("*") if path.is_file()] == [".json"]
@@ -0,0 +1,105 @@
+"""Tests for the error mail digests"""
+
+import os
+import subprocess
+import sys
+import time
+
+import pytest
+
+from benchmarks.local_smtp_server import LocalSmtpServer
+from helpers import config, error_notifications
+from helpers.import_profile import REPO_DIR
+
+
+@pytest.fixture
+def smtp_server(monkeypatch):
+    server = LocalSmtpServer().start()
+
+    monkeypatch.setattr(config, "MAIL_BACKEND", "local")
+    monkeypatch.setattr(config, "LOCAL_SMTP_ADDRESS", server.address)
+
+    yield server
+
+    server.stop()
+
+
+def _error(message: str, error_type: str = "ValueError") -> dict:
+    return {"type": error_type, "message": message, "traceback": "Traceback (most recent call last): ..."}
+
+
+def _wait_for_messages(server: LocalSmtpServer, count: int, timeout: float = 5.0) -> list:
+    deadline = time.monotonic() + timeout
+
+    while len(server.messages) < count and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+    return list(server.messages)
+
+
+def test_one_deduplicated_digest_per_window(smtp_server):
+    notifier = error_notifications.ErrorNotifier(window_seconds=0.3)
+
+    for _ in range(20):
+        notifier.notify(_error("Workbook is locked"), "Formulardata", None)
+
+    for _ in range(5):
+        notifier.notify(_error("Timed out", "TimeoutError"), "Formulardata", None)
+
+    messages = _wait_for_messages(smtp_server, 1)
+    time.sleep(0.5)
+
+    assert len(smtp_server.messages) == 1
+    assert messages[0]["subject"] == "Error digest: Formulardata - 25 errors, 2 distinct"
+
+    html = messages[0].get_body(("html",)).get_content()
+    assert "20 x ValueError" in html and "5 x TimeoutError" in html
+
+    # Errors after the first digest go in a digest of their own, over the same connection
+    notifier.notify(_error("Workbook is locked"), "Formulardata", None)
+
+    messages = _wait_for_messages(smtp_server, 2)
+    notifier.close(timeout=5)
+
+    assert len(messages) == 2
+    assert messages[1]["subject"] == "Error digest: Formulardata - 1 errors, 1 distinct"
+    assert smtp_server.stats["connections"] == 1
+
+
+def test_close_sends_the_pending_digest(smtp_server):
+    notifier = error_notifications.ErrorNotifier(window_seconds=None)
+
+    notifier.notify(_error("Workbook is locked"), "Formulardata", None)
+    notifier.close(timeout=5)
+
+    assert len(smtp_server.messages) == 1
+    assert notifier.digests_sent == 1
+
+
+def test_quiet_run_sends_nothing(smtp_server):
+    notifier = error_notifications.ErrorNotifier(window_seconds=0.1)
+    notifier.close(timeout=5)
+
+    assert not smtp_server.messages
+    assert smtp_server.stats["connections"] == 0
+
+
+def test_pending_digest_is_sent_at_exit(smtp_server):
+    # The window is far longer than the run, so only the exit handler sends the digest
+    code = (
+        "from helpers import error_notifications\n"
+        "for _ in range(3):\n"
+        "    error_notifications.notify({'type': 'ValueError', 'message': 'boom', 'traceback': ''}, 'Formulardata')\n"
+    )
+    env = {
+        **os.environ,
+        "FORMULARDATA_MAIL_BACKEND": "local",
+        "FORMULARDATA_LOCAL_SMTP_ADDRESS": smtp_server.address,
+    }
+
+    subprocess.run([sys.executable, "-c", code], cwd=REPO_DIR, env=env, check=True, timeout=60)
+
+    messages = _wait_for_messages(smtp_server, 1)
+
+    assert len(messages) == 1
+    assert messages[0]["subject"] == "Error digest: Formulardata - 3 errors, 1 distinct"
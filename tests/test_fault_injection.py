@@ -0,0 +1,19 @@
+"""Tests for reading the faults of the local backends from the environment"""
+
+import pytest
+
+from benchmarks import fault_injection
+
+
+def test_faults_are_read_per_backend(monkeypatch):
+    monkeypatch.setenv(fault_injection.FAULTS_ENV, '{"sqlite": {"failure_rate": 0.5}}')
+
+    assert fault_injection.for_backend("sqlite") == fault_injection.Faults(failure_rate=0.5)
+    assert fault_injection.for_backend("sharepoint") == fault_injection.Faults()
+
+
+@pytest.mark.parametrize("faults", ["not json", "[]", '{"sqlite": {"unknown": 1}}', '{"sqlite": 1}'])
+def test_invalid_faults_are_ignored(monkeypatch, faults):
+    monkeypatch.setenv(fault_injection.FAULTS_ENV, faults)
+
+    assert fault_injection.for_backend("sqlite") == fault_injection.Faults()
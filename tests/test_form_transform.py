@@ -0,0 +1,43 @@
+"""Tests for the compiled, batched transform"""
+
+from helpers import form_transform, helper_functions
+
+
+def test_two_mappings_compiled_one_after_the_other():
+    # The first mapping is garbage collected before the second is created, so both may get the same id
+    first = form_transform.compile_mapping({"spoergsmaal_1": "Spørgsmål 1"}).columns
+    second = form_transform.compile_mapping({"spoergsmaal_2": "Spørgsmål 2"}).columns
+
+    assert first == ("Spørgsmål 1", "Serial number", "Oprettet", "Gennemført")
+    assert second == ("Spørgsmål 2", "Serial number", "Oprettet", "Gennemført")
+
+
+def test_cached_entry_of_another_mapping_is_not_returned(monkeypatch):
+    stale = {"gammelt_spoergsmaal": "Gammelt spørgsmål"}
+    mapping = {"nyt_spoergsmaal": "Nyt spørgsmål"}
+
+    # As if mapping had reused the id of a collected mapping
+    monkeypatch.setitem(
+        form_transform._COMPILED_MAPPINGS,  # pylint: disable=protected-access
+        id(mapping),
+        (stale, form_transform.compile_mapping(stale)),
+    )
+
+    assert form_transform.compile_mapping(mapping).columns[0] == "Nyt spørgsmål"
+
+
+def test_transform_matches_transform_form_submission():
+    mapping = {"navn": "Navn", "tabel": {"raekke_1": "Række 1", "raekke_2": "Række 2"}, "valg": "Valg"}
+    form = {
+        "data": {"navn": "Svar\nmed linjer", "tabel": {"raekke_1": "['Skole', 'SFO']"}, "valg": ["Ja", "Nej"]},
+        "entity": {
+            "created": [{"value": "2025-01-31T08:00:00+01:00"}],
+            "completed": [{"value": "2025-01-31T08:10:00+01:00"}],
+        },
+    }
+
+    compiled = form_transform.compile_mapping(mapping)
+
+    assert form_transform.transform_to_rows(compiled, [(7, form)]) == [
+        helper_functions.transform_form_submission(7, form, mapping)
+    ]
@@ -0,0 +1,193 @@
+"""Tests for the formats work item submissions are stored in"""
+
+import base64
+import json
+import zlib
+
+import pytest
+
+from helpers import config, payload_codec
+
+ROWS = [{"Serial number": serial, "Navn": f"Svar {serial}", "Status": "Modtaget"} for serial in range(1, 7)]
+
+
+class FakeZstd:
+    """Stand-in for the zstandard module, whose compress takes the level positionally"""
+
+    @staticmethod
+    def compress(data, level=3, /):
+        return zlib.compress(data, level)
+
+    @staticmethod
+    def decompress(data):
+        return zlib.decompress(data)
+
+
+@pytest.fixture(autouse=True)
+def plain_rows(monkeypatch):
+    monkeypatch.setattr(config, "WORK_ITEM_FORMAT", "rows")
+    monkeypatch.setattr(config, "WORK_ITEM_COMPRESSION", None)
+
+
+def test_uncompressed_rows_are_stored_as_is():
+    assert payload_codec.encode_submissions(ROWS) is ROWS
+    assert payload_codec.decode_submissions(ROWS) is ROWS
+
+
+def test_gzip_envelope_round_trip(monkeypatch):
+    monkeypatch.setattr(config, "WORK_ITEM_COMPRESSION", "gzip")
+
+    envelope = payload_codec.encode_submissions(ROWS)
+
+    assert envelope["version"] == payload_codec.ENVELOPE_VERSION and envelope["encoding"] == "gzip"
+    assert payload_codec.encode_submissions(ROWS) == envelope
+    assert payload_codec.decode_submissions(envelope) == ROWS
+
+
+def test_zstd_envelope_round_trip(monkeypatch):
+    monkeypatch.setattr(config, "WORK_ITEM_COMPRESSION", "zstd")
+    monkeypatch.setattr(payload_codec, "_zstd", FakeZstd)
+
+    envelope = payload_codec.encode_submissions(ROWS)
+
+    assert envelope["encoding"] == "zstd"
+    assert payload_codec.decode_submissions(envelope) == ROWS
+
+
+def test_zstd_falls_back_to_gzip_when_unavailable(monkeypatch):
+    monkeypatch.setattr(config, "WORK_ITEM_COMPRESSION", "zstd")
+    monkeypatch.setattr(payload_codec, "_zstd", None)
+
+    envelope = payload_codec.encode_submissions(ROWS)
+
+    assert envelope["encoding"] == "gzip"
+    assert payload_codec.decode_submissions(envelope) == ROWS
+
+
+def test_zstd_item_cannot_be_read_without_zstd(monkeypatch):
+    monkeypatch.setattr(config, "WORK_ITEM_COMPRESSION", "zstd")
+    monkeypatch.setattr(payload_codec, "_zstd", FakeZstd)
+    envelope = payload_codec.encode_submissions(ROWS)
+
+    monkeypatch.setattr(payload_codec, "_zstd", None)
+
+    with pytest.raises(ValueError, match="zstd is not available"):
+        payload_codec.decode_submissions(envelope)
+
+
+def test_newer_envelope_version_is_rejected(monkeypatch):
+    monkeypatch.setattr(config, "WORK_ITEM_COMPRESSION", "gzip")
+    envelope = payload_codec.encode_submissions(ROWS)
+
+    with pytest.raises(ValueError, match="version 2 is not supported"):
+        payload_codec.decode_submissions({**envelope, "version": 2})
+
+
+def test_unknown_encoding_is_rejected(monkeypatch):
+    envelope = {"version": 1, "encoding": "brotli", "data": base64.b64encode(b"{}").decode("ascii")}
+
+    with pytest.raises(ValueError, match="Unknown work item compression 'brotli'"):
+        payload_codec.decode_submissions(envelope)
+
+    monkeypatch.setattr(config, "WORK_ITEM_COMPRESSION", "brotli")
+
+    with pytest.raises(ValueError, match="Unknown work item compression 'brotli'"):
+        payload_codec.encode_submissions(ROWS)
+
+
+def test_legacy_items_without_an_envelope_are_read_as_is(monkeypatch):
+    monkeypatch.setattr(config, "WORK_ITEM_COMPRESSION", "gzip")
+
+    assert payload_codec.decode_submissions(ROWS) == ROWS
+    assert payload_codec.decode_submissions([]) == []
+
+
+def _round_trip(submissions, columns=None):
+    # Work item data is stored as JSON
+    stored = json.dumps(payload_codec.encode_submissions(submissions, columns))
+
+    return payload_codec.decode_submissions(json.loads(stored))
+
+
+@pytest.fixture
+def columnar(monkeypatch):
+    monkeypatch.setattr(config, "WORK_ITEM_FORMAT", "columns")
+
+
+@pytest.mark.usefixtures("columnar")
+def test_repeated_values_are_dictionary_encoded():
+    table = payload_codec.encode_submissions(ROWS, list(ROWS[0]))
+
+    status, serials = table["arrays"][2], table["arrays"][0]
+
+    assert status == {"dictionary": ["Modtaget"], "codes": [0] * 6}
+    assert serials == list(range(1, 7))
+    assert payload_codec.submission_rows(_round_trip(ROWS, list(ROWS[0]))) == ROWS
+
+
+@pytest.mark.usefixtures("columnar")
+def test_mixed_numbers_and_booleans_keep_their_type():
+    rows = [{"Serial number": serial, "Svar": value} for serial, value in enumerate([1, 1.0, True, 1, 1.0, True, 1, 1])]
+
+    table = _round_trip(rows, ["Serial number", "Svar"])
+    values = payload_codec.submission_columns(table, ["Svar"])["Svar"]
+
+    assert table["arrays"][1]["dictionary"] == [1, 1.0, True]
+    assert [type(value) for value in values] == [int, float, bool, int, float, bool, int, int]
+
+
+@pytest.mark.usefixtures("columnar")
+def test_nested_values_are_stored_plainly():
+    rows = [{"Serial number": serial, "Bilag": [{"navn": "bilag.pdf"}]} for serial in range(1, 5)]
+
+    table = _round_trip(rows, ["Serial number", "Bilag"])
+
+    assert table["arrays"][1] == [[{"navn": "bilag.pdf"}]] * 4
+    assert payload_codec.submission_rows(table) == rows
+
+
+@pytest.mark.usefixtures("columnar")
+def test_zero_rows_round_trip():
+    table = _round_trip([], ["Serial number", "Navn"])
+
+    assert table["row_count"] == 0
+    assert not payload_codec.submission_rows(table)
+    assert payload_codec.submission_columns(table, ["Navn", "Ukendt"]) == {"Navn": [], "Ukendt": []}
+
+
+@pytest.mark.usefixtures("columnar")
+def test_rows_with_other_columns_fall_back_to_the_row_format():
+    rows = [*ROWS, {"Serial number": 7, "Navn": "Svar 7"}]
+
+    assert payload_codec.encode_submissions(rows, list(ROWS[0])) is rows
+    assert payload_codec.encode_submissions(ROWS, ["Serial number", "Status", "Navn"]) is ROWS
+
+
+@pytest.mark.usefixtures("columnar")
+def test_compressed_table_round_trip(monkeypatch):
+    monkeypatch.setattr(config, "WORK_ITEM_COMPRESSION", "gzip")
+
+    table = _round_trip(ROWS, list(ROWS[0]))
+
+    assert payload_codec.is_table(table)
+    assert payload_codec.submission_rows(table) == ROWS
+
+
+@pytest.mark.usefixtures("columnar")
+def test_legacy_row_items_stay_readable():
+    submissions = _round_trip(ROWS)
+
+    assert submissions == ROWS
+    assert payload_codec.submission_rows(submissions) == ROWS
+    assert payload_codec.submission_columns(submissions, ["Navn", "Ukendt"]) == {
+        "Navn": [row["Navn"] for row in ROWS],
+        "Ukendt": [None] * len(ROWS),
+    }
+
+
+@pytest.mark.usefixtures("columnar")
+def test_newer_table_version_is_rejected():
+    table = payload_codec.encode_submissions(ROWS, list(ROWS[0]))
+
+    with pytest.raises(ValueError, match="table version 2 is not supported"):
+        payload_codec.submission_rows({**table, "version": 2})
@@ -0,0 +1,163 @@
+"""Tests for transferring the PDFs of a work item from OS2Forms to SharePoint"""
+
+import threading
+
+from contextlib import contextmanager
+from io import BytesIO
+
+import pytest
+import requests
+
+from mbu_rpa_core.exceptions import ProcessError
+
+from helpers import config, helper_functions, sharepoint_pool, sharepoint_rest
+from processes import process_item
+
+SHAREPOINT_KWARGS = {"tenant": "tenant", "client_id": "app", "thumbprint": "", "cert_path": ""}
+
+PDF_URLS = {str(serial): f"https://os2forms/files/besvarelse_{serial}.pdf" for serial in range(1, 6)}
+
+
+class FakeSharepoint:
+    """Stand-in for a pooled client, recording the files uploaded with it"""
+
+    site_url = "https://sharepoint"
+    site_name = "site"
+    document_library = "Dokumenter"
+
+    def __init__(self):
+        self.uploaded = []
+
+
+class FakePool:
+    """Stand-in for helpers.sharepoint_pool, handing each checkout a new client"""
+
+    def __init__(self):
+        self.clients = []
+        self.leased = set()
+        self.lock = threading.Lock()
+
+    def checkout_client(self, sharepoint_kwargs, site_url, site_name, document_library):
+        client = FakeSharepoint()
+
+        with self.lock:
+            self.clients.append(client)
+            self.leased.add(client)
+
+        return client
+
+    def return_client(self, client):
+        with self.lock:
+            self.leased.remove(client)
+
+
+@contextmanager
+def _open_file_stream(url, os2_api_key):
+    yield BytesIO(url.encode())
+
+
+def _upload_file(sharepoint_api, folder_name, file_name, stream):
+    sharepoint_api.uploaded.append(file_name)
+
+
+@pytest.fixture(autouse=True)
+def fake_transfers(monkeypatch):
+    pool = FakePool()
+
+    monkeypatch.setattr(sharepoint_pool, "checkout_client", pool.checkout_client)
+    monkeypatch.setattr(sharepoint_pool, "return_client", pool.return_client)
+    monkeypatch.setattr(sharepoint_rest, "list_files", lambda sharepoint_api, folder_name: [])
+    monkeypatch.setattr(sharepoint_rest, "upload_file", _upload_file)
+    monkeypatch.setattr(helper_functions, "open_file_stream", _open_file_stream)
+    monkeypatch.setattr(config, "RETRY_BASE_DELAY", 0)
+
+    return pool
+
+
+def test_each_transfer_leases_its_own_client(fake_transfers):
+    caller_client = FakeSharepoint()
+
+    summary = helper_functions.upload_pdfs_to_sharepoint(caller_client, "PDF", "key", PDF_URLS, SHAREPOINT_KWARGS)
+
+    assert sorted(summary["uploaded"]) == sorted(f"besvarelse_{serial}.pdf" for serial in range(1, 6))
+    assert not caller_client.uploaded
+    assert [len(client.uploaded) for client in fake_transfers.clients] == [1] * 5
+    assert not fake_transfers.leased
+
+
+def test_transfers_run_on_the_given_client_without_kwargs(fake_transfers):
+    caller_client = FakeSharepoint()
+
+    summary = helper_functions.upload_pdf_to_sharepoint(caller_client, "PDF", "key", PDF_URLS["1"])
+
+    assert summary["uploaded"] == caller_client.uploaded == ["besvarelse_1.pdf"]
+    assert not fake_transfers.clients
+
+
+def test_existing_pdfs_are_skipped(monkeypatch):
+    monkeypatch.setattr(sharepoint_rest, "list_files", lambda sharepoint_api, folder_name: [{"Name": "besvarelse_1.pdf"}])
+
+    summary = helper_functions.upload_pdfs_to_sharepoint(FakeSharepoint(), "PDF", "key", PDF_URLS, SHAREPOINT_KWARGS)
+
+    assert summary["skipped"] == ["besvarelse_1.pdf"]
+    assert len(summary["uploaded"]) == 4
+
+
+def test_network_errors_are_retried(monkeypatch):
+    attempts = []
+
+    def upload_file(sharepoint_api, folder_name, file_name, stream):
+        attempts.append(file_name)
+
+        if len(attempts) == 1:
+            raise requests.ConnectionError("connection reset")
+
+    monkeypatch.setattr(sharepoint_rest, "upload_file", upload_file)
+
+    summary = helper_functions.upload_pdf_to_sharepoint(FakeSharepoint(), "PDF", "key", PDF_URLS["1"])
+
+    assert summary["uploaded"] == ["besvarelse_1.pdf"]
+    assert len(attempts) == 2
+
+
+def test_other_errors_fail_the_transfer_without_retrying(monkeypatch):
+    attempts = []
+
+    def upload_file(sharepoint_api, folder_name, file_name, stream):
+        attempts.append(file_name)
+
+        if file_name == "besvarelse_3.pdf":
+            raise ValueError("unexpected response")
+
+    monkeypatch.setattr(sharepoint_rest, "upload_file", upload_file)
+
+    summary = helper_functions.upload_pdfs_to_sharepoint(FakeSharepoint(), "PDF", "key", PDF_URLS, SHAREPOINT_KWARGS)
+
+    assert summary["failed"] == {"besvarelse_3.pdf": "ValueError: unexpected response"}
+    assert len(summary["uploaded"]) == 4
+    assert attempts.count("besvarelse_3.pdf") == 1
+
+
+def test_failed_checkout_lands_in_the_summary(monkeypatch):
+    def checkout_client(*args, **kwargs):
+        raise ConnectionError("SharePoint is unavailable")
+
+    monkeypatch.setattr(sharepoint_pool, "checkout_client", checkout_client)
+
+    summary = helper_functions.upload_pdfs_to_sharepoint(FakeSharepoint(), "PDF", "key", PDF_URLS, SHAREPOINT_KWARGS)
+
+    assert sorted(summary["failed"]) == sorted(f"besvarelse_{serial}.pdf" for serial in range(1, 6))
+
+
+def test_failed_pdf_fails_the_item(monkeypatch):
+    def upload_file(sharepoint_api, folder_name, file_name, stream):
+        raise ValueError("unexpected response")
+
+    monkeypatch.setattr(sharepoint_rest, "upload_file", upload_file)
+    monkeypatch.setattr(process_item.secrets_provider, "get_credential", lambda name: {"decrypted_password": "key"})
+
+    workbook = process_item.TargetWorkbook(FakeSharepoint(), "Besvarelser", "form.xlsx", "form")
+    item_config = {"upload_pdfs_to_sharepoint_folder_name": "PDF", "pdf_urls": PDF_URLS}
+
+    with pytest.raises(ProcessError, match="Failed to upload 5 PDFs"):
+        process_item._upload_pdfs(workbook, item_config, SHAREPOINT_KWARGS)  # pylint: disable=protected-access
@@ -0,0 +1,24 @@
+"""Tests for the queries against the journalizing view"""
+
+import pytest
+
+from helpers import helper_functions, query_builder
+
+
+def test_mssql_purged_filter_checks_for_the_key():
+    query, _ = query_builder.build_forms_query(query_builder.MSSQL, {"form": None}, {"form": ["navn"]})
+
+    assert "NOT EXISTS (SELECT 1 FROM OPENJSON(form_data) WHERE [key] = 'purged')" in query
+    assert "JSON_VALUE(form_data, '$.purged')" not in query
+
+
+@pytest.mark.parametrize("data_keys", [None, ["navn"]], ids=["whole document", "projected"])
+def test_purged_entries_are_skipped_whatever_their_value(journalizing_db, data_keys):
+    conn_string = journalizing_db("form", [1, 2, 3, 4], purged={2: None, 3: True})
+
+    serials = [
+        parsed["entity"]["serial"][0]["value"]
+        for parsed, _ in helper_functions.iter_forms_data(conn_string=conn_string, form_type="form", data_keys=data_keys)
+    ]
+
+    assert serials == [4, 1]
@@ -0,0 +1,140 @@
+"""Tests for splitting new submissions into bounded work items"""
+
+import math
+
+import pytest
+
+from helpers import config, payload_codec
+from helpers.config import WEBFORMS_CONFIG
+from processes import queue_handler
+
+FORM_ID = next(iter(WEBFORMS_CONFIG))
+
+
+def _form(serial: int | str) -> dict:
+    return {"data": {}, "entity": {"serial": [{"value": serial}]}}
+
+
+def _queue_items(serials: list[int | str], queue_references: set[str] | None = None) -> list[dict]:
+    form_run = queue_handler._create_form_run(FORM_ID)  # pylint: disable=protected-access
+    form_run.queued_serial_ranges = queue_handler.queued_serial_ranges(queue_references or set(), FORM_ID)
+
+    # Submissions are streamed newest first
+    for serial in sorted(serials, key=int, reverse=True):
+        row_watermark = {"form_submitted_date": "2025-01-31T12:00:00", "form_id": serial}
+        queue_handler._add_submission(form_run, _form(serial), row_watermark)  # pylint: disable=protected-access
+
+    return queue_handler._build_queue_items(form_run)  # pylint: disable=protected-access
+
+
+def _serials(items: list[dict]) -> list[int]:
+    return [
+        row["Serial number"] for item in items for row in payload_codec.decode_submissions(item["data"]["submissions"])
+    ]
+
+
+def _reference(low: int, high: int) -> str:
+    return f"{FORM_ID}_{queue_handler.TODAYS_DATE}_{low}-{high}"
+
+
+@pytest.fixture(autouse=True)
+def small_chunks(monkeypatch):
+    monkeypatch.setattr(config, "WORK_ITEM_MAX_SUBMISSIONS", 10)
+    monkeypatch.setattr(config, "WORK_ITEM_MAX_BYTES", 1_000_000)
+
+
+def test_chunks_are_bounded_by_submissions():
+    chunks = queue_handler.chunk_submissions([{"Serial number": serial} for serial in range(25)])
+
+    assert [len(chunk) for chunk in chunks] == [10, 10, 5]
+
+
+def test_chunks_are_bounded_by_bytes(monkeypatch):
+    monkeypatch.setattr(config, "WORK_ITEM_MAX_BYTES", 150)
+
+    chunks = queue_handler.chunk_submissions([{"Serial number": serial, "Svar": "x" * 40} for serial in range(5)])
+
+    assert [len(chunk) for chunk in chunks] == [2, 2, 1]
+
+
+def test_new_submissions_are_split_into_items_per_serial_range():
+    items = _queue_items(list(range(1, 26)))
+
+    assert [item["reference"] for item in items] == [_reference(16, 25), _reference(6, 15), _reference(1, 5)]
+    assert [item["data"]["config"]["chunk"] for item in items] == [
+        {"index": 0, "count": 3},
+        {"index": 1, "count": 3},
+        {"index": 2, "count": 3},
+    ]
+
+
+def test_failed_middle_chunk_is_queued_again_the_same_day():
+    # The first run added the chunks 16-25 and 1-5, while adding 6-15 failed
+    queue_references = {_reference(16, 25), _reference(1, 5)}
+
+    items = _queue_items(list(range(1, 26)), queue_references)
+
+    assert [item["reference"] for item in items] == [_reference(6, 15)]
+    assert sorted(_serials(items)) == list(range(6, 16))
+
+
+def test_submissions_arriving_after_a_partial_run_are_queued_with_the_rest():
+    queue_references = {_reference(16, 25), _reference(1, 5)}
+
+    items = _queue_items(list(range(1, 31)), queue_references)
+
+    assert sorted(_serials(items)) == [*range(6, 16), *range(26, 31)]
+
+
+def test_everything_queued_today_queues_nothing():
+    queue_references = {_reference(16, 25), _reference(6, 15), _reference(1, 5)}
+
+    assert not _queue_items(list(range(1, 26)), queue_references)
+
+
+def test_unchunked_reference_covers_the_whole_day():
+    queue_references = {f"{FORM_ID}_{queue_handler.TODAYS_DATE}"}
+
+    assert not _queue_items(list(range(1, 26)), queue_references)
+
+
+def test_references_of_other_days_and_forms_are_ignored():
+    queue_references = {f"{FORM_ID}_2000-01-01_1-25", f"another_form_{queue_handler.TODAYS_DATE}_1-25"}
+
+    assert len(_queue_items(list(range(1, 26)), queue_references)) == 3
+
+
+def test_text_serials_get_a_numeric_range():
+    serials = [str(serial) for serial in range(1, 26)]
+
+    items = _queue_items(serials)
+
+    assert [item["reference"] for item in items] == [_reference(16, 25), _reference(6, 15), _reference(1, 5)]
+
+
+def test_text_serials_queued_today_are_not_queued_again():
+    serials = [str(serial) for serial in range(1, 26)]
+    queue_references = {item["reference"] for item in _queue_items(serials)}
+
+    assert not _queue_items(serials, queue_references)
+
+
+def test_unwritten_serial_floor_is_the_lowest_unwritten_chunk():
+    references = {_reference(1, 10), _reference(11, 20), _reference(21, 30), f"{FORM_ID}_2025-01-30_31-40"}
+    written = set(range(1, 11)) | set(range(21, 41))
+
+    assert queue_handler.unwritten_serial_floor(references, FORM_ID, written) == 11
+    assert queue_handler.unwritten_serial_floor(references, FORM_ID, set(range(1, 41))) == math.inf
+
+
+def test_unwritten_serial_floor_accepts_serials_as_text():
+    written = {str(serial) for serial in range(1, 21)}
+
+    assert queue_handler.unwritten_serial_floor({_reference(1, 20)}, FORM_ID, written) == math.inf
+
+
+def test_unchunked_reference_disables_early_stop():
+    references = {_reference(1, 10), f"{FORM_ID}_{queue_handler.TODAYS_DATE}", "other_form_2025-01-30_1-5"}
+
+    assert queue_handler.unwritten_serial_floor(references, FORM_ID, set(range(1, 11))) == -math.inf
+    assert queue_handler.unwritten_serial_floor({"other_form_2025-01-30_1-5"}, FORM_ID, set()) == math.inf
@@ -0,0 +1,40 @@
+"""Tests for the lazily resolved secrets and constants"""
+
+import time
+
+import pytest
+
+from helpers import config, secrets_provider
+
+
+@pytest.fixture
+def disk_cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "SECRETS_DISK_CACHE", True)
+    monkeypatch.setattr(config, "SECRETS_DISK_CACHE_FILE", str(tmp_path / "secrets.bin"))
+    monkeypatch.setenv("OPENORCHESTRATORKEY", "test key")
+
+    secrets_provider.clear()
+    yield tmp_path
+    secrets_provider.clear()
+
+
+def _fetch_constants(keys):
+    for kind, name in keys:
+        secrets_provider._CACHE[secrets_provider._cache_key(kind, name)] = (  # pylint: disable=protected-access
+            time.time() + 60,
+            {"constant_name": name, "value": f"value of {name}"},
+        )
+
+
+def test_cold_start_reads_the_disk_cache(disk_cache, monkeypatch):
+    monkeypatch.setattr(secrets_provider, "_fetch", _fetch_constants)
+    secrets_provider.get_constants("a", "b")
+
+    def fetch_fails(keys):
+        raise AssertionError(f"fetched {keys} although they are cached on disk")
+
+    secrets_provider._CACHE.clear()  # pylint: disable=protected-access
+    monkeypatch.setattr(secrets_provider, "_fetch", fetch_fails)
+
+    assert secrets_provider.get_constant("b") == {"constant_name": "b", "value": "value of b"}
+    assert [path.name for path in disk_cache.iterdir()] == ["secrets.bin"]
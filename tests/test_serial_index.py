@@ -0,0 +1,170 @@
+"""Tests for the local index of the serial numbers in each workbook"""
+
+from io import BytesIO
+
+import pytest
+
+from openpyxl import Workbook
+
+from helpers import config, serial_index, sharepoint_rest
+
+FOLDER_NAME = "Besvarelser"
+EXCEL_FILE_NAME = "form.xlsx"
+SHEET_NAME = "Besvarelser"
+
+
+def _workbook_bytes(serials: list) -> bytes:
+    workbook = Workbook()
+    worksheet = workbook.active
+    worksheet.title = SHEET_NAME
+    worksheet.append(["Navn", serial_index.SERIAL_NUMBER_COLUMN])
+
+    for serial in serials:
+        worksheet.append([f"Svar {serial}", serial])
+
+    stream = BytesIO()
+    workbook.save(stream)
+
+    return stream.getvalue()
+
+
+class FakeSharepoint:
+    """Stand-in for a client, serving one workbook and counting its downloads"""
+
+    site_name = "site"
+
+    def __init__(self, serials: list, etag: str):
+        self.excel_file = _workbook_bytes(serials)
+        self.etag = etag
+        self.downloads = 0
+
+    def fetch_file_using_open_binary(self, file_name, folder_name):
+        self.downloads += 1
+
+        return self.excel_file
+
+
+@pytest.fixture(autouse=True)
+def index_dir(state_dir, monkeypatch):
+    monkeypatch.setattr(config, "SERIAL_INDEX_DIR", str(state_dir / "serial_index"))
+
+
+def _list_files(monkeypatch, sharepoint_api: FakeSharepoint):
+    monkeypatch.setattr(
+        sharepoint_rest,
+        "list_files",
+        lambda api, folder_name: [{"Name": EXCEL_FILE_NAME, "ETag": sharepoint_api.etag}],
+    )
+
+
+def _load(sharepoint_api: FakeSharepoint, etag: str | None) -> set:
+    return serial_index.load_serials(sharepoint_api, FOLDER_NAME, EXCEL_FILE_NAME, SHEET_NAME, etag)
+
+
+def test_index_is_reused_while_the_etag_matches():
+    sharepoint_api = FakeSharepoint([1, 2, 3.0], etag="v1")
+
+    assert _load(sharepoint_api, "v1") == {1, 2, 3}
+    assert _load(sharepoint_api, "v1") == {1, 2, 3}
+    assert sharepoint_api.downloads == 1
+
+
+def test_index_is_rebuilt_when_the_etag_is_stale():
+    sharepoint_api = FakeSharepoint([1, 2, 3], etag="v1")
+    _load(sharepoint_api, "v1")
+
+    sharepoint_api.excel_file = _workbook_bytes([1, 2, 3, 4])
+
+    assert _load(sharepoint_api, "v2") == {1, 2, 3, 4}
+    assert sharepoint_api.downloads == 2
+
+
+def test_index_without_etag_is_never_reused():
+    sharepoint_api = FakeSharepoint([1, 2], etag="v1")
+
+    _load(sharepoint_api, None)
+    _load(sharepoint_api, None)
+
+    assert sharepoint_api.downloads == 2
+
+
+def test_added_serials_are_stamped_when_the_index_was_current(monkeypatch):
+    sharepoint_api = FakeSharepoint([1, 2], etag="v1")
+    _load(sharepoint_api, "v1")
+
+    sharepoint_api.etag = "v2"
+    _list_files(monkeypatch, sharepoint_api)
+    serial_index.add_serials(sharepoint_api, FOLDER_NAME, EXCEL_FILE_NAME, serials=[3], previous_etag="v1")
+
+    assert _load(sharepoint_api, "v2") == {1, 2, 3}
+    assert sharepoint_api.downloads == 1
+
+
+def test_added_serials_are_not_stamped_when_the_index_was_stale(monkeypatch):
+    sharepoint_api = FakeSharepoint([1, 2], etag="v1")
+    _load(sharepoint_api, "v1")
+
+    # Another run wrote the workbook since the index was built
+    sharepoint_api.etag = "v3"
+    _list_files(monkeypatch, sharepoint_api)
+    serial_index.add_serials(sharepoint_api, FOLDER_NAME, EXCEL_FILE_NAME, serials=[3], previous_etag="v2")
+
+    _load(sharepoint_api, "v3")
+
+    assert sharepoint_api.downloads == 2
+
+
+def test_unchanged_etag_after_a_write_is_not_stamped(monkeypatch):
+    sharepoint_api = FakeSharepoint([1, 2], etag="v1")
+    _load(sharepoint_api, "v1")
+
+    _list_files(monkeypatch, sharepoint_api)
+    serial_index.add_serials(sharepoint_api, FOLDER_NAME, EXCEL_FILE_NAME, serials=[3], previous_etag="v1")
+
+    _load(sharepoint_api, "v1")
+
+    assert sharepoint_api.downloads == 2
+
+
+def test_new_workbook_replaces_the_index(monkeypatch):
+    sharepoint_api = FakeSharepoint([1, 2], etag="v1")
+    _load(sharepoint_api, "v1")
+
+    sharepoint_api.etag = "v2"
+    _list_files(monkeypatch, sharepoint_api)
+    serial_index.add_serials(
+        sharepoint_api, FOLDER_NAME, EXCEL_FILE_NAME, serials=[7], previous_etag=None, new_workbook=True
+    )
+
+    assert _load(sharepoint_api, "v2") == {7}
+
+
+def test_missing_workbook_has_no_etag(monkeypatch):
+    monkeypatch.setattr(sharepoint_rest, "list_files", lambda api, folder_name: [{"Name": "other.xlsx", "ETag": "v1"}])
+
+    assert serial_index.workbook_etag(FakeSharepoint([], etag="v1"), FOLDER_NAME, EXCEL_FILE_NAME) is None
+
+
+def test_failed_etag_lookup_is_raised(monkeypatch):
+    def list_files(api, folder_name):
+        raise ConnectionError("SharePoint is unavailable")
+
+    monkeypatch.setattr(sharepoint_rest, "list_files", list_files)
+
+    with pytest.raises(ConnectionError):
+        serial_index.workbook_etag(FakeSharepoint([], etag="v1"), FOLDER_NAME, EXCEL_FILE_NAME)
+
+
+def test_failed_etag_lookup_after_a_write_leaves_the_index_invalid(monkeypatch):
+    sharepoint_api = FakeSharepoint([1, 2], etag="v1")
+    _load(sharepoint_api, "v1")
+
+    def list_files(api, folder_name):
+        raise ConnectionError("SharePoint is unavailable")
+
+    monkeypatch.setattr(sharepoint_rest, "list_files", list_files)
+    serial_index.add_serials(sharepoint_api, FOLDER_NAME, EXCEL_FILE_NAME, serials=[3], previous_etag="v1")
+
+    _load(sharepoint_api, "v1")
+
+    assert sharepoint_api.downloads == 2
@@ -0,0 +1,75 @@
+"""Tests for the local cache of SharePoint file contents"""
+
+from types import SimpleNamespace
+
+import pytest
+
+from helpers import config, sharepoint_cache, sharepoint_rest
+
+CONTENT = b"Serial number;CPR\n1;0101011234\n"
+
+
+@pytest.fixture
+def cache_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "SHAREPOINT_CACHE_DIR", str(tmp_path))
+    monkeypatch.setenv("OPENORCHESTRATORKEY", "test key")
+
+    return tmp_path
+
+
+@pytest.fixture
+def downloads(monkeypatch):
+    """Record the conditional downloads, answering 304 when the cached eTag is current."""
+
+    calls = []
+
+    def download_file(sharepoint_api, folder_name, file_name, if_none_match=None):  # pylint: disable=unused-argument
+        calls.append(if_none_match)
+
+        if if_none_match == '"1"':
+            return None, if_none_match
+
+        return CONTENT, '"1"'
+
+    monkeypatch.setattr(sharepoint_rest, "download_file", download_file)
+
+    return calls
+
+
+SHAREPOINT_API = SimpleNamespace(site_name="site")
+
+
+def test_contents_are_encrypted_at_rest(cache_dir, downloads):
+    sharepoint_cache.store(SHAREPOINT_API, "folder", "workbook.xlsx", CONTENT, '"1"')
+
+    content_files = list(cache_dir.glob("*.bin"))
+
+    assert len(content_files) == 1
+    assert b"0101011234" not in content_files[0].read_bytes()
+    assert sharepoint_cache.fetch_file(SHAREPOINT_API, "folder", "workbook.xlsx") == CONTENT
+    assert downloads == ['"1"']
+
+
+def test_nothing_is_cached_without_the_key(cache_dir, downloads, monkeypatch):
+    monkeypatch.delenv("OPENORCHESTRATORKEY")
+
+    assert sharepoint_cache.fetch_file(SHAREPOINT_API, "folder", "workbook.xlsx") == CONTENT
+    assert sharepoint_cache.fetch_file(SHAREPOINT_API, "folder", "workbook.xlsx") == CONTENT
+    assert downloads == [None, None]
+    assert not list(cache_dir.iterdir())
+
+
+def test_unreadable_entry_is_downloaded_again(cache_dir, downloads, monkeypatch):
+    sharepoint_cache.store(SHAREPOINT_API, "folder", "workbook.xlsx", CONTENT, '"1"')
+    monkeypatch.setenv("OPENORCHESTRATORKEY", "another key")
+
+    assert sharepoint_cache.fetch_file(SHAREPOINT_API, "folder", "workbook.xlsx") == CONTENT
+    assert downloads == ['"1"', None]
+
+
+def test_no_temp_files_are_left_behind(cache_dir, downloads):  # pylint: disable=unused-argument
+    for name in ("a.xlsx", "b.xlsx"):
+        sharepoint_cache.store(SHAREPOINT_API, "folder", name, CONTENT, '"1"')
+
+    assert not list(cache_dir.glob("*.tmp"))
+    assert len(list(cache_dir.glob("*.bin"))) == 2
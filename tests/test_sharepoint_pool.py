@@ -0,0 +1,128 @@
+"""Tests for the pool of SharePoint clients"""
+
+import threading
+
+import pytest
+
+from helpers import config, sharepoint_pool
+
+SHAREPOINT_KWARGS = {"tenant": "tenant", "client_id": "app", "thumbprint": "", "cert_path": ""}
+
+
+class FakeSharepoint:
+    """Stand-in for CachedSharepoint, counting the clients created"""
+
+    created = 0
+    authenticates = True
+
+    def __init__(self, **kwargs):
+        FakeSharepoint.created += 1
+
+        self.site_name = kwargs["site_name"]
+        self.ctx = object() if FakeSharepoint.authenticates else None
+
+
+@pytest.fixture(autouse=True)
+def fake_clients(monkeypatch):
+    monkeypatch.setattr(sharepoint_pool, "CachedSharepoint", FakeSharepoint)
+    monkeypatch.setattr(FakeSharepoint, "created", 0)
+    monkeypatch.setattr(FakeSharepoint, "authenticates", True)
+
+    sharepoint_pool.clear()
+    yield
+    sharepoint_pool.clear()
+
+
+def _checkout(site_name: str = "site"):
+    return sharepoint_pool.checkout_client(SHAREPOINT_KWARGS, "https://sharepoint", site_name, "Dokumenter")
+
+
+def test_returned_client_is_reused():
+    client = _checkout()
+    sharepoint_pool.return_client(client)
+
+    assert _checkout() is client
+    assert FakeSharepoint.created == 1
+
+
+def test_leased_client_is_not_handed_out_again():
+    first = _checkout()
+    second = _checkout()
+
+    assert first is not second
+    assert FakeSharepoint.created == 2
+
+
+def test_concurrent_threads_on_one_site_never_share_a_client():
+    leased = set()
+    shared = []
+    lock = threading.Lock()
+    start = threading.Barrier(8)
+
+    def work():
+        start.wait()
+
+        for _ in range(50):
+            client = _checkout()
+
+            with lock:
+                if id(client) in leased:
+                    shared.append(client)
+
+                leased.add(id(client))
+
+            with lock:
+                leased.discard(id(client))
+
+            sharepoint_pool.return_client(client)
+
+    threads = [threading.Thread(target=work) for _ in range(8)]
+
+    for thread in threads:
+        thread.start()
+
+    for thread in threads:
+        thread.join()
+
+    assert not shared
+    assert FakeSharepoint.created <= 8
+
+
+def test_clients_are_kept_per_site():
+    client = _checkout("site")
+    sharepoint_pool.return_client(client)
+
+    assert _checkout("another site") is not client
+
+
+def test_expired_client_is_replaced(monkeypatch):
+    client = _checkout()
+    sharepoint_pool.return_client(client)
+
+    monkeypatch.setattr(config, "SHAREPOINT_CLIENT_MAX_AGE_SECONDS", 0)
+
+    assert _checkout() is not client
+
+
+def test_unauthenticated_client_is_not_pooled():
+    FakeSharepoint.authenticates = False
+
+    client = _checkout()
+    sharepoint_pool.return_client(client)
+
+    assert _checkout() is not client
+
+
+def test_pool_size_is_bounded(monkeypatch):
+    monkeypatch.setattr(config, "SHAREPOINT_POOL_MAX_CLIENTS", 2)
+
+    clients = [_checkout() for _ in range(3)]
+
+    for client in clients:
+        sharepoint_pool.return_client(client)
+
+    # The client returned first was evicted
+    assert {id(_checkout()), id(_checkout()), id(_checkout())} & {id(client) for client in clients} == {
+        id(clients[1]),
+        id(clients[2]),
+    }
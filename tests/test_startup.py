@@ -0,0 +1,26 @@
+"""Tests for the startup imports of each mode of main.py"""
+
+import pytest
+
+from helpers import config, import_profile
+
+
+@pytest.mark.parametrize("mode", list(config.IMPORT_TIME_BUDGET_SECONDS))
+def test_mode_imports_within_its_budget(mode):
+    seconds = import_profile.import_time(import_profile.profile_mode(mode))
+
+    assert seconds <= config.IMPORT_TIME_BUDGET_SECONDS[mode], f"{mode} imports in {seconds:.3f}s"
+
+
+@pytest.mark.parametrize("mode", list(config.DEFERRED_IMPORTS))
+def test_mode_does_not_load_deferred_modules(mode):
+    # Imported in a fresh interpreter, like a cold start of the mode
+    loaded = {name.strip() for name, _, _ in import_profile.profile_mode(mode)["modules"]}
+
+    assert not [module for module in config.DEFERRED_IMPORTS[mode] if module in loaded]
+
+
+def test_finalize_does_not_load_pandas_sqlalchemy_or_pil():
+    loaded = {name.strip() for name, _, _ in import_profile.profile_mode("--finalize")["modules"]}
+
+    assert not {"pandas", "sqlalchemy", "PIL"} & loaded
@@ -0,0 +1,92 @@
+"""Tests for streaming submissions from the journalizing view"""
+
+from helpers import config, helper_functions
+from helpers.watermark import make_watermark
+
+from tests.conftest import submitted_date
+
+
+def _read_serials(conn_string: str, **kwargs) -> list[int]:
+    return [
+        parsed["entity"]["serial"][0]["value"]
+        for parsed, _ in helper_functions.iter_forms_data(conn_string=conn_string, form_type="form", **kwargs)
+    ]
+
+
+def test_default_config_reads_every_submission(journalizing_db):
+    conn_string = journalizing_db("form", list(range(1, 11)))
+
+    serials = _read_serials(
+        conn_string,
+        known_serials=set(range(1, 11)),
+        stop_after_known=config.STOP_AFTER_KNOWN_SERIALS,
+    )
+
+    assert serials == [10, 9, 8, 7, 6, 5, 4, 3, 2, 1]
+
+
+def test_submissions_are_read_newest_first(journalizing_db):
+    conn_string = journalizing_db("form", list(range(1, 6)))
+
+    assert _read_serials(conn_string) == [5, 4, 3, 2, 1]
+
+
+def test_get_forms_data_returns_the_submissions(journalizing_db):
+    conn_string = journalizing_db("form", [1, 2], purged={1: True})
+
+    forms = helper_functions.get_forms_data(conn_string, "form")
+
+    assert isinstance(forms, list)
+    assert [form["entity"]["serial"][0]["value"] for form in forms] == [2]
+
+
+def test_early_stop_after_a_run_of_known_serials(journalizing_db):
+    conn_string = journalizing_db("form", list(range(1, 21)))
+
+    serials = _read_serials(conn_string, known_serials=set(range(1, 18)), stop_after_known=3)
+
+    assert serials == [20, 19, 18, 17, 16, 15]
+
+
+def test_unknown_serial_resets_the_run(journalizing_db):
+    conn_string = journalizing_db("form", list(range(1, 11)))
+
+    serials = _read_serials(conn_string, known_serials={10, 9, 7, 6, 5, 4}, stop_after_known=3)
+
+    assert serials == [10, 9, 8, 7, 6, 5]
+
+
+def test_early_stop_does_not_skip_a_failed_older_chunk(journalizing_db):
+    # Serials 1-10 were queued in chunks of two, and the chunk with serials 3-4 failed while the newer ones were written
+    conn_string = journalizing_db("form", list(range(1, 11)))
+
+    serials = _read_serials(
+        conn_string,
+        known_serials={1, 2, 5, 6, 7, 8, 9, 10},
+        stop_after_known=2,
+        stop_below_serial=3,
+    )
+
+    assert serials == [10, 9, 8, 7, 6, 5, 4, 3, 2, 1]
+
+
+def test_early_stop_counts_only_past_the_bound(journalizing_db):
+    conn_string = journalizing_db("form", list(range(1, 21)))
+
+    serials = _read_serials(conn_string, known_serials=set(range(1, 21)), stop_after_known=3, stop_below_serial=15)
+
+    assert serials == [20, 19, 18, 17, 16, 15, 14, 13, 12]
+
+
+def test_early_stop_is_independent_of_the_watermark(journalizing_db, monkeypatch):
+    monkeypatch.setattr(config, "WATERMARK_LOOKBACK_HOURS", 100)
+    conn_string = journalizing_db("form", list(range(1, 21)))
+
+    serials = _read_serials(
+        conn_string,
+        watermark=make_watermark(submitted_date(19), 19),
+        known_serials=set(range(1, 21)),
+        stop_after_known=5,
+    )
+
+    assert serials == [20, 19, 18, 17, 16]
@@ -0,0 +1,64 @@
+"""Tests for the incremental extraction watermarks"""
+
+from datetime import datetime
+
+from helpers import config, query_builder, watermark
+
+
+def test_incremental_extraction_is_off_by_default():
+    assert config.INCREMENTAL_EXTRACTION is False
+
+
+def test_marks_are_ignored_when_incremental_extraction_is_off(state_dir, monkeypatch):
+    monkeypatch.setattr(config, "INCREMENTAL_EXTRACTION", True)
+    watermark.stage_watermark("form", watermark.make_watermark(datetime(2025, 1, 31), 7))
+    watermark.commit_watermarks()
+
+    monkeypatch.setattr(config, "INCREMENTAL_EXTRACTION", False)
+
+    assert watermark.load_watermark("form") is None
+
+
+def test_missing_watermark_file_falls_back_to_a_full_read(state_dir, monkeypatch):
+    monkeypatch.setattr(config, "INCREMENTAL_EXTRACTION", True)
+
+    mark = watermark.load_watermark("form")
+    query, params = query_builder.build_forms_query(query_builder.SQLITE, {"form": mark})
+
+    assert mark is None
+    assert not (state_dir / "watermarks.json").exists()
+    assert "form_submitted_date >= ?" not in query
+    assert params == ["form", "form"]
+
+
+def test_unreadable_watermark_file_falls_back_to_a_full_read(state_dir, monkeypatch):
+    monkeypatch.setattr(config, "INCREMENTAL_EXTRACTION", True)
+    (state_dir / "watermarks.json").write_text("{not json", encoding="utf-8")
+
+    assert watermark.load_watermark("form") is None
+
+
+def test_committed_mark_is_read_incrementally(state_dir, monkeypatch):
+    monkeypatch.setattr(config, "INCREMENTAL_EXTRACTION", True)
+    monkeypatch.setattr(config, "WATERMARK_LOOKBACK_HOURS", 24)
+
+    watermark.stage_watermark("form", watermark.make_watermark(datetime(2025, 1, 31, 12), 7))
+    watermark.commit_watermarks()
+
+    mark = watermark.load_watermark("form")
+    query, params = query_builder.build_forms_query(query_builder.SQLITE, {"form": mark})
+
+    assert mark == {"form_submitted_date": "2025-01-31T12:00:00", "form_id": 7}
+    assert "form_submitted_date >= ?" in query
+    assert params[:2] == ["form", "form"] and len(params) == 3
+
+
+def test_committing_leaves_no_temp_files(state_dir, monkeypatch):
+    monkeypatch.setattr(config, "INCREMENTAL_EXTRACTION", True)
+
+    for form_id in (1, 2):
+        watermark.stage_watermark("form", watermark.make_watermark(datetime(2025, 1, 31), form_id))
+        watermark.commit_watermarks()
+
+    assert [path.name for path in state_dir.iterdir()] == ["watermarks.json"]
+    assert watermark.load_watermark("form")["form_id"] == 2
@@ -0,0 +1,59 @@
+"""Tests for looking up the existing workbook of each form when populating the queue"""
+
+import sys
+
+import pytest
+
+from helpers import payload_codec, sharepoint_pool, sharepoint_rest
+from helpers.config import WEBFORMS_CONFIG
+from processes import queue_handler
+
+FORM_ID = next(iter(WEBFORMS_CONFIG))
+
+SHAREPOINT_KWARGS = {"tenant": "tenant", "client_id": "app", "thumbprint": "", "cert_path": ""}
+
+
+class FakeSharepoint:
+    """Stand-in for a pooled client, which is only handed to the patched SharePoint calls"""
+
+    site_name = "site"
+
+
+@pytest.fixture(autouse=True)
+def form_submissions(journalizing_db, monkeypatch):
+    monkeypatch.setenv("DBCONNECTIONSTRINGPROD", journalizing_db(FORM_ID, list(range(1, 6))))
+    monkeypatch.setattr(sys, "argv", ["main.py", f"--{FORM_ID}"])
+    monkeypatch.setattr(sharepoint_pool, "checkout_client", lambda *args, **kwargs: FakeSharepoint())
+    monkeypatch.setattr(sharepoint_pool, "return_client", lambda client: None)
+
+
+def _queued_serials(items: list[dict]) -> list:
+    return sorted(
+        row["Serial number"] for item in items for row in payload_codec.decode_submissions(item["data"]["submissions"])
+    )
+
+
+def test_missing_workbook_queues_every_submission(monkeypatch):
+    monkeypatch.setattr(sharepoint_rest, "list_files", lambda sharepoint_api, folder_name: [])
+
+    items = queue_handler.retrieve_items_for_queue(SHAREPOINT_KWARGS)
+
+    assert _queued_serials(items) == [1, 2, 3, 4, 5]
+
+
+def test_failed_listing_skips_the_form(monkeypatch):
+    def list_files(sharepoint_api, folder_name):
+        raise ConnectionError("SharePoint is unavailable")
+
+    monkeypatch.setattr(sharepoint_rest, "list_files", list_files)
+
+    assert not queue_handler.retrieve_items_for_queue(SHAREPOINT_KWARGS)
+
+
+def test_failed_authentication_skips_the_form(monkeypatch):
+    def checkout_client(*args, **kwargs):
+        raise ConnectionError("Could not authenticate")
+
+    monkeypatch.setattr(sharepoint_pool, "checkout_client", checkout_client)
+
+    assert not queue_handler.retrieve_items_for_queue(SHAREPOINT_KWARGS)
@@ -0,0 +1,209 @@
+"""Tests for merging new rows into a workbook locally"""
+
+from io import BytesIO
+
+import pytest
+
+from openpyxl import Workbook, load_workbook
+
+from mbu_msoffice_integration.sharepoint_class import Sharepoint
+
+from helpers import config, sharepoint_cache, sharepoint_rest, workbook_merge
+
+SHEET_NAME = "Besvarelser"
+
+HEADERS = ["Serial number", "Navn", "Svar"]
+
+
+class InMemorySharepoint(Sharepoint):
+    """Stand-in for the Sharepoint class, keeping one workbook in memory"""
+
+    def __init__(self, content: bytes):  # pylint: disable=super-init-not-called
+        self.site_name = "site"
+        self.content = content
+
+    def fetch_file_using_open_binary(self, file_name, folder_name):
+        return self.content
+
+    def upload_file_from_bytes(self, binary_content, file_name, folder_name):
+        self.content = binary_content
+
+
+def _row(serial: int, answer: str = "Ja") -> dict:
+    return {"Serial number": serial, "Navn": f"Svar {serial}", "Svar": answer}
+
+
+def _worksheet(serials: list, empty_rows: int = 0):
+    workbook = Workbook()
+    worksheet = workbook.active
+    worksheet.title = SHEET_NAME
+    worksheet.append(HEADERS)
+
+    for serial in serials:
+        worksheet.append([serial, f"Svar {serial}", "Ja"])
+
+    for row_index in range(len(serials) + 2, len(serials) + 2 + empty_rows):
+        worksheet.cell(row=row_index, column=1).value = None
+
+    return worksheet
+
+
+def _serials(worksheet) -> list:
+    return [serial for (serial,) in worksheet.iter_rows(min_row=2, max_col=1, values_only=True)]
+
+
+def _workbook_bytes(worksheet) -> bytes:
+    stream = BytesIO()
+    worksheet.parent.save(stream)
+
+    return stream.getvalue()
+
+
+def test_new_rows_are_merged_into_a_sorted_sheet():
+    worksheet = _worksheet([9, 5, 1])
+
+    workbook_merge.merge_rows(worksheet, [_row(3), _row(10), _row(7)])
+
+    assert _serials(worksheet) == [10, 9, 7, 5, 3, 1]
+    assert worksheet.cell(row=4, column=2).value == "Svar 7"
+
+
+def test_unsorted_sheet_is_sorted_with_the_new_rows():
+    worksheet = _worksheet([1, 9, 5])
+
+    workbook_merge.merge_rows(worksheet, [_row(3), _row(7)])
+
+    assert _serials(worksheet) == [9, 7, 5, 3, 1]
+    assert [worksheet.cell(row=row_index, column=2).value for row_index in range(2, 7)] == [
+        "Svar 9", "Svar 7", "Svar 5", "Svar 3", "Svar 1",
+    ]
+
+
+def test_empty_rows_are_dropped():
+    worksheet = _worksheet([9, 5], empty_rows=2)
+
+    assert worksheet.max_row == 5
+
+    workbook_merge.merge_rows(worksheet, [_row(7)])
+
+    assert _serials(worksheet) == [9, 7, 5]
+    assert worksheet.max_row == 4
+
+
+def test_missing_values_are_written_as_empty_strings():
+    worksheet = _worksheet([1])
+
+    workbook_merge.merge_rows(worksheet, [{"Serial number": 2}])
+
+    assert [cell.value for cell in worksheet[2]] == [2, "", ""]
+
+
+def test_long_value_wraps_its_column_and_rewraps_the_rows():
+    worksheet = _worksheet([2, 1])
+    workbook_merge.merge_rows(worksheet, [])
+
+    assert not worksheet.cell(row=2, column=3).alignment.wrap_text
+
+    long_answer = "x" * 300
+    workbook_merge.merge_rows(worksheet, [_row(3, long_answer)])
+
+    assert worksheet.column_dimensions["C"].width == workbook_merge.WORKBOOK_FORMAT["column_widths"]
+    assert all(worksheet.cell(row=row_index, column=3).alignment.wrap_text for row_index in range(1, 5))
+    assert worksheet.row_dimensions[2].height == 3 * workbook_merge.ROW_HEIGHT_PER_LINE
+    assert worksheet.row_dimensions[3].height == workbook_merge.ROW_HEIGHT_PER_LINE
+
+
+def test_column_widths_grow_with_the_new_values():
+    worksheet = _worksheet([1])
+    workbook_merge.merge_rows(worksheet, [])
+
+    column_widths, wrapped_columns, rewrap = workbook_merge._update_column_widths(  # pylint: disable=protected-access
+        worksheet, HEADERS, [[2, "A much longer name", "Ja"]], is_new_sheet=False
+    )
+
+    assert column_widths[2] == len("A much longer name") + 2
+    assert not wrapped_columns and not rewrap
+
+
+def test_row_height_counts_the_lines_of_wrapped_columns():
+    values = [1, "x" * 500, "first line\nsecond line"]
+
+    row_height = workbook_merge._row_height(values, {2: 100, 3: 100}, {2, 3})  # pylint: disable=protected-access
+
+    assert row_height == 5 * workbook_merge.ROW_HEIGHT_PER_LINE
+    assert workbook_merge._row_height(values, {2: 100}, set()) == workbook_merge.ROW_HEIGHT_PER_LINE  # pylint: disable=protected-access
+
+
+def test_changed_workbook_is_merged_again(monkeypatch):
+    versions = iter([(_workbook_bytes(_worksheet([5, 1])), "v1"), (_workbook_bytes(_worksheet([6, 5, 1])), "v2")])
+    uploads = []
+
+    def replace_file(sharepoint_api, folder_name, file_name, content, if_match):
+        uploads.append((load_workbook(BytesIO(bytes(content)))[SHEET_NAME], if_match))
+
+        if if_match == "v1":
+            raise sharepoint_rest.FileChangedError("changed")
+
+        return "v3"
+
+    monkeypatch.setattr(sharepoint_cache, "fetch_file_with_etag", lambda *args: next(versions))
+    monkeypatch.setattr(sharepoint_cache, "store", lambda *args: None)
+    monkeypatch.setattr(sharepoint_rest, "replace_file", replace_file)
+
+    workbook_merge.merge_into_workbook(InMemorySharepoint(b""), "Besvarelser", "form.xlsx", SHEET_NAME, [_row(3)])
+
+    assert [if_match for _, if_match in uploads] == ["v1", "v2"]
+    assert _serials(uploads[-1][0]) == [6, 5, 3, 1]
+
+
+def test_merge_gives_up_after_the_configured_retries(monkeypatch):
+    content = _workbook_bytes(_worksheet([1]))
+
+    def replace_file(*args, **kwargs):
+        raise sharepoint_rest.FileChangedError("changed")
+
+    monkeypatch.setattr(config, "EXCEL_MERGE_MAX_RETRIES", 2)
+    monkeypatch.setattr(sharepoint_cache, "fetch_file_with_etag", lambda *args: (content, "v1"))
+    monkeypatch.setattr(sharepoint_rest, "replace_file", replace_file)
+
+    with pytest.raises(sharepoint_rest.FileChangedError):
+        workbook_merge.merge_into_workbook(InMemorySharepoint(b""), "Besvarelser", "form.xlsx", SHEET_NAME, [_row(3)])
+
+
+def _cells(worksheet) -> list:
+    return [
+        (cell.value, bool(cell.font.bold), bool(cell.alignment.wrap_text), cell.alignment.horizontal)
+        for row in worksheet.iter_rows()
+        for cell in row
+    ]
+
+
+def _layout(worksheet) -> tuple:
+    widths = [worksheet.column_dimensions[letter].width for letter in "ABC"]
+    heights = [worksheet.row_dimensions[row_index].height for row_index in range(1, worksheet.max_row + 1)]
+
+    return widths, heights, worksheet.freeze_panes
+
+
+@pytest.mark.parametrize("new_answer", ["Nej", "y" * 250])
+def test_merge_matches_append_and_format_and_sort(new_answer):
+    # The workbook as the append path leaves it, before the new rows
+    sharepoint_api = InMemorySharepoint(_workbook_bytes(_worksheet([8, 2, 5], empty_rows=1)))
+    sharepoint_api.format_and_sort_excel_file("", "form.xlsx", SHEET_NAME, **workbook_merge.WORKBOOK_FORMAT)
+
+    merged = load_workbook(BytesIO(sharepoint_api.content))[SHEET_NAME]
+
+    new_rows = [_row(9, new_answer), _row(4), _row(1)]
+
+    sharepoint_api.append_row_to_sharepoint_excel(
+        folder_name="", excel_file_name="form.xlsx", sheet_name=SHEET_NAME, new_rows=new_rows
+    )
+    sharepoint_api.format_and_sort_excel_file("", "form.xlsx", SHEET_NAME, **workbook_merge.WORKBOOK_FORMAT)
+    appended = load_workbook(BytesIO(sharepoint_api.content))[SHEET_NAME]
+
+    workbook_merge.merge_rows(merged, new_rows)
+    merged = load_workbook(BytesIO(_workbook_bytes(merged)))[SHEET_NAME]
+
+    assert _serials(merged) == [9, 8, 5, 4, 2, 1]
+    assert _cells(merged) == _cells(appended)
+    assert _layout(merged) == _layout(appended)